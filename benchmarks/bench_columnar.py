@@ -0,0 +1,76 @@
+# bench_columnar.py
+r'''
+Allocations made by the token representations for a large source:
+one object per token (the original Token class), the interned token
+list and the columnar TokenBuffer. Also times a full parse with each
+TokenStream backend.
+
+    python -m benchmarks.bench_columnar [size_in_MB]
+'''
+
+import io
+import os
+import sys
+import time
+import tracemalloc
+import contextlib
+
+from latextree import settings
+from latextree.parser.parser import Parser
+from latextree.parser.tokens import tokenize, TokenBuffer
+
+from .bench_tokenize import load_source
+from .bench_token_memory import legacy_tokenize
+
+
+def measure(func, s):
+    tracemalloc.start()
+    result = func(s)
+    snapshot = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    stats = snapshot.statistics('filename')
+    blocks = sum([stat.count for stat in stats])
+    size = sum([stat.size for stat in stats])
+    return blocks, size
+
+
+def load_document(size):
+    '''
+    The body of main_all.tex repeated to roughly the given size.
+    '''
+    tex_file = os.path.join(settings.LATEX_ROOT, 'test_article', 'main_all.tex')
+    with open(tex_file) as f:
+        s = f.read()
+    start = s.index(r'\begin{document}') + len(r'\begin{document}')
+    end = s.index(r'\end{document}')
+    body = s[start:end]
+    return s[:start] + body * (1 + size // len(s)) + s[end:]
+
+
+def parse(s, columnar):
+    with contextlib.redirect_stdout(io.StringIO()):
+        parser = Parser(columnar=columnar)
+        t0 = time.perf_counter()
+        parser.parse(s)
+        return time.perf_counter() - t0
+
+
+def main():
+    size = int(float(sys.argv[1]) * 2**20) if len(sys.argv) > 1 else 2**20
+    s = load_source(size)
+    print('source: {:.2f} MB'.format(len(s) / 2**20))
+
+    for func in [legacy_tokenize, tokenize, TokenBuffer]:
+        blocks, size = measure(func, s)
+        print('{:16}{:10} blocks {:10.2f} MB'.format(
+            func.__name__, blocks, size / 2**20))
+
+    # parse
+    s = load_document(2**18)
+    for columnar in [False, True]:
+        t = parse(s, columnar)
+        print('parse columnar={:6}{:8.3f}s'.format(str(columnar), t))
+
+
+if __name__ == '__main__':
+    main()
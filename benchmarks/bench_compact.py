@@ -0,0 +1,103 @@
+# bench_compact.py
+r'''
+Compact (struct-of-arrays) trees: memory per node of the Node tree
+against the CompactTree for the test article repeated to roughly the
+given size (default 1MB, about 200k nodes), and the time for counting
+species, finding phenotypes and the depth histogram with recursive
+calls over the nodes against array operations.
+
+    python -m benchmarks.bench_compact [size_in_KB]
+'''
+
+import io
+import sys
+import time
+import tracemalloc
+import contextlib
+from collections import Counter
+
+from latextree.tree import LatexTree
+from latextree.parser.parser import Parser
+from latextree.parser.compact import CompactTree
+
+from .bench_columnar import load_document
+
+
+def traced(func, *args):
+    '''
+    Result of func(*args) and the memory it holds.
+    '''
+    tracemalloc.start()
+    result = func(*args)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, size
+
+
+def timed(func, *args):
+    t0 = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - t0
+
+
+def node_species_counts(node, counts):
+    counts[node.species] += 1
+    for arg in getattr(node, 'args', {}).values():
+        if arg:
+            node_species_counts(arg, counts)
+    for child in node.children:
+        node_species_counts(child, counts)
+    return counts
+
+
+def node_depth_histogram(node, depth, counts):
+    counts[depth] += 1
+    for arg in getattr(node, 'args', {}).values():
+        if arg:
+            node_depth_histogram(arg, depth + 1, counts)
+    for child in node.children:
+        node_depth_histogram(child, depth + 1, counts)
+    return counts
+
+
+def main():
+    size = int(float(sys.argv[1]) * 2**10) if len(sys.argv) > 1 else 2**20
+    s = load_document(size)
+    with contextlib.redirect_stdout(io.StringIO()):
+        tree = LatexTree()
+        Parser().parse(s)   # warm up (caches)
+
+        # memory: the tree outlives the parser (and tokens)
+        root, node_size = traced(lambda: Parser().parse(s))
+    tree.root = root
+    tree.to_compact()   # reading the attributes creates the empty __dict__ of commands
+    compact, compact_size = traced(tree.to_compact)
+    n = len(compact)
+    print('source: {:.0f} KB   nodes: {}'.format(len(s) / 2**10, n))
+    print('{:24}{:>10.1f} MB {:>8.0f} B/node'.format('Node tree', node_size / 2**20, node_size / n))
+    print('{:24}{:>10.1f} MB {:>8.0f} B/node'.format('CompactTree', compact_size / 2**20, compact_size / n))
+    print('{:24}{:>10.1f} MB {:>8.0f} B/node'.format('  arrays and text', compact.nbytes() / 2**20, compact.nbytes() / n))
+
+    # traversals
+    limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(max(limit, 10000))
+    rows = [
+        ('species counts', lambda: node_species_counts(root, Counter()), compact.species_counts),
+        ('get_phenotypes(Text)', lambda: tree.get_phenotypes('Text'), lambda: compact.find('Text')),
+        ('depth histogram', lambda: node_depth_histogram(root, 0, Counter()), compact.depth_histogram),
+    ]
+    print('{:24}{:>12}{:>12}'.format('', 'nodes', 'compact'))
+    for name, on_nodes, on_compact in rows:
+        _, t0 = timed(on_nodes)
+        _, t1 = timed(on_compact)
+        print('{:24}{:>10.1f}ms{:>10.1f}ms'.format(name, t0 * 1e3, t1 * 1e3))
+    sys.setrecursionlimit(limit)
+
+    _, t = timed(tree.to_compact)
+    print('to_compact: {:.0f}ms'.format(t * 1e3))
+    _, t = timed(compact.to_node)
+    print('to_node:    {:.0f}ms'.format(t * 1e3))
+
+
+if __name__ == '__main__':
+    main()
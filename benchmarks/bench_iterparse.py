@@ -0,0 +1,52 @@
+# bench_iterparse.py
+r'''
+Peak memory and time for a document of n sections (default 2000): 
+Parser.parse (the whole tree) against Parser.iterparse (events).
+
+    python -m benchmarks.bench_iterparse [n]
+'''
+
+import io
+import sys
+import time
+import tracemalloc
+import contextlib
+
+from latextree.parser.parser import Parser
+
+SECTION = r'''\section{Section} Some text with \textbf{bold} and $x^2$.
+\begin{itemize}\item one \item two\end{itemize}
+
+'''
+
+
+def parse_tree(s):
+    return Parser().parse(s)
+
+
+def parse_events(s):
+    return sum(1 for event in Parser().iterparse(s))
+
+
+def measure(func, s):
+    with contextlib.redirect_stdout(io.StringIO()):
+        tracemalloc.start()
+        t0 = time.perf_counter()
+        func(s)
+        t = time.perf_counter() - t0
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return peak, t
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    s = r'\begin{document}' + SECTION * n + r'\end{document}'
+    print('source: {:.0f} KB'.format(len(s) / 2**10))
+    for func in [parse_tree, parse_events]:
+        peak, t = measure(func, s)
+        print('{:16}{:10.2f} MB peak {:8.3f}s'.format(func.__name__, peak / 2**20, t))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+# bench_macros.py
+r'''
+Expansion of user-defined commands and environments: a preamble
+defines a few macros with long definitions and the body uses them
+n times each (default 2000). Also the time per definition for a
+style file of long definitions, and the time for reading a long
+definition body without expansion (parse_group with noexpand=True).
+
+    python -m benchmarks.bench_macros [n]
+'''
+
+import io
+import sys
+import time
+import contextlib
+
+from latextree.parser.parser import Parser
+
+from .bench_parse import bench
+
+PREAMBLE = r'''
+\newcommand{\hello}[1]{Hello #1, this is a fairly long macro definition which is repeated on every use.}
+\newcommand{\pair}[2]{\textbf{#1} and \textit{#2} (and #1 again)}
+\newenvironment{note}[1]{\textbf{Note on #1:} the opening text of the environment}{the closing text}
+'''
+
+BODY = r'''\hello{world} \pair{one}{two}
+\begin{note}{macros} inside \end{note}
+'''
+
+
+def bench_expand(repeat=10000):
+    r'''
+    Time per expansion of \pair{one}{two} (template and arguments to tokens).
+    '''
+    with contextlib.redirect_stdout(io.StringIO()):
+        parser = Parser()
+        root = parser.parse(PREAMBLE + BODY)
+    cmd = next(node for node in root.children if node.species == 'pair')
+    args = list(cmd.args.values())
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        parser.expand_template(parser.custom_template('pair'), args)
+    return (time.perf_counter() - t0) / repeat
+
+
+DEFINITION = r'''\newcommand{\box%(k)s}[2]{%%
+  \begin{center}{\bf #1} \\ {\small\it #2 \{see below\}}
+  \begin{tabular}{ll} a & b \\ {c} & {{d}} \end{tabular}
+  %% comment with a brace {
+  \end{center}}
+'''
+
+
+def bench_define(n=500):
+    r'''
+    Time per \newcommand for a style file of n long definitions.
+    '''
+    s = ''.join(DEFINITION % {'k': chr(ord('a') + k % 26) * (1 + k // 26)} for k in range(n))
+    with contextlib.redirect_stdout(io.StringIO()):
+        t0 = time.perf_counter()
+        Parser().parse(s)
+    return (time.perf_counter() - t0) / n
+
+
+def bench_group(n=40, repeat=200):
+    '''
+    Time per noexpand group for a body of n definitions.
+    '''
+    body = '{' + ''.join(DEFINITION % {'k': 'x'} for _ in range(n)) + '}'
+    parser = Parser()
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        parser.run(parser.parse_group(parser.tokenize(body), noexpand=True))
+    return len(body), (time.perf_counter() - t0) / repeat
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    s = PREAMBLE + BODY * n
+    t = bench(s)
+    print('uses: {}   parse: {:.3f}s   {:.0f} uses/s'.format(3 * n, t, 3 * n / t))
+    print('expand \\pair: {:.1f}us'.format(bench_expand() * 1e6))
+    print('define \\newcommand: {:.1f}us'.format(bench_define() * 1e6))
+    size, t = bench_group()
+    print('noexpand group ({} chars): {:.1f}us'.format(size, t * 1e6))
+
+
+if __name__ == '__main__':
+    main()
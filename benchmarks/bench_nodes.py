@@ -0,0 +1,147 @@
+# bench_nodes.py
+r'''
+Memory and creation time per node: the original Node classes (taxonomy
+and attributes in the instance __dict__, a debug message per node)
+against the slotted classes with class-level taxonomy. Text, Group,
+Command (a species created by ClassFactory) and Environment nodes are
+created n at a time (default 100000).
+
+    python -m benchmarks.bench_nodes [n]
+'''
+
+import sys
+import time
+import logging
+import tracemalloc
+from collections import OrderedDict
+
+from latextree.parser.group import Group
+from latextree.parser.content import Text
+from latextree.parser.command import Command, Environment
+from latextree.parser.registry import ClassFactory
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.WARNING)
+
+
+class LegacyArgTable(OrderedDict):
+    '''
+    The original ArgTable (an OrderedDict with a debug counter).
+    '''
+    counter = 0
+
+    def __init__(self):
+        self.number = LegacyArgTable.counter
+        LegacyArgTable.counter += 1
+        OrderedDict.__init__(self)
+
+
+class LegacyNode():
+    '''
+    The original Node class (one __dict__ per instance).
+    '''
+    counter = 0
+
+    def __init__(self):
+        self.serial_number = LegacyNode.counter
+        LegacyNode.counter += 1
+        self.parent = None
+        self.children = []
+        self.species = type(self).__name__
+        self.genus = type(self).__bases__[0].__name__
+        self.family = type(self).__bases__[0].__bases__[0].__name__
+        log.debug('Node {} created ({})'.format(
+            self.serial_number, self.species))
+
+class LegacyContent(LegacyNode):
+    def __init__(self):
+        LegacyNode.__init__(self)
+        self.content = ''
+
+class LegacyText(LegacyContent):
+    def __init__(self, text=None):
+        LegacyContent.__init__(self)
+        self.content = text
+
+class LegacyGroup(LegacyNode):
+    def __init__(self):
+        LegacyNode.__init__(self)
+
+class LegacyCommand(LegacyNode):
+    def __init__(self):
+        LegacyNode.__init__(self)
+        self.args = LegacyArgTable()
+        self.starred = False
+        self.noexpand = False
+        self.post_space = ''
+
+class LegacyEnvironment(LegacyCommand):
+    def __init__(self):
+        LegacyCommand.__init__(self)
+        self.tex_style = False
+        self.pre_space = ''
+        self.pre_children = []
+        self.post_children = []
+
+
+def legacy_factory(name, argnames, BaseClass):
+    '''
+    The original ClassFactory (an __init__ for every class).
+    '''
+    symbol = None
+    def __init__(self, **kwargs):
+        BaseClass.__init__(self)
+        if symbol:
+            setattr(self, 'symbol', symbol)
+        if argnames:
+            setattr(self, 'args', LegacyArgTable.fromkeys(argnames, None))
+        for key, value in kwargs.items():
+            if key not in argnames:
+                raise AttributeError(key)
+            self.args[key] = value
+    return type(name, (BaseClass,), {"__init__": __init__})
+
+
+def kinds():
+    '''
+    (name, legacy class, current class) for each kind of node
+    '''
+    return [
+        ('Text', lambda: LegacyText('text'), lambda: Text('text')),
+        ('Group', LegacyGroup, Group),
+        ('Command', legacy_factory('emph', [], legacy_factory('Style', [], LegacyCommand)),
+                    ClassFactory('emph', [], ClassFactory('Style', [], Command))),
+        ('Environment', legacy_factory('itemize', [], legacy_factory('List', [], LegacyEnvironment)),
+                        ClassFactory('itemize', [], ClassFactory('List', [], Environment))),
+    ]
+
+
+def measure(make, n):
+    '''
+    Bytes and seconds per node for n nodes (kept alive in a list).
+    '''
+    tracemalloc.start()
+    nodes = [make() for _ in range(n)]
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del nodes
+
+    t0 = time.perf_counter()
+    nodes = [make() for _ in range(n)]
+    t = time.perf_counter() - t0
+    return size / n, t / n
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    print('{:12}{:>12}{:>12}{:>10}{:>12}{:>12}{:>10}'.format(
+        'node', 'legacy', 'slots', '', 'legacy', 'slots', ''))
+    for name, legacy, current in kinds():
+        m0, t0 = measure(legacy, n)
+        m1, t1 = measure(current, n)
+        print('{:12}{:>8.0f} B/n {:>8.0f} B/n {:>8.1f}x {:>8.2f} us {:>8.2f} us {:>8.1f}x'.format(
+            name, m0, m1, m0 / m1, t0 * 1e6, t1 * 1e6, t0 / t1))
+
+
+if __name__ == '__main__':
+    main()
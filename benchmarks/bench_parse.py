@@ -0,0 +1,41 @@
+# bench_parse.py
+r'''
+Parse throughput on the test article: the body of
+`tex/test_article/main_all.tex` is repeated to make a document of
+roughly the given size (default 256KB) which is parsed a few times.
+
+    python -m benchmarks.bench_parse [size_in_KB]
+'''
+
+import io
+import sys
+import time
+import contextlib
+
+from latextree.parser.parser import Parser
+
+from .bench_columnar import load_document
+
+
+def bench(s, repeat=3):
+    best = None
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            parser = Parser()
+            t0 = time.perf_counter()
+            parser.parse(s)
+            t = time.perf_counter() - t0
+        best = t if best is None else min(best, t)
+    return best
+
+
+def main():
+    size = int(float(sys.argv[1]) * 2**10) if len(sys.argv) > 1 else 2**18
+    s = load_document(size)
+    t = bench(s)
+    print('source: {:.0f} KB   parse: {:.3f}s   {:.0f} KB/s'.format(
+        len(s) / 2**10, t, len(s) / 2**10 / t))
+
+
+if __name__ == '__main__':
+    main()
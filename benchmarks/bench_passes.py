@@ -0,0 +1,116 @@
+# bench_passes.py
+r'''
+LatexTree.pp_tree for the test article repeated to roughly the given
+size (default 256KB): the original post-processing (a recursive search
+of the tree for each species looked up, and a recursive traversal for
+the table of contents) against the passes run in a single traversal
+which also builds the species index (see latextree/passes.py).
+
+    python -m benchmarks.bench_passes [size_in_KB]
+'''
+
+import io
+import sys
+import time
+import contextlib
+
+from latextree.tree import LatexTree
+from latextree.parser.parser import Parser
+from latextree.passes import Visitor, PreamblePass, ImageFilesPass, WidthsPass
+
+from .bench_columnar import load_document
+from .bench_phenotypes import legacy_get_phenotypes
+
+
+def legacy_toc(node):
+    '''
+    The original LatexTree.pp_toc (recursive function).
+    '''
+    if not node:
+        return {}
+    if node.genus == 'Input':
+        tt = {}
+        for child in node.children:
+            tt.update(legacy_toc(child))
+        return tt
+    subs = []
+    for child in node.children:
+        s = legacy_toc(child)
+        if s:
+            subs.append(s)
+    if node.genus == 'Section' or node.species == 'document':
+        return {node: subs}
+    return {}
+
+
+def legacy_pp_tree(tree):
+    '''
+    The original LatexTree.pp_tree (one search of the tree for each species).
+    '''
+    root = tree.root
+    tree.doc_root = next((child for child in root.children if child.species == 'document'), None)
+    PreamblePass().start(tree)
+    if tree.doc_root:
+        tree.chapters = legacy_get_phenotypes(root, 'chapter')
+        tree.sections = []
+        if not tree.chapters:
+            tree.sections = legacy_get_phenotypes(root, 'section')
+    tree.labels = {}
+    for node in legacy_get_phenotypes(root, 'label'):
+        key = node.args['key'].chars(nobrackets=True)
+        while node.parent:
+            if hasattr(node, 'number') or node.species in tree.registry.block_commands:
+                break
+            node = node.parent
+        tree.labels[key] = node
+    for node in legacy_get_phenotypes(root, 'bibitem'):
+        tree.labels[node.args['key'].chars(nobrackets=True)] = node
+    tree.toc = legacy_toc(tree.doc_root) if tree.doc_root else None
+
+    # the same functions on the nodes found
+    images = ImageFilesPass()
+    images.start(tree)
+    for species in images.species:
+        for node in legacy_get_phenotypes(root, species):
+            images.visit(node, tree)
+    widths = WidthsPass()
+    for species in widths.species:
+        for node in legacy_get_phenotypes(root, species):
+            widths.visit(node, tree)
+
+
+def main():
+    size = int(float(sys.argv[1]) * 2**10) if len(sys.argv) > 1 else 2**18
+    s = load_document(size)
+    with contextlib.redirect_stdout(io.StringIO()):
+        tree = LatexTree()
+        parser = Parser()
+        tree.root = parser.parse(s)
+        tree.registry = parser.registry
+
+        limit = sys.getrecursionlimit()
+        sys.setrecursionlimit(max(limit, 10000))
+        t0 = time.perf_counter()
+        legacy_pp_tree(tree)
+        t_legacy = time.perf_counter() - t0
+        sys.setrecursionlimit(limit)
+        legacy = (tree.sections, tree.labels, tree.toc)
+
+        t0 = time.perf_counter()
+        tree.pp_tree()
+        t_passes = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        Visitor([]).run(tree)
+        t_traversal = time.perf_counter() - t0
+
+    assert legacy == (tree.sections, tree.labels, tree.toc)
+    print('source: {:.0f} KB   nodes: {}   passes: {}'.format(
+        len(s) / 2**10, sum(tree.species_index.counts().values()), len(tree.passes)))
+    print('pp_tree (searches):       {:8.1f}ms'.format(t_legacy * 1e3))
+    print('pp_tree (single pass):    {:8.1f}ms'.format(t_passes * 1e3))
+    print('traversal (no passes):    {:8.1f}ms'.format(t_traversal * 1e3))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+# bench_phenotypes.py
+r'''
+get_phenotypes for the species looked up after a parse (LatexTree.pp_*,
+WebsiteBuilder, templates): the original recursive search of the whole
+tree for each species against the species index (built once) for the
+test article repeated to roughly the given size (default 256KB).
+
+    python -m benchmarks.bench_phenotypes [size_in_KB]
+'''
+
+import io
+import sys
+import time
+import contextlib
+
+from latextree.parser.parser import Parser
+from latextree.parser.index import SpeciesIndex
+
+from .bench_columnar import load_document
+
+# species looked up by LatexTree.pp_tree and latex2html
+SPECIES = ['chapter', 'section', 'label', 'bibitem', 'includegraphics', 'includevideo',
+           'minipage', 'includegraphics', 'caption', 'includegraphics', 'questions']
+
+
+def legacy_get_phenotypes(node, species):
+    '''
+    The original LatexTree.get_phenotypes (lists concatenated at every level).
+    '''
+    if not node:
+        return []
+    phenotypes = []
+    if node.species == species:
+        phenotypes.append(node)
+    if hasattr(node, 'args'):
+        for arg in node.args.values():
+            phenotypes.extend(legacy_get_phenotypes(arg, species))
+    for child in node.children:
+        phenotypes.extend(legacy_get_phenotypes(child, species))
+    return phenotypes
+
+
+def main():
+    size = int(float(sys.argv[1]) * 2**10) if len(sys.argv) > 1 else 2**18
+    s = load_document(size)
+    with contextlib.redirect_stdout(io.StringIO()):
+        root = Parser().parse(s)
+
+    t0 = time.perf_counter()
+    legacy = [legacy_get_phenotypes(root, species) for species in SPECIES]
+    t_legacy = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    index = SpeciesIndex(root)
+    t_build = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    indexed = [index.get(species) for species in SPECIES]
+    t_lookup = time.perf_counter() - t0
+
+    assert [len(x) for x in legacy] == [len(x) for x in indexed]
+    print('source: {:.0f} KB   {} lookups, {} nodes found'.format(
+        len(s) / 2**10, len(SPECIES), sum(len(x) for x in indexed)))
+    print('recursive search: {:8.1f}ms'.format(t_legacy * 1e3))
+    print('index build:      {:8.1f}ms'.format(t_build * 1e3))
+    print('index lookups:    {:8.3f}ms'.format(t_lookup * 1e3))
+
+
+if __name__ == '__main__':
+    main()
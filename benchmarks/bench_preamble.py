@@ -0,0 +1,39 @@
+# bench_preamble.py
+r'''
+Metadata extraction: time per document (default 20 repeats of the
+test article) for a full parse against a preamble-only parse.
+
+    python -m benchmarks.bench_preamble [n]
+'''
+
+import io
+import os
+import sys
+import time
+import contextlib
+
+from latextree import LatexTree
+from latextree.settings import LATEX_ROOT
+
+TEX_MAIN = os.path.join(LATEX_ROOT, 'test_article', 'main.tex')
+
+
+def bench(func, n):
+    with contextlib.redirect_stdout(io.StringIO()):
+        tree = LatexTree()
+        t0 = time.perf_counter()
+        for _ in range(n):
+            func(tree)
+        return (time.perf_counter() - t0) / n
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    t_full = bench(lambda tree: LatexTree().parse_file(TEX_MAIN), n)
+    t_preamble = bench(lambda tree: tree.parse_preamble(TEX_MAIN), n)
+    print('parse_file:      {:.2f}ms'.format(t_full * 1e3))
+    print('parse_preamble:  {:.2f}ms ({:.1%})'.format(t_preamble * 1e3, t_preamble / t_full))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+# bench_select.py
+r'''
+Single-chapter preview: time for a full parse of a generated book
+against a parse of its last chapter (select='chapter:N') as the number
+of chapters grows. The selected parse should stay roughly constant.
+
+    python -m benchmarks.bench_select [n]
+'''
+
+import io
+import os
+import sys
+import time
+import tempfile
+import contextlib
+
+from latextree.parser.parser import Parser
+
+CHAPTER = r'''
+\chapter{Chapter}\label{ch:%(k)d}
+%(sections)s
+'''
+
+SECTION = r'''
+\section{Section}
+Some text with \emph{emphasis} and maths $x^2 + y^2 = z^2$.
+\begin{equation} e^{i\pi} + 1 = 0 \end{equation}
+\begin{figure}\caption{A figure}\end{figure}
+\begin{itemize} \item one \item two \end{itemize}
+% a comment with \chapter{inside}
+'''
+
+def book(chapters, sections=10):
+    body = ''.join(CHAPTER % {'k': k, 'sections': SECTION * sections}
+                   for k in range(1, chapters + 1))
+    return '\\documentclass{book}\n\\begin{document}\n' + body + '\\end{document}\n'
+
+
+def bench(tex_main, n, **kwargs):
+    with contextlib.redirect_stdout(io.StringIO()):
+        t0 = time.perf_counter()
+        for _ in range(n):
+            Parser().parse_file(tex_main, **kwargs)
+        return (time.perf_counter() - t0) / n
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    with tempfile.TemporaryDirectory() as tmp:
+        tex_main = os.path.join(tmp, 'main.tex')
+        print('{:>8} {:>10} {:>12} {:>12}'.format('chapters', 'size', 'full', 'selected'))
+        for chapters in [5, 10, 20, 40]:
+            with open(tex_main, 'w') as f:
+                f.write(book(chapters))
+            t_full = bench(tex_main, n)
+            t_select = bench(tex_main, n, select='chapter:{}'.format(chapters))
+            print('{:>8} {:>9}K {:>10.2f}ms {:>10.2f}ms'.format(
+                chapters, os.path.getsize(tex_main) // 1024, t_full * 1e3, t_select * 1e3))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+# bench_setup.py
+r'''
+Setup cost for small documents: time per document (default 1000)
+for a new Parser, a new LatexTree (with the extensions) and a
+warm parser reused with Parser.reset(). Also the cold start cost of
+the prototype registry: built from .the definitions or loaded from a
+snapshot (see Registry.prototype).
+
+    python -m benchmarks.bench_setup [n]
+'''
+
+import io
+import sys
+import time
+import gc
+import copy
+import tempfile
+import contextlib
+
+from latextree.parser.parser import Parser
+from latextree.parser.coredefs import defs
+from latextree.parser import registry
+from latextree import LatexTree
+
+DOCUMENT = r'\newcommand{\hello}[1]{Hello #1} \section{One} \hello{world} $x^2$'
+
+
+def bench(setup, n):
+    with contextlib.redirect_stdout(io.StringIO()):
+        t0 = time.perf_counter()
+        for _ in range(n):
+            setup().parse(DOCUMENT)
+        return (time.perf_counter() - t0) / n
+
+
+def bench_prototype(n=20):
+    '''
+    Time to build the prototype registry and to load it from a snapshot 
+    (new definitions dicts so the per-process cache is not used).
+    The garbage collector is disabled (the copies would be scanned).
+    '''
+    defs_copies = [copy.deepcopy(defs) for _ in range(2 * n)]
+    with tempfile.TemporaryDirectory() as cache_root, contextlib.redirect_stdout(io.StringIO()):
+        root = registry.SNAPSHOT_ROOT
+        gc.disable()
+        try:
+            registry.SNAPSHOT_ROOT = None
+            t0 = time.perf_counter()
+            for idx in range(n):
+                registry.Registry.prototype(defs_copies[idx])
+            t_build = (time.perf_counter() - t0) / n
+            registry.SNAPSHOT_ROOT = cache_root
+            registry.Registry.prototype(defs)
+            t0 = time.perf_counter()
+            for idx in range(n, 2 * n):
+                registry.Registry.prototype(defs_copies[idx])
+            t_load = (time.perf_counter() - t0) / n
+        finally:
+            registry.SNAPSHOT_ROOT = root
+            gc.enable()
+    return t_build, t_load
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    with contextlib.redirect_stdout(io.StringIO()):
+        parser = Parser()
+    def reuse():
+        parser.reset()
+        return parser
+    print('new Parser:       {:.0f}us'.format(bench(Parser, n) * 1e6))
+    print('new LatexTree:    {:.0f}us'.format(bench(lambda: LatexTree().parser, n) * 1e6))
+    print('Parser.reset():   {:.0f}us'.format(bench(reuse, n) * 1e6))
+    t_build, t_load = bench_prototype()
+    print('registry build:   {:.0f}us'.format(t_build * 1e6))
+    print('registry load:    {:.0f}us'.format(t_load * 1e6))
+
+
+if __name__ == '__main__':
+    main()
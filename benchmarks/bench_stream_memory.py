@@ -0,0 +1,56 @@
+# bench_stream_memory.py
+r'''
+Peak memory while reading every token of a large source: a reversed
+token list (the original TokenStream) against the lazy TokenStream.
+
+    python -m benchmarks.bench_stream_memory [size_in_MB]
+'''
+
+import sys
+import tracemalloc
+
+from latextree.parser.tokens import tokenize, TokenStream
+
+from .bench_tokenize import load_source
+
+
+def drain_list(s):
+    tokens = tokenize(s)
+    tokens.reverse()
+    n = 0
+    while tokens:
+        tokens.pop()
+        n += 1
+    return n
+
+
+def drain_stream(s):
+    tokens = TokenStream(s)
+    n = 0
+    while tokens:
+        tokens.pop()
+        n += 1
+    return n
+
+
+def measure(func, s):
+    tracemalloc.start()
+    n = func(s)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak, n
+
+
+def main():
+    size = int(float(sys.argv[1]) * 2**20) if len(sys.argv) > 1 else 2**20
+    s = load_source(size)
+    print('source: {:.2f} MB'.format(len(s) / 2**20))
+
+    for func in [drain_list, drain_stream]:
+        peak, n = measure(func, s)
+        print('{:16}{:10.2f} MB peak {:10} tokens'.format(
+            func.__name__, peak / 2**20, n))
+
+
+if __name__ == '__main__':
+    main()
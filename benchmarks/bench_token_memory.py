@@ -0,0 +1,53 @@
+# bench_token_memory.py
+r'''
+Memory used by the token list for `tex/test_article/main_all.tex`:
+the original dict-based Token class against the slotted tuple Token,
+with and without interning (`tokenize_chars` creates a fresh token per
+character, `tokenize` hands out shared tokens).
+
+    python -m benchmarks.bench_token_memory
+'''
+
+import os
+import tracemalloc
+
+from latextree import settings
+from latextree.parser.tokens import tokenize, tokenize_chars
+
+
+class LegacyToken():
+    '''
+    The original Token class (one __dict__ per instance).
+    '''
+    def __init__(self, catcode, value):
+        self.catcode = catcode
+        self.value = value
+
+
+def legacy_tokenize(s):
+    tokens = [(t.catcode, t.value) for t in tokenize_chars(s)]
+    return [LegacyToken(*t) for t in tokens]
+
+
+def measure(func, s):
+    tracemalloc.start()
+    tokens = func(s)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return size, len(tokens)
+
+
+def main():
+    tex_file = os.path.join(settings.LATEX_ROOT, 'test_article', 'main_all.tex')
+    with open(tex_file) as f:
+        s = f.read()
+    print('source: {} ({} chars)'.format(tex_file, len(s)))
+
+    for func in [legacy_tokenize, tokenize_chars, tokenize]:
+        size, n = measure(func, s)
+        print('{:16}{:10.1f} KB {:8} tokens {:8.1f} bytes/token'.format(
+            func.__name__, size / 2**10, n, size / n))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+# bench_tokenize.py
+r'''
+Throughput of the regex tokenizer (`tokenize`) against the original
+character loop (`tokenize_chars`).
+
+The test article sources are concatenated and repeated to make a
+document of roughly the given size (default 2MB):
+
+    python -m benchmarks.bench_tokenize [size_in_MB]
+'''
+
+import os
+import sys
+import glob
+import time
+
+from latextree import settings
+from latextree.parser.tokens import tokenize, tokenize_chars
+
+
+def load_source(size):
+    tex_dir = os.path.join(settings.LATEX_ROOT, 'test_article')
+    parts = []
+    for tex_file in sorted(glob.glob(os.path.join(tex_dir, '*.tex'))):
+        with open(tex_file) as f:
+            parts.append(f.read())
+    s = ''.join(parts)
+    return s * (1 + size // len(s))
+
+
+def bench(func, s, repeat=3):
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        tokens = func(s)
+        t = time.perf_counter() - t0
+        best = t if best is None else min(best, t)
+    return best, len(tokens)
+
+
+def main():
+    size = int(float(sys.argv[1]) * 2**20) if len(sys.argv) > 1 else 2 * 2**20
+    s = load_source(size)
+    print('source: {:.2f} MB'.format(len(s) / 2**20))
+
+    assert tokenize(s) == tokenize_chars(s)
+
+    for func in [tokenize_chars, tokenize]:
+        t, n = bench(func, s)
+        print('{:16}{:8.3f}s {:10} tokens {:8.2f} MB/s'.format(
+            func.__name__, t, n, len(s) / 2**20 / t))
+
+
+if __name__ == '__main__':
+    main()
@@ -1 +1,2 @@
-from .parser import Parser
\ No newline at end of file
+from .parser import Parser
+from .limits import ExpansionLimitExceeded
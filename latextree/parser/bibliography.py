@@ -151,7 +151,7 @@ class Bibliography(Command):
     def add_item(self, bibitem):
         if not isinstance(bibitem, BibItem):
             Exception('Bibliography objects can only contain BibItem objects')
-            self.children.append(bibitem)
+            self.append_child(bibitem)
         
     def harvard(self):
         ''' string harvard entries together '''
@@ -96,8 +96,13 @@ class Command(Node):
     Attributes attributes:
         1. `starred` (default=`False`)
         2. `noexpand` (default=`False`)
-    
+
+    Other attributes (`number`, `label`, `symbol`, ...) are set on some
+    commands only, so they are kept in the instance __dict__ (which is
+    not allocated until one of them is set).
     '''
+    __slots__ = ('args', 'starred', 'noexpand', 'post_space', '__dict__')
+
     def __init__(self):
         Node.__init__(self)
         self.args = ArgTable()
@@ -255,12 +260,14 @@ class Environment(Command):
     Environments can inline or display. 
     For example \begin{math} ... \end{math} is a synonym for $ ... $ 
     '''
+    __slots__ = ('tex_style', 'pre_space', 'pre_children', 'post_children')
+
     def __init__(self):
         Command.__init__(self)
         self.tex_style = False
         self.pre_space = ''
-        self.pre_children = []  # begdef for user-defined environments
-        self.post_children = [] # enddef for user_defined environments
+        self.pre_children = ()  # begdef for user-defined environments
+        self.post_children = () # enddef for user_defined environments
 
 
     def chars(self, **kwargs):
@@ -397,6 +404,41 @@ class ActiveCharacter(Command):
 
 
 
+class Verbatim(Command):
+    r'''
+    Genus class for inline verbatim commands (genus `Verbatim')
+    '''
+    def __init__(self):
+        Command.__init__(self)
+
+
+class Verb(Verbatim):
+    r'''
+    Inline verbatim \verb|...| (or \verb*|...|). Read as a single raw token
+    by the tokenizer. The contents are recorded in `text' and the delimiter
+    (any non-letter character) in `delimiter'.
+    '''
+    def __init__(self, text='', delimiter='|'):
+        Verbatim.__init__(self)
+        self.text = text
+        self.delimiter = delimiter
+
+    def __repr__(self):
+        return '{}:{}({})'.format(self.genus, self.species, self.text)
+
+    def chars(self, **kwargs):
+        s = ['\\verb']
+        if self.starred:
+            s.append('*')
+        s += [self.delimiter, self.text, self.delimiter]
+        return ''.join(s)
+
+    def xml(self):
+        elt = etree.Element(self.species)
+        elt.text = self.text
+        return elt
+
+
 # test
 def test_command():
 
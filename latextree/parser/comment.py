@@ -6,10 +6,12 @@ class Comment(Node):
     '''
     Comment node. The comment character (%) and newline (\n) 
     These are stripped from the tex, but returned in chars(). 
+    The newline is absent for a comment at the end of the source.
     '''   
-    def __init__(self, text=None):
+    def __init__(self, text=None, newline=True):
         Node.__init__(self)
         self.comment = text
+        self.newline = newline
 
     def __repr__(self):
         # return '{}:{}({})'.format(self.genus, self.species, self.comment)
@@ -17,5 +19,7 @@ class Comment(Node):
 
 
     def chars(self, **kwargs):
+        if not self.newline:
+            return '%{}'.format(self.comment)
         return '%{}\n'.format(self.comment)
 
@@ -0,0 +1,329 @@
+# compact.py
+r'''
+Compact (struct-of-arrays) form of a tree (see LatexTree.to_compact).
+
+    compact = tree.to_compact()
+    compact.species_counts()        # Counter({'Text': 1520, 'emph': 12, ...})
+    compact.depth_histogram()
+    root = compact.to_node()        # back to Node objects
+
+The nodes are numbered in preorder and stored in parallel arrays
+(`array' module, so `numpy.frombuffer' can view them without copying)
+    parent          index of the container (-1 for the root)
+    first_child     index of the first node in the container (or -1)
+    next_sibling    index of the next node in the same container (or -1)
+    species         index into `classes' (the node classes)
+                    (this and the other table indices are 16-bit when
+                    the table is small enough)
+    slot            index into `slots': how the node is attached to its
+                    container, e.g. ('children', None) or ('args', 'title')
+    attrs           index into `attr_sets' (see below)
+    text_start      offsets of the text of the node (Text contents,
+    text_end        comments, ...) into the shared string `text'
+    flags           PARENT if node.parent is the container
+
+Arguments, markers, pre_children, ... are nodes of the compact tree like
+the children (with a different slot), so the subtree of a node is a
+contiguous range of indices (see end) and traversals are slices of the
+arrays instead of recursive calls over the nodes.
+
+The other attributes of a node (starred, post_space, number, ...) are
+recorded as a tuple of (name, kind, value) triples. The tuples are
+shared by all nodes with the same attributes (e.g. all unstarred
+commands with no space after the name), so they cost one index per
+node. Values which cannot be shared (not hashable) are kept in `extras'
+and nodes reached by more than one attribute (e.g. the marker of an
+item, which is also an argument) in `refs'.
+'''
+
+from array import array
+from collections import Counter
+
+from .node import Node, node_items
+from .parameter import ArgTable
+
+# kinds of attribute (see CompactTree.attr_sets)
+SCALAR = 0      # value
+LIST = 1        # list of nodes (value is the list class)
+ARGS = 2        # ArgTable (value is the tuple of argument names)
+TEXT = 3        # string stored in the text buffer
+
+# attributes stored in the text buffer (the first string found)
+TEXT_ATTRIBUTES = ('content', 'comment', 'text')
+
+# flags
+PARENT = 1
+
+# attributes which are not recorded (set again by Node.__init__)
+SKIPPED = ('parent', 'serial_number')
+
+
+class CompactTree():
+    '''
+    Struct-of-arrays form of a tree of Node objects.
+    '''
+    def __init__(self):
+        self.parent = array('i')
+        self.first_child = array('i')
+        self.next_sibling = array('i')
+        self.species = array('I')
+        self.slot = array('I')
+        self.attrs = array('I')
+        self.text_start = array('I')
+        self.text_end = array('I')
+        self.flags = array('B')
+        self.text = ''
+
+        # tables (indexed by the arrays)
+        self.classes = []       # node classes
+        self.slots = []         # (attribute name, argument name or None)
+        self.attr_sets = []     # tuples of (name, kind, value)
+
+        # sparse attributes keyed on node index
+        self.extras = {}        # [(name, value)] for unhashable values
+        self.refs = {}          # [(slot, index)] for nodes already stored
+
+
+    @classmethod
+    def from_node(cls, root):
+        '''
+        Compact form of the tree `root'.
+        '''
+        compact = cls()
+        compact.add_tree(root)
+        return compact
+
+
+    def add_tree(self, root):
+        '''
+        Store the nodes of the tree `root' in preorder.
+        '''
+        index = {}                              # node ids to indices
+        class_ids = {}
+        slot_ids = {}
+        attr_ids = {}
+        texts = []
+        text_len = 0
+        last = []                               # last node in each container
+
+        stack = [(root, -1, None, None)]
+        while stack:
+            node, container, container_node, slot = stack.pop()
+            slot_id = slot_ids.get(slot)
+            if slot_id is None:
+                slot_id = slot_ids[slot] = len(self.slots)
+                self.slots.append(slot)
+
+            # node reached again (e.g. a marker which is also an argument)
+            if id(node) in index:
+                self.refs.setdefault(container, []).append((slot_id, index[id(node)]))
+                continue
+
+            i = len(self.species)
+            index[id(node)] = i
+            last.append(-1)
+
+            # link to the container
+            self.parent.append(container)
+            self.first_child.append(-1)
+            self.next_sibling.append(-1)
+            if container >= 0:
+                if last[container] < 0:
+                    self.first_child[container] = i
+                else:
+                    self.next_sibling[last[container]] = i
+                last[container] = i
+
+            # species
+            node_class = type(node)
+            class_id = class_ids.get(node_class)
+            if class_id is None:
+                class_id = class_ids[node_class] = len(self.classes)
+                self.classes.append(node_class)
+            self.species.append(class_id)
+            self.slot.append(slot_id)
+            self.flags.append(PARENT if node.parent is not None and node.parent is container_node else 0)
+
+            # attributes and edges (nodes in attributes)
+            attrs = []
+            edges = []
+            start = end = text_len
+            has_text = False
+            for name, value in node_items(node):
+                if name in SKIPPED:
+                    continue
+                if isinstance(value, Node):
+                    edges.append(((name, None), value))
+                elif isinstance(value, ArgTable):
+                    attrs.append((name, ARGS, tuple(value)))
+                    for key, arg in value.items():
+                        if isinstance(arg, Node):
+                            edges.append(((name, key), arg))
+                        elif arg is not None:
+                            raise Exception('Argument {} of {} cannot be stored'.format(key, node.species))
+                elif isinstance(value, list) and all(isinstance(x, Node) for x in value):
+                    attrs.append((name, LIST, type(value)))
+                    edges.extend(((name, None), x) for x in value)
+                elif isinstance(value, str) and name in TEXT_ATTRIBUTES and not has_text:
+                    has_text = True
+                    attrs.append((name, TEXT, None))
+                    texts.append(value)
+                    text_len += len(value)
+                    end = text_len
+                else:
+                    try:
+                        hash(value)
+                        attrs.append((name, SCALAR, value))
+                    except TypeError:
+                        self.extras.setdefault(i, []).append((name, value))
+            self.text_start.append(start)
+            self.text_end.append(end)
+
+            attrs = tuple(attrs)
+            attr_id = attr_ids.get(attrs)
+            if attr_id is None:
+                attr_id = attr_ids[attrs] = len(self.attr_sets)
+                self.attr_sets.append(attrs)
+            self.attrs.append(attr_id)
+
+            for slot, value in reversed(edges):
+                stack.append((value, i, node, slot))
+
+        self.text = ''.join(texts)
+
+        # table indices in 16 bits when the tables are small enough
+        for name, table in [('species', self.classes), ('slot', self.slots), ('attrs', self.attr_sets)]:
+            if len(table) <= 0xFFFF:
+                setattr(self, name, array('H', getattr(self, name)))
+
+
+    def __len__(self):
+        return len(self.species)
+
+
+    def end(self, i=0):
+        '''
+        Index after the last node of the subtree of node `i'
+        (the subtree is the range i..end-1).
+        '''
+        while i >= 0:
+            if self.next_sibling[i] >= 0:
+                return self.next_sibling[i]
+            i = self.parent[i]
+        return len(self.species)
+
+
+    def species_name(self, i):
+        return self.classes[self.species[i]].species
+
+
+    def node_text(self, i):
+        '''
+        Text of node `i' (Text contents, comment, ...) or ''.
+        '''
+        return self.text[self.text_start[i]:self.text_end[i]]
+
+
+    def species_counts(self, i=0):
+        '''
+        Number of nodes of each species in the subtree of node `i'
+        (including arguments, markers, ...).
+        '''
+        counts = Counter(self.species[i:self.end(i)])
+        names = Counter()
+        for class_id, count in counts.items():
+            names[self.classes[class_id].species] += count
+        return names
+
+
+    def find(self, species, i=0):
+        '''
+        Indices of the nodes of `species' in the subtree of node `i'
+        (arguments, markers, ... included, see LatexTree.get_phenotypes).
+        '''
+        ids = set(k for k, cls in enumerate(self.classes) if cls.species == species)
+        end = self.end(i)
+        return [k for k, class_id in enumerate(self.species[i:end], i) if class_id in ids]
+
+
+    def depths(self):
+        '''
+        Depth of each node (0 for the root). In preorder the container
+        of a node comes first, so a single pass is enough.
+        '''
+        parent = self.parent
+        depth = array('I', bytes(4 * len(parent)))
+        for k in range(1, len(parent)):
+            depth[k] = depth[parent[k]] + 1
+        return depth
+
+
+    def depth_histogram(self, i=0):
+        '''
+        Number of nodes at each depth (relative to node `i') in the
+        subtree of node `i'.
+        '''
+        depth = self.depths()
+        base = depth[i]
+        return Counter(d - base for d in depth[i:self.end(i)])
+
+
+    def nbytes(self):
+        '''
+        Memory used by the arrays and the text buffer (not the tables).
+        '''
+        arrays = (self.parent, self.first_child, self.next_sibling, self.species,
+                  self.slot, self.attrs, self.text_start, self.text_end, self.flags)
+        return sum(a.itemsize * len(a) for a in arrays) + len(self.text.encode('utf-8'))
+
+
+    def to_node(self, i=0):
+        '''
+        Node objects for the subtree of node `i' (new serial numbers
+        are allocated as for nodes created by the parser, see node.py).
+        '''
+        end = self.end(i)
+        nodes = []
+        for k in range(i, end):
+            cls = self.classes[self.species[k]]
+            node = cls.__new__(cls)
+            Node.__init__(node)
+            for name, kind, value in self.attr_sets[self.attrs[k]]:
+                if kind == SCALAR:
+                    setattr(node, name, value)
+                elif kind == LIST:
+                    setattr(node, name, value())
+                elif kind == ARGS:
+                    setattr(node, name, ArgTable.fromkeys(value))
+                else:
+                    setattr(node, name, self.text[self.text_start[k]:self.text_end[k]])
+            for name, value in self.extras.get(k, []):
+                setattr(node, name, value)
+            nodes.append(node)
+            if k > i:
+                container = nodes[self.parent[k] - i]
+                attach(container, self.slots[self.slot[k]], node)
+                if self.flags[k] & PARENT:
+                    node.parent = container
+
+        for k, refs in self.refs.items():
+            if i <= k < end:
+                for slot_id, target in refs:
+                    if i <= target < end:
+                        attach(nodes[k - i], self.slots[slot_id], nodes[target - i])
+        return nodes[0]
+
+
+def attach(container, slot, node):
+    '''
+    Set the attribute `slot' (name, argument name) of `container' to `node'.
+    '''
+    name, key = slot
+    if key is not None:
+        getattr(container, name)[key] = node
+        return
+    value = getattr(container, name, None)
+    if isinstance(value, list):
+        value.append(node)
+    else:
+        setattr(container, name, node)
@@ -8,6 +8,7 @@ from lxml import etree
 from .node import Node
 
 class Content(Node):
+    __slots__ = ('content',)
 
     def __init__(self):
         Node.__init__(self)
@@ -26,6 +27,8 @@ class Text(Content):
         1. names (e.g. chaptername, abstractname, contentname, etc) TODO
         2. numbers (e.g. \arabic{chapter}.\arabic{equation})
     '''    
+    __slots__ = ()
+
     def __init__(self, text=None):
         Content.__init__(self)
         self.content = text
@@ -80,6 +83,8 @@ class Number(Content):
     if self.species == 'arabic':
         return chr(97+self.value)
     '''    
+    __slots__ = ()
+
     def __init__(self, value=None):
         Content.__init__(self)
         self.content = int(value)
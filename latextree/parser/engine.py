@@ -0,0 +1,101 @@
+# engine.py
+r'''
+Parsing engines.
+
+The recursive parser functions (parse_tokens, parse_group, parse_command,
+parse_environment, parse_arguments, ...) are written as generators.
+A nested call is made by yielding the generator of the callee
+
+    sibs = yield self.parse_tokens(tokens, RBRACE)
+
+and the engine runs the callee and sends its return value back.
+Any other value is sent straight back, so a token handler can return
+either a node or a generator (see `Parser.parse_tokens').
+
+Two engines are provided (selected by `Parser(engine=...)')
+    recursive   - run each nested call in a new Python frame
+    iterative   - keep the open calls on an explicit stack
+
+Each open call holds its own node and stop tokens, so the stack used by
+the iterative engine is a stack of open nodes and stop token frames.
+Its depth is not limited by the interpreter recursion limit, e.g.
+for deeply nested groups {{{{...}}}}.
+
+The iterative engine runs a generator (run_stepwise) to the end; the
+generator pauses after every step (see Parser.iterparse).
+'''
+
+from types import GeneratorType
+
+
+def run_recursive(gen):
+    '''
+    Run the generator `gen' and return its return value.
+    Nested calls are run recursively.
+    '''
+    send = gen.send
+    value = None
+    try:
+        while True:
+            value = send(value)
+            if type(value) is GeneratorType:
+                value = run_recursive(value)
+    except StopIteration as e:
+        return e.value
+
+
+def run_stepwise(gen):
+    '''
+    Run the generator `gen' as a generator which yields (None) after
+    each step so that the caller can act while the parse proceeds.
+    Returns the return value of `gen'.
+    Nested calls are pushed on a stack (no recursion).
+    Exceptions are thrown into the calling generator.
+    '''
+    stack = []
+    value = None
+    error = None
+    while True:
+        try:
+            if error is None:
+                value = gen.send(value)
+            else:
+                exc, error = error, None
+                value = gen.throw(exc)
+        except StopIteration as e:
+            if not stack:
+                return e.value
+            gen = stack.pop()
+            value = e.value
+            continue
+        except Exception as e:
+            if not stack:
+                raise
+            gen = stack.pop()
+            error = e
+            continue
+        if type(value) is GeneratorType:
+            stack.append(gen)
+            gen = value
+            value = None
+        yield
+
+
+def run_iterative(gen):
+    '''
+    Run the generator `gen' and return its return value
+    (run_stepwise without the pauses).
+    '''
+    steps = run_stepwise(gen)
+    try:
+        while True:
+            next(steps)
+    except StopIteration as e:
+        return e.value
+
+
+# engines keyed on name
+ENGINES = {
+    'recursive': run_recursive,
+    'iterative': run_iterative,
+}
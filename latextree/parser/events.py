@@ -0,0 +1,146 @@
+# events.py
+r'''
+Event streams (see Parser.iterparse).
+
+    for event in parser.iterparse(s):
+        if event.event == 'text':
+            words += len(event.text.split())
+
+The parser yields a `start' event when a node is opened (its arguments
+are parsed and it is numbered), `text' events for the Text nodes and an
+`end' event when the node is closed. The nodes are not attached to their
+parents so finished subtrees are not kept: memory is bounded by the
+nesting depth of the document rather than its size.
+
+Only the contents (children) of nodes are streamed. Arguments are parsed
+as usual and summarised in the start event, and so are the pre_children
+and post_children of user-defined environments. Nodes whose contents
+are not streamed (e.g. tabular environments) are reported by walking
+the finished subtree, which gives the same events.
+
+The parse functions mark the nodes whose contents are parsed next
+(Parser.open_node and Parser.close_node) and the regions which are not
+streamed (Parser.quietly). The events for a tree produced by Parser.parse
+are given by tree_events.
+'''
+
+from collections import namedtuple, deque
+
+from .node import NodeList
+from .content import Text
+
+# parse event
+#   event       'start', 'end' or 'text'
+#   species     species name of the node
+#   genus       genus name of the node
+#   args        tex source of the arguments keyed on name (unset arguments omitted)
+#   depth       nesting depth (0 for the top-level nodes)
+#   marker      marker of a numbered node e.g. '2.1' (or None)
+#   text        contents of a Text node (or None)
+ParseEvent = namedtuple('ParseEvent',
+    ['event', 'species', 'genus', 'args', 'depth', 'marker', 'text'])
+
+
+def start_event(node, depth):
+    args = getattr(node, 'args', None)
+    if args:
+        args = {name: arg.chars() for name, arg in args.items() if arg}
+    marker = getattr(node, 'marker', None)
+    if marker is not None:
+        marker = marker.chars()
+    return ParseEvent('start', node.species, node.genus, args or {}, depth, marker, None)
+
+
+def end_event(node, depth):
+    return ParseEvent('end', node.species, node.genus, None, depth, None, None)
+
+
+def text_event(node, depth):
+    return ParseEvent('text', node.species, node.genus, None, depth, None, node.content)
+
+
+def tree_events(nodes, depth=0):
+    '''
+    Events for the subtrees of `nodes' (see Parser.iterparse).
+    '''
+    stack = [(node, depth, False) for node in reversed(nodes)]
+    while stack:
+        node, depth, end = stack.pop()
+        if end:
+            yield end_event(node, depth)
+        elif isinstance(node, Text):
+            yield text_event(node, depth)
+        else:
+            yield start_event(node, depth)
+            stack.append((node, depth, True))
+            stack.extend((child, depth + 1, False) for child in reversed(node.children))
+
+
+class EventStream():
+    '''
+    Events of a parse in progress (see Parser.iterparse).
+    '''
+    def __init__(self):
+        self.events = deque()
+        self.depth = 0          # number of open nodes
+        self.quiet = 0          # nesting of regions which are not streamed
+        self.pending = True     # the next parse_tokens call streams (top level)
+        self.closed = None      # last node closed (see add)
+
+    def siblings(self):
+        '''
+        Sibling list for parse_tokens: the contents of an open node
+        are streamed, anything else is collected as usual.
+        '''
+        if self.pending:
+            self.pending = False
+            return EventList(self)
+        return NodeList()
+
+    def open(self, node):
+        if self.quiet:
+            return
+        self.events.append(start_event(node, self.depth))
+        self.depth += 1
+        self.pending = True
+
+    def close(self, node):
+        if self.quiet:
+            return
+        self.depth -= 1
+        self.events.append(end_event(node, self.depth))
+        self.closed = node
+
+    def add(self, node):
+        '''
+        Node appended to the contents of an open node.
+        '''
+        if node is self.closed:
+            self.closed = None
+            return
+        if isinstance(node, Text):
+            self.events.append(text_event(node, self.depth))
+        else:
+            self.events.extend(tree_events([node], self.depth))
+
+    def quietly(self, gen):
+        '''
+        Run the parser generator `gen' without streaming.
+        '''
+        self.quiet += 1
+        try:
+            return (yield gen)
+        finally:
+            self.quiet -= 1
+
+
+class EventList(NodeList):
+    '''
+    Sibling list which streams its nodes instead of keeping them.
+    '''
+    def __init__(self, stream):
+        NodeList.__init__(self)
+        self.stream = stream
+
+    def append(self, node):
+        self.stream.add(node)
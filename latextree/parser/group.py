@@ -8,6 +8,8 @@ class Group(Node):
     Latex group node. 
     Should probably be subclassed from NodeList 
     '''
+    __slots__ = ()
+
     def __init__(self):
         Node.__init__(self)
    
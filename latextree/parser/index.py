@@ -0,0 +1,66 @@
+# index.py
+r'''
+Species index of a tree (see LatexTree.get_phenotypes).
+
+    index = SpeciesIndex(root)
+    index.get('section')        # all section nodes in document order
+
+The nodes are indexed in a single pass over the tree, in the order of
+a depth-first search which visits the arguments of a node before its
+children. Lookups then take time proportional to the number of nodes
+found, instead of a traversal of the whole tree for each species.
+
+The index is not updated when the tree changes: index the tree again
+after adding or removing nodes (LatexTree does so when its root is
+replaced, e.g. by a new parse or reparse).
+'''
+
+
+def preorder(root):
+    '''
+    Nodes of the tree `root' in document order (a node, its arguments,
+    then its children).
+    '''
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        yield node
+        stack.extend(reversed(node.children))
+        args = getattr(node, 'args', None)
+        if args:
+            stack.extend(reversed([arg for arg in args.values() if arg]))
+
+
+class SpeciesIndex():
+    '''
+    Lists of nodes keyed on species name (in document order). The nodes
+    of `root' are indexed unless root is None, in which case the nodes
+    are added by the caller (e.g. a Visitor, see passes.py).
+    '''
+    def __init__(self, root=None):
+        self.root = root
+        self.nodes = {}
+        if root is not None:
+            for node in preorder(root):
+                self.add(node)
+
+    def add(self, node):
+        '''
+        Add `node' (after the nodes which precede it in document order).
+        '''
+        if node.species in self.nodes:
+            self.nodes[node.species].append(node)
+        else:
+            self.nodes[node.species] = [node]
+
+    def get(self, species):
+        '''
+        Nodes of `species' (a new list).
+        '''
+        return list(self.nodes.get(species, ()))
+
+    def counts(self):
+        '''
+        Number of nodes of each species.
+        '''
+        return {species: len(nodes) for species, nodes in self.nodes.items()}
@@ -0,0 +1,91 @@
+# limits.py
+r'''
+Limits on the expansion of user-defined macros.
+
+A user-defined command or environment is expanded by splicing its
+definition back into the token stream, so a document like
+
+    \newcommand{\a}{\a}                     % recursive
+    \newcommand{\b}{\a\a} \newcommand{\c}{\b\b} ...   % exponential
+
+never terminates or takes exponential time. Each parse is given a
+budget (see Parser(limits=...))
+    max_tokens  total number of tokens spliced by expansions
+    max_depth   number of nested expansions (expansions inside expansions)
+    max_time    wall-clock time of the parse in seconds (checked at
+                each expansion)
+A limit set to None is not checked. ExpansionLimitExceeded is raised
+when a limit is exceeded, naming the macro being expanded.
+'''
+
+import time
+
+# default limits (see Parser)
+#   the depth limit also keeps the recursive engine within
+#   the interpreter recursion limit
+MAX_TOKENS = 10**7
+MAX_DEPTH = 100
+MAX_TIME = None
+
+
+class ExpansionLimitExceeded(Exception):
+    '''
+    Expansion limit exceeded.
+        macro       species name of the macro being expanded
+        count       number of expansions of the macro (including this one)
+        limit       limit exceeded ('max_tokens', 'max_depth' or 'max_time')
+        value       value of the limit
+    '''
+    def __init__(self, macro, count, limit, value):
+        self.macro = macro
+        self.count = count
+        self.limit = limit
+        self.value = value
+        Exception.__init__(self, 'Expansion limit {}={} exceeded by \\{} ({} expansions)'.format(
+            limit, value, macro, count))
+
+    def __reduce__(self):
+        return (ExpansionLimitExceeded, (self.macro, self.count, self.limit, self.value))
+
+
+class ExpansionBudget():
+    '''
+    Expansions made by a parse (see Parser.parse_command).
+    '''
+    def __init__(self, max_tokens=MAX_TOKENS, max_depth=MAX_DEPTH, max_time=MAX_TIME):
+        self.max_tokens = max_tokens
+        self.max_depth = max_depth
+        self.max_time = max_time
+        self.start()
+
+    def start(self):
+        '''
+        Reset the budget for a new parse.
+        '''
+        self.tokens = 0
+        self.depth = 0
+        self.counts = {}
+        self.deadline = None
+        if self.max_time is not None:
+            self.deadline = time.perf_counter() + self.max_time
+
+    def expand(self, macro, ntokens):
+        '''
+        Record an expansion of `macro' into `ntokens' tokens, which are
+        parsed before the matching call to `done'.
+        '''
+        count = self.counts[macro] = self.counts.get(macro, 0) + 1
+        self.tokens += ntokens
+        self.depth += 1
+        if self.max_tokens is not None and self.tokens > self.max_tokens:
+            raise ExpansionLimitExceeded(macro, count, 'max_tokens', self.max_tokens)
+        if self.max_depth is not None and self.depth > self.max_depth:
+            raise ExpansionLimitExceeded(macro, count, 'max_depth', self.max_depth)
+        if self.deadline is not None and time.perf_counter() > self.deadline:
+            raise ExpansionLimitExceeded(macro, count, 'max_time', self.max_time)
+
+    def done(self):
+        '''
+        The last expansion has been parsed.
+        '''
+        self.depth -= 1
@@ -0,0 +1,149 @@
+# location.py
+r'''
+Source locations for Node objects.
+
+The parser records the source file and position of every node in a
+SourceMap as the node is created. Positions are stored in arrays indexed
+by serial number (rather than as attributes on the nodes) and are only
+converted to line and column numbers when a node is located, e.g.
+
+    tree.locate(node)  -> Location(file='intro.tex', line=12, column=5)
+
+The position recorded is the position of the parser in the token stream
+when the node was created, which is usually just after the opening token
+(e.g. the command name). Nodes created by macro expansion are located at
+the macro.
+'''
+
+from array import array
+from bisect import bisect_right
+from collections import namedtuple
+
+import re
+
+Location = namedtuple('Location', ['file', 'line', 'column'])
+
+
+class SourceMap():
+    '''
+    Source file ids and positions of nodes, indexed by serial number.
+    '''
+
+    def __init__(self, base=0):
+
+        # serial number of the first node
+        self.base = base
+
+        # source files (indexed by file id)
+        self.files = []     # file names
+        self.cursors = []   # cursors (resolve positions into offsets)
+        self.lines = []     # offsets of line starts (computed on demand)
+
+        # positions (see TokenStream.tell)
+        self.file_ids = array('h')
+        self.chunks = array('I')
+        self.counts = array('I')
+
+        # current stream (set by the parser)
+        self.stream = None
+
+    def add_file(self, name, tokens):
+        '''
+        Register the source of the token stream `tokens` and set its file id.
+        '''
+        file_id = len(self.files)
+        self.files.append(name)
+        self.cursors.append(tokens.cursor)
+        self.lines.append(None)
+        tokens.cursor.file_id = file_id
+        return file_id
+
+    def record(self, node):
+        '''
+        Record the current position of the stream for `node`.
+        '''
+        if self.stream is None:
+            return
+        (file_id, a, b) = self.stream.tell()
+        if file_id is None:
+            return
+        idx = node.serial_number - self.base
+        gap = idx - len(self.file_ids)
+        if gap > 0:
+            self.file_ids.extend([-1] * gap)
+            self.chunks.extend([0] * gap)
+            self.counts.extend([0] * gap)
+        if gap >= 0:
+            self.file_ids.append(file_id)
+            self.chunks.append(a)
+            self.counts.append(b)
+
+    def offset(self, node):
+        '''
+        File id and character offset of `node` (or None).
+        '''
+        idx = node.serial_number - self.base
+        if idx < 0 or idx >= len(self.file_ids) or self.file_ids[idx] < 0:
+            return None
+        file_id = self.file_ids[idx]
+        offset = self.cursors[file_id].offset(self.chunks[idx], self.counts[idx])
+        return (file_id, offset)
+
+    def locate(self, node):
+        '''
+        Location (file, line, column) of `node` (or None).
+        Lines and columns are numbered from 1.
+        '''
+        result = self.offset(node)
+        if result is None:
+            return None
+        (file_id, offset) = result
+        if self.lines[file_id] is None:
+            text = self.cursors[file_id].text
+            self.lines[file_id] = array('I', [0] + [m.end() for m in re.finditer('\n', text)])
+        line_starts = self.lines[file_id]
+        line = bisect_right(line_starts, offset)
+        column = offset - line_starts[line-1] + 1
+        return Location(self.files[file_id], line, column)
+
+    def renumber(self, serials):
+        '''
+        Reorder the positions for new serial numbers 0..n-1: the node 
+        numbered k was numbered serials[k] (see Parser.finish_tree).
+        '''
+        file_ids, chunks, counts = array('h'), array('I'), array('I')
+        size = len(self.file_ids)
+        for serial in serials:
+            idx = serial - self.base
+            if 0 <= idx < size:
+                file_ids.append(self.file_ids[idx])
+                chunks.append(self.chunks[idx])
+                counts.append(self.counts[idx])
+            else:
+                file_ids.append(-1)
+                chunks.append(0)
+                counts.append(0)
+        self.file_ids, self.chunks, self.counts = file_ids, chunks, counts
+        self.base = 0
+
+    def merge(self, other, offset=0):
+        '''
+        Append the positions recorded in the source map `other' 
+        (e.g. of a file parsed separately, see parallel.py). The serial 
+        numbers of its nodes have been shifted by `offset'.
+        '''
+        file_base = len(self.files)
+        self.files.extend(other.files)
+        self.cursors.extend(other.cursors)
+        self.lines.extend(other.lines)
+
+        start = other.base + offset - self.base
+        gap = start - len(self.file_ids)
+        if gap < 0:
+            raise Exception('Source maps overlap')
+        self.file_ids.extend([-1] * gap)
+        self.chunks.extend([0] * gap)
+        self.counts.extend([0] * gap)
+        self.file_ids.extend([-1 if i < 0 else i + file_base for i in other.file_ids])
+        self.chunks.extend(other.chunks)
+        self.counts.extend(other.counts)
@@ -7,6 +7,7 @@ These functions will be used by `LatexTree` objects for document processing
     - e.g. tree.write_xml(), tree.write_unicode(), tree.xref_table(), etc
 '''
 
+import threading
 from lxml import etree
 import logging
 log = logging.getLogger(__name__)
@@ -18,26 +19,31 @@ class Node():
     Abstract class for LatexTree nodes: 
         - Has only parent and children attributes
         - Additional attributes are defined in derived classes:
+
+    Instance attributes are stored in slots (there may be millions of
+    nodes). The taxonomy (species, genus and family) depends only on the
+    class, so it is stored as class attributes when the class is created
+    (see __init_subclass__ and registry.ClassFactory). Most nodes are
+    leaves, so `children` starts as the shared empty tuple and becomes a
+    list when the first child is added (see append_child).
     '''
+    __slots__ = ('serial_number', 'parent', 'children')
 
-    counter = 0  # serial numbers
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        set_taxonomy(cls)
 
     def __init__(self):
-        self.serial_number = Node.counter
-        Node.counter += 1
+        context = CONTEXT
+        ids = context.ids
+        if ids is None:
+            ids = context.ids = NodeIds()
+        self.serial_number = ids.count
+        ids.count += 1
+        if context.source_map:
+            context.source_map.record(self)
         self.parent = None
-        self.children = []
-
-        # Taxonomy info
-        # e.g.  species = itemize,  genus = List, family = Environment
-        # The last one currently fails for direct subclasses of `Node`
-        self.species = type(self).__name__
-        self.genus = type(self).__bases__[0].__name__
-        self.family = type(self).__bases__[0].__bases__[0].__name__
-
-        # info
-        log.debug('Node {} created ({})'.format(
-            self.serial_number, self.species))
+        self.children = ()
 
     def __repr__(self):
         return '{}()'.format(self.species)
@@ -86,9 +92,12 @@ class Node():
             raise TypeError('Cannot add type {} to LatexTreeNode.children'.format(
                 node.__class__.__name__))
 
-        # set parent and append to children
+        # set parent and append to children (a list from the first child)
         node.parent = self
-        self.children.append(node)
+        if self.children.__class__ is tuple:
+            self.children = [node]
+        else:
+            self.children.append(node)
 
     def append_children(self, node_list):
         '''
@@ -128,21 +137,132 @@ class Node():
         return self.parent.get_mpath() + '.' + hexstr
 
 
+class NodeIds():
+    '''
+    Serial numbers of the nodes of a tree. Each tree (each parse) has its
+    own allocator, so the numbers do not depend on what was parsed before.
+    Nodes are numbered as they are created, and some are discarded (e.g.
+    the empty row after the last \\\\ of a tabular), so the tree is
+    numbered again when it is finished (see Parser.finish_tree): the
+    numbers of the n nodes of a tree returned by the parser are then
+    dense (0..n-1) and can be used to index side arrays (e.g. the
+    positions in a SourceMap, see location.py). Nodes streamed by
+    iterparse are not numbered again.
+    '''
+    __slots__ = ('count',)
+
+    def __init__(self, start=0):
+        self.count = start      # next serial number
+
+    def __repr__(self):
+        return 'NodeIds({})'.format(self.count)
+
+    def reserve(self, n):
+        '''
+        Reserve `n' serial numbers and return the first one
+        (e.g. for nodes parsed in another process, see parallel.py).
+        '''
+        start = self.count
+        self.count += n
+        return start
+
+
+class NodeContext(threading.local):
+    '''
+    Allocator and source map of the tree being built (set by the parser, 
+    see Parser.building). Each thread has its own, so trees can be built
+    on several threads at once. Nodes created outside a parse are 
+    numbered by a default allocator for the thread.
+    '''
+    ids = None          # NodeIds
+    source_map = None   # source locations (see location.py)
+
+CONTEXT = NodeContext()
+
+
+def set_taxonomy(cls):
+    '''
+    Taxonomy info from the class hierarchy
+    e.g.  species = itemize,  genus = List, family = Environment
+    The family of a direct subclass of `Node` is `object`
+    '''
+    base = cls.__bases__[0]
+    cls.species = cls.__name__
+    cls.genus = base.__name__
+    cls.family = base.__bases__[0].__name__ if base.__bases__ else None
+
+set_taxonomy(Node)
+
+
+def tree_nodes(root):
+    '''
+    All nodes of the tree `root' (children, arguments, pre_children, 
+    post_children and the nodes in other attributes, e.g. markers). 
+    Faster than parallel.walk, which looks at every attribute.
+    '''
+    nodes = []
+    seen = set()
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        if id(node) in seen:
+            continue
+        seen.add(id(node))
+        nodes.append(node)
+        stack.extend(node.children)
+        args = getattr(node, 'args', None)
+        if args:
+            stack.extend([arg for arg in args.values() if arg is not None])
+        if getattr(node, 'pre_children', None) or getattr(node, 'post_children', None):
+            stack.extend(node.pre_children)
+            stack.extend(node.post_children)
+        for value in getattr(node, '__dict__', {}).values():
+            if isinstance(value, Node):
+                stack.append(value)
+            elif isinstance(value, dict):
+                stack.extend([x for x in value.values() if isinstance(x, Node)])
+            elif isinstance(value, (list, tuple)):
+                stack.extend([x for x in value if isinstance(x, Node)])
+    return nodes
+
+
+def node_items(node):
+    '''
+    Attributes of `node' as (name, value) pairs (slots and __dict__).
+    '''
+    for name in slot_names(type(node)):
+        if hasattr(node, name):
+            yield name, getattr(node, name)
+    if hasattr(node, '__dict__'):
+        yield from node.__dict__.items()
+
+
+# slot names keyed on class
+SLOT_NAMES = {}
+
+def slot_names(cls):
+    if not cls in SLOT_NAMES:
+        names = []
+        for klass in reversed(cls.__mro__):
+            slots = klass.__dict__.get('__slots__', ())
+            if isinstance(slots, str):
+                slots = (slots,)
+            names.extend(name for name in slots if not name in ('__dict__', '__weakref__'))
+        SLOT_NAMES[cls] = tuple(names)
+    return SLOT_NAMES[cls]
+
+
 class NodeList(list):
     '''
     List of Node objects. Implements basic type checking. 
     Simple extension of `list` useful for debugging.
     '''
-    counter = 0
-
     def __init__(self):
-        self.number = NodeList.counter
-        NodeList.counter += 1
         list.__init__(self)
-        log.info('NodeList {} created'.format(self.number))
+        log.info('NodeList %x created', id(self))
 
     def append(self, node):
         if not isinstance(node, Node):
             Exception('NodeList objects can only contain Node objects')
         super(NodeList, self).append(node)
-        log.debug('{} appended to Nodelist {}'.format(node, self.number))
+        log.debug('%s appended to Nodelist %x', node, id(self))
@@ -1,6 +1,9 @@
 # numeral.py
 
+import re
+
 from .node import Node
+from .misc import write_roman
 
 class Numeral(Node):
     '''
@@ -20,3 +23,49 @@ class Numeral(Node):
 
 
 
+# ---------------------------------------------------------------
+# Marker formats
+#
+# A marker format is the definition of \the<counter> e.g.
+#   \renewcommand{\thesubsection}{\arabic{section}.\alph{subsection}}
+# It is compiled once into a function which maps the counter values
+# to the marker (e.g. '3.b') so numbering a node costs a function call
+# (see Registry.marker_formatter)
+
+NUMERAL_STYLES = {
+    'arabic':   str,
+    'alph':     lambda n: chr(96 + n),
+    'Alph':     lambda n: chr(64 + n),
+    'roman':    lambda n: write_roman(n).lower(),
+    'Roman':    write_roman,
+    'fnsymbol': lambda n: FNSYMBOLS[n-1] if 0 < n <= len(FNSYMBOLS) else str(n),
+}
+
+FNSYMBOLS = ['*', '\u2020', '\u2021', '\u00a7', '\u00b6', '\u2016', '**', '\u2020\u2020', '\u2021\u2021']
+
+NUMERAL_RE = re.compile(r'\\(?P<style>{})\s*\{{\s*(?P<counter>[^{{}}\s]*)\s*\}}'.format(
+    '|'.join(NUMERAL_STYLES)))
+
+
+def compile_marker_format(tex_str):
+    r'''
+    Compile a marker format (e.g. '\arabic{section}.\alph{subsection}')
+    into a function which returns the marker given the counter values
+    (a dict keyed on counter name). Anything other than the numerals
+    \arabic{...}, \alph{...} etc. is copied as it stands.
+    '''
+    fields = []     # (style, counter_name) for each numeral
+    parts = []      # format string
+    pos = 0
+    for m in NUMERAL_RE.finditer(tex_str):
+        parts.append(tex_str[pos:m.start()].replace('{', '{{').replace('}', '}}'))
+        parts.append('{}')
+        fields.append((NUMERAL_STYLES[m.group('style')], m.group('counter')))
+        pos = m.end()
+    parts.append(tex_str[pos:].replace('{', '{{').replace('}', '}}'))
+    fmt = ''.join(parts)
+
+    def formatter(counters):
+        return fmt.format(*[style(counters.get(name, 0)) for (style, name) in fields])
+
+    return formatter
@@ -0,0 +1,239 @@
+# parallel.py
+r'''
+Parallel parsing of input files (\input, \include, ...).
+
+    root = parser.parse_file('main.tex', parallel=True, processes=4)
+
+The main file is parsed as usual except that input files are not parsed
+in place: each input command is submitted to an `InputPool' together
+with a snapshot of the registry and counters at that point, and the file
+is parsed in a worker process while the main parse carries on. When the
+main parse is done the subtrees are grafted onto the input commands in
+document order.
+
+The main file and the input files are parsed speculatively: definitions
+made in an input file (e.g. \newcommand in a chapter) are not seen by the
+main parser, nor by the workers parsing the later files. The results are
+checked in document order
+    - new species (unknown commands) created in an input file are added
+      to the registry, unless the name is used elsewhere with a different
+      base class (command or environment)
+    - if an input file changed the definitions, the later files are parsed
+      again with the new registry. This is only possible when the main file
+      makes no definitions and uses none of the new species after the
+      input command, otherwise the whole document is parsed again serially.
+
+Numbers and markers depend on all the preceding files so they are set
+in a final pass over the tree (see Parser.renumber).
+
+Each worker numbers the nodes of its file from 0. The serial numbers of
+the grafted nodes are shifted to unused ranges of the tree, so they are
+unique (and located by the source map). The finished tree is numbered
+0..n-1 (see Parser.finish_tree), but not in the same order as in a
+serial parse.
+'''
+
+import pickle
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from .node import Node, node_items
+from .parser import Parser, InputRecord
+
+import logging
+log = logging.getLogger(__name__)
+
+# attribute types which cannot contain nodes (see walk)
+SCALARS = (str, int, bool, float, type(None))
+
+# result of parse_input
+#   siblings    nodes parsed from .the file
+#   base        serial number of the first node
+#   count       number of serial numbers used
+#   source_map  positions of the nodes (or None)
+#   changed     species created or redefined (keyed on species name)
+#   registry    the new registry (None if the definitions have not changed)
+#   counters    the new counters (None if the definitions have not changed)
+#   inputs      input files parsed inside the file (see Parser.reparse)
+InputResult = namedtuple('InputResult', 
+    ['siblings', 'base', 'count', 'source_map', 'changed', 'registry', 'counters', 'inputs'])
+
+
+def parse_input(snapshot, filename, LATEX_ROOT, options, base=0):
+    '''
+    Worker function: parse the input file `filename' starting from .the
+    registry and counters in `snapshot' (pickled). Returns an InputResult.
+    Also used by Parser.reparse (in the same process), which numbers the
+    nodes from .`base' (the next serial number of its tree).
+    '''
+    registry, counters = pickle.loads(snapshot)
+    version = registry.version
+    species = registry.species.copy()
+    tables = [dict(table) for table in (registry.custom, registry.params, registry.theorem_names)]
+
+    parser = Parser(registry=registry, **options)
+    parser.counters = counters
+    parser.LATEX_ROOT = LATEX_ROOT
+
+    tokens = parser.tokenize_file(filename)
+    parser.start_tree(tokens, filename, base)
+    with parser.building():
+        siblings = parser.run(parser.parse_tokens(tokens))
+    count = parser.node_ids.count - base
+    if parser.source_map:
+        parser.source_map.stream = None
+
+    # species created or redefined by this file
+    # (the class is the same if a species is redefined with the same arguments)
+    changed = registry.species.changes(species)
+    for before, table in zip(tables, (registry.custom, registry.params, registry.theorem_names)):
+        for name, value in table.items():
+            if not before.get(name) == value and name in registry.species:
+                changed[name] = registry.species[name]
+
+    if registry.version == version:
+        return InputResult(list(siblings), base, count, parser.source_map, changed, None, None, parser.inputs)
+    return InputResult(list(siblings), base, count, parser.source_map, changed, registry, parser.counters, parser.inputs)
+
+
+def graft(parser, cmd, result, shift=True):
+    '''
+    Attach the nodes parsed from .an input file to the input command `cmd'.
+    The positions are copied into the source map of `parser'. Nodes parsed 
+    in another process (shift=True) are given serial numbers in a new range.
+    '''
+    offset = 0
+    if shift:
+        offset = parser.node_ids.reserve(result.count) - result.base
+        for node in walk(result.siblings):
+            node.serial_number += offset
+    else:
+        parser.node_ids.count = max(parser.node_ids.count, result.base + result.count)
+    if result.source_map and parser.source_map:
+        parser.source_map.merge(result.source_map, offset)
+    cmd.append_children(result.siblings)
+
+
+def walk(nodes):
+    '''
+    All nodes in the subtrees of `nodes' (children, arguments, markers, ...)
+    '''
+    seen = set()
+    stack = list(nodes)
+    while stack:
+        obj = stack.pop()
+        if isinstance(obj, Node):
+            if id(obj) in seen:
+                continue
+            seen.add(id(obj))
+            yield obj
+            for key, val in node_items(obj):
+                if not isinstance(val, SCALARS) and not key == 'parent':
+                    stack.append(val)
+        elif isinstance(obj, dict):
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple)):
+            stack.extend(obj)
+
+
+class InputJob():
+    '''
+    Input file submitted to the pool.
+    '''
+    def __init__(self, cmd, filename, serial, is_enum, enum_depth):
+        self.cmd = cmd                  # input command (parent of the subtree)
+        self.filename = filename
+        self.serial = serial            # first serial number after the command
+        self.is_enum = is_enum          # enum nesting tracker at the command
+        self.enum_depth = enum_depth
+        self.snapshot = None            # registry and counters (see start_job)
+        self.future = None
+
+
+class InputPool():
+    '''
+    Pool of worker processes which parse the input files of a document.
+    Used by Parser.parse_file (parallel=True).
+    '''
+    def __init__(self, parser, processes=None):
+        self.parser = parser
+        self.executor = ProcessPoolExecutor(processes)
+        self.jobs = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+    def submit(self, cmd, filename):
+        '''
+        Parse the input file `filename' of the input command `cmd'
+        in a worker process.
+        '''
+        registry = self.parser.registry
+        job = InputJob(cmd, filename, self.parser.node_ids.count, registry.is_enum, registry.enum_depth)
+        self.jobs.append(job)
+        self.start_job(job)
+
+    def start_job(self, job):
+        '''
+        Submit `job' with a snapshot of the current registry and counters.
+        '''
+        parser = self.parser
+        registry = parser.registry
+        is_enum, enum_depth = registry.is_enum, registry.enum_depth
+        registry.is_enum, registry.enum_depth = job.is_enum, job.enum_depth
+        try:
+            job.snapshot = parser.snapshot()
+        finally:
+            registry.is_enum, registry.enum_depth = is_enum, enum_depth
+        log.info('Parsing input file {} in parallel'.format(job.filename))
+        job.future = self.executor.submit(
+            parse_input, job.snapshot, job.filename, parser.LATEX_ROOT, parser.options())
+
+    def finish(self, root):
+        '''
+        Graft the parsed input files onto the tree `root' produced
+        by the main parse, then number the tree.
+        Returns False if the main file must be parsed again (serially).
+        '''
+        parser = self.parser
+        main_end = parser.node_ids.count
+
+        for idx, job in enumerate(self.jobs):
+            result = job.future.result()
+            graft(parser, job.cmd, result)
+            parser.inputs.append(InputRecord(job.cmd, job.filename, job.snapshot, bool(result.registry)))
+            parser.inputs.extend(result.inputs)
+
+            # new species only (unknown commands and environments)
+            if result.registry is None:
+                if not parser.add_species(result.changed):
+                    return False
+                continue
+
+            # definitions changed: check the rest of the main file
+            log.info('Definitions changed in {}'.format(job.filename))
+            for node in walk(root.children):
+                if job.serial <= node.serial_number < main_end:
+                    if node.genus == 'Macro' or node.species in result.changed:
+                        return False
+
+            # adopt the new registry (with the species created later in the
+            # main file) and parse the later input files again
+            registry, counters = result.registry, result.counters
+            for name, cls in parser.registry.species.items():
+                if not name in registry.species:
+                    dict.__setitem__(registry.species, name, cls)
+                    dict.__setitem__(registry.params, name, parser.registry.params.get(name, []))
+            counters.update(parser.counters)
+            parser.registry = registry
+            parser.counters = counters
+            for later in self.jobs[idx+1:]:
+                later.future.cancel()
+                self.start_job(later)
+
+        # numbers and markers
+        parser.renumber_all(root)
+        return True
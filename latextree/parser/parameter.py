@@ -38,7 +38,7 @@ ArgTable is an ordered dictionary so that we can reconstruct the source Latex co
 
 
 '''
-from collections import namedtuple, OrderedDict
+from collections import namedtuple
 from .content import Text, Number
 from .group import Group
 from .node import Node
@@ -82,25 +82,20 @@ class OptArg(Node):
         return '{}:{}()'.format(self.genus, self.species)
 
 
-class ArgTable(OrderedDict):
+class ArgTable(dict):
     '''
     An ordered dictionary of arguments. 
     We need to remember the order in which arguments are parsed, so that they
     can be printed in the correct order when recovering the source. 
+    (dicts keep insertion order, and every command has an ArgTable, so we
+    use a slotted dict rather than an OrderedDict)
         - delimited arguments are Group objects
         - undelimited arguments are Node objects (Command, Text ...)
     TODO: basic type checking
         - allowed types are Group, Command, OptArg, Text
+    Use ArgTable.fromkeys(names) for a table of argument names (values None).
     '''
-    counter = 0  # for debugging
-
-    def __init__(self, keys=None):
-        self.number = ArgTable.counter
-        ArgTable.counter += 1
-        OrderedDict.__init__(self)
-        if keys:  # list of argument names
-            for key in keys:
-                OrderedDict.__setitem__(self, key, None)
+    __slots__ = ()
 
     def insert(self, arg):
         # if not isinstance(arg, Node):
@@ -105,7 +105,11 @@ Some examples:
 '''
 
 import os
+import re
 import json
+import pickle
+import contextlib
+from collections import namedtuple
 
 # logging
 import logging
@@ -118,21 +122,29 @@ logging.basicConfig(
 # log.setLevel(logging.DEBUG)
 log.setLevel(logging.INFO)
 
-from .tokens import Token, TokenStream, EndToken
-from .node import Node, NodeList
+from .tokens import Token, TokenStream, EndToken, COMMANDS, CHARS, PRINTABLE
+from .tokens import LBRACE, RBRACE, DOLLAR, AMPERSAND, HASH, STAR, LBRACKET, RBRACKET
+from .tokens import tokenize
+from .tokens import BEGIN, END, ITEM, HLINE, NEWLINE
+from .tokens import MATH_OPEN, MATH_CLOSE, DISPLAY_OPEN, DISPLAY_CLOSE
+from .node import Node, NodeList, NodeIds, CONTEXT, tree_nodes
 from .group import Group
 from .command import Command, Declaration, Environment
 from .command import Input, Macro, UserDefined
-from .command import Superscript, Subscript, ActiveCharacter
+from .command import Superscript, Subscript, ActiveCharacter, Verb
 from .parameter import Parameter, ArgTable, OptArg
 from .maths import Inline, Display
 from .tabular import Row, Cell
 from .content import Text, Number
 from .vertical import ParagraphBreak
 from .comment import Comment
-from .registry import Registry, ClassFactory
+from .registry import Registry, ClassFactory, read_defs_file
+from .location import SourceMap
+from .engine import ENGINES, run_stepwise
+from .events import EventStream
+from .selection import Selector
+from .limits import ExpansionBudget, ExpansionLimitExceeded
 
-from .misc import write_roman
 # spec
 from .coredefs import defs
 
@@ -140,6 +152,41 @@ from .coredefs import defs
 from lxml import etree
 from termcolor import colored
 
+# raw verbatim tokens (see parse_verbatim)
+VERB_RE = re.compile(r'\\verb(?P<star>\*?)(?P<delim>.)(?P<text>.*)(?P=delim)\Z', re.DOTALL)
+VERBATIM_RE = re.compile(r'''\\begin(?P<pre_space>\s*)\{(?P<env>[^*}]+)(?P<star>\*?)\}
+    (?P<text>.*)\\end(?P<post_space>\s*)\{(?P=env)(?P=star)\}\Z''', re.DOTALL | re.VERBOSE)
+
+# end of the preamble (see read_preamble)
+# code before the comment of a line (control symbols such as \% and \\ are
+# skipped as pairs: % after an even number of backslashes starts a comment)
+CODE_RE = re.compile(r'(?:[^\\%]+|\\.)*', re.DOTALL)
+PREAMBLE_END_RE = re.compile(r'\\begin\s*\{document\}|\\document(?![a-zA-Z])')
+
+
+def read_preamble(f):
+    r'''
+    Source read from .the file object `f' up to \begin{document} (or the 
+    tex-style \document). The rest of the file is not read.
+    '''
+    lines = []
+    for line in f:
+        code = CODE_RE.match(line).group()
+        m = PREAMBLE_END_RE.search(code)
+        if m:
+            lines.append(line[:m.start()])
+            break
+        lines.append(line)
+    return ''.join(lines)
+
+
+# input files parsed by parse_file (see reparse)
+#   cmd         the input command (parent of the subtree)
+#   filename    the input file
+#   snapshot    registry and counters before the file was parsed
+#   defines     True if the file changed the definitions 
+InputRecord = namedtuple('InputRecord', ['cmd', 'filename', 'snapshot', 'defines'])
+
 
 class Parser():
     '''
@@ -147,38 +194,137 @@ class Parser():
     The main `parse` function returns a Node object of type Root
     The `Parser` class only deals with string input. 
         - the `LatexTree` class handles file i/o.
+    The recursive parse_* functions are generators which are run
+    by a parsing engine (see engine.py)
+        - engine='recursive' (default) or engine='iterative'
+    An existing registry can be passed as `registry' (e.g. a snapshot 
+    of the registry of another parser, see parallel.py)
+    A parser can be reused for many documents (see reset).
+    Parse events can be streamed instead of building the tree 
+    (see iterparse).
+    A single chapter or section can be parsed from .a file without 
+    parsing the rest of the document (see parse_file).
+    The expansion of user-defined macros is bounded by `limits', a dict 
+    with keys max_tokens, max_depth and max_time (see limits.py).
     '''
 
-    def __init__(self):
+    def __init__(self, columnar=False, locations=True, engine='recursive', registry=None, limits=None):
+
+        # token stream backend (see tokens.TokenBuffer)
+        self.columnar = columnar
+
+        # source locations of nodes (see location.py)
+        self.locations = locations
+
+        # parsing engine (see engine.py)
+        if not engine in ENGINES:
+            raise Exception('Parsing engine {} not recognised'.format(engine))
+        self.engine = engine
+        self.run = ENGINES[engine]
+
+        # expansion limits (see limits.py)
+        self.limits = dict(limits or {})
+        self.budget = ExpansionBudget(**self.limits)
+
+        # token handlers for parse_tokens (keyed on catcode)
+        self.handlers = {
+            0: self.parse_control_sequence,
+            1: self.parse_begin_group,
+            3: self.parse_mathmode,
+            4: self.parse_character,
+            6: self.parse_character,
+            7: self.parse_script,
+            8: self.parse_script,
+            9: self.parse_null,
+            13: self.parse_active_character,
+            14: self.parse_comment,
+            17: self.parse_verbatim,
+        }
+
+        # definitions (coredefs and definitions files, see read_defs_file)
+        # and the registry built from .them (shared, see registry.py)
+        self.defs_list = (defs,)
+        self.prototype = Registry.prototype(*self.defs_list)
+
+        # init registry, counters etc.
+        self.reset()
+        if registry is not None:
+            self.registry = registry
+            self.counters = dict.fromkeys(self.registry.numbered.keys(), 0)
+
+
+    def reset(self):
+        '''
+        Reset the parser for a new document: the registry is a new copy 
+        of the prototype (definitions made in the last document are 
+        discarded) and the counters are set to zero.
+        '''
+        # init registry
+        self.registry = self.prototype.copy()
+
+        # init counters
+        self.counters = dict.fromkeys(self.registry.numbered.keys(), 0)
 
         # source root (set in `parse_file')
         self.LATEX_ROOT = None
 
-        # init registry
-        self.registry = Registry(defs)
+        # serial numbers of the nodes of the last tree (see node.py)
+        self.node_ids = None
 
-        # init counters
-        self.counters = dict.fromkeys(self.registry.numbered.keys(), 0)
+        # source locations of nodes (see location.py)
+        self.source_map = None
+
+        # input files parsed in parallel (set in `parse_file', see parallel.py)
+        self.input_pool = None
+
+        # main file, input files and the initial state (set in `parse_file')
+        self.tex_main = None
+        self.inputs = []
+        self.start = None
+
+        # parse events (set in `iterparse', see events.py)
+        self.events = None
+
+        # selected block (set in `parse_file', see selection.py)
+        self.selector = None
+
+
+    def options(self):
+        '''
+        Keyword arguments for creating a parser with the same options.
+        '''
+        return {
+            'columnar': self.columnar, 
+            'locations': self.locations, 
+            'engine': self.engine,
+            'limits': self.limits,
+        }
 
 
     def read_defs_file(self, defs_file):
         '''
-        Parse definitions in JSON format.
+        Parse definitions in JSON format. 
+        The registry is reset to a copy of the prototype 
+        for the new definitions (see registry.py)
         '''
-        try:
-            with open(defs_file, 'r') as input_file:
-                log.info('Reading definitions from {}'.format(defs_file))           
-                more_defs = json.load(input_file)
-                self.registry.update_defs(more_defs)
-        
-        except FileNotFoundError as e:
-            raise Exception('File {} not found'.format(e.filename))
-        
-        # reset counters table (all defs should be loaded before parsing begins)
+        more_defs = read_defs_file(defs_file)
+        self.defs_list = self.defs_list + (more_defs,)
+        self.prototype = Registry.prototype(*self.defs_list)
+
+        # reset registry and counters table (all defs should be loaded before parsing begins)
+        self.registry = self.prototype.copy()
         self.counters = dict.fromkeys(self.registry.numbered.keys(), 0)
 
 
 
+    def tokenize(self, s):
+        '''
+        Tokenize a string (or file object). Comments and verbatim
+        environments are read as raw tokens (see tokens.py)
+        '''
+        return TokenStream(s, columnar=self.columnar, verbatim=self.registry.verbatim)
+
+
     def tokenize_file(self, tex_file):
         '''
         Read and tokenize a tex file
@@ -186,36 +332,221 @@ class Parser():
         try:
             with open(tex_file) as f:
                 log.info('Reading from .{}'.format(tex_file))
-                return TokenStream(f.read())
+                tokens = self.tokenize(f)
+                if self.source_map:
+                    self.source_map.add_file(tex_file, tokens)
+                return tokens
 
         except FileNotFoundError as e:
             raise Exception('File {} not found'.format(e.filename))
 
 
-    def parse_file(self, tex_main, LATEX_ROOT=None):
+    def parse_file(self, tex_main, LATEX_ROOT=None, parallel=False, processes=None, select=None):
         r'''
         Any source containing \input or \include cmds
         must be parsed from .a main source file to set
         LATEX_ROOT and thus find the input files.
+
+        parallel=True parses the input files in a pool of `processes'
+        worker processes (see parallel.py). The resulting tree is the
+        same as the tree produced by the serial parse.
+
+        select='chapter:3' (or 'section:2.1', 'label:sec:intro') parses 
+        the preamble and the selected block of the document only. The 
+        rest of the document is skipped by a scanner, which keeps the 
+        counters so the selected block is numbered as in a full parse 
+        (see selection.py).
+
+        The input files are recorded in `inputs' (see reparse).
         '''
         if not LATEX_ROOT:
             self.LATEX_ROOT = os.path.dirname(os.path.abspath(tex_main))
         else:
             self.LATEX_ROOT = LATEX_ROOT
 
+        if select:
+            if parallel:
+                raise Exception('Selective parsing cannot be combined with parallel=True')
+            self.selector = Selector(select, self.registry)
+            try:
+                return self.parse_file(tex_main, LATEX_ROOT=self.LATEX_ROOT)
+            finally:
+                self.selector = None
+
+        if parallel:
+            from .parallel import InputPool
+            with InputPool(self, processes) as pool:
+                self.input_pool = pool
+                try:
+                    root = self.parse_file(tex_main, LATEX_ROOT=self.LATEX_ROOT)
+                finally:
+                    self.input_pool = None
+                with self.building():
+                    finished = pool.finish(root)
+                if finished:
+                    self.finish_tree(root)
+                    return root
+
+            # definitions in an input file change the main file: parse again
+            log.info('Parallel parse failed, parsing {} again'.format(tex_main))
+            self.restore(self.start)
+            return self.parse_file(tex_main, LATEX_ROOT=self.LATEX_ROOT)
+
+        self.tex_main = tex_main
+        self.inputs = []
+        self.start = self.snapshot()
+
         try:
             with open(tex_main) as f:
                 log.info('Reading from .{}'.format(tex_main))
-                tokens = TokenStream(f.read())
-                siblings =  self.parse_tokens(tokens)
-                root = ClassFactory('Root', [], BaseClass=Node)() # instantiate!
-                root.append_children(siblings)
+                tokens = self.tokenize(f)
+                self.start_tree(tokens, tex_main)
+                self.budget.start()
+                with self.building():
+                    siblings = self.run(self.parse_tokens(tokens))
+                    root = ClassFactory('Root', [], BaseClass=Node)() # instantiate!
+                    root.append_children(siblings)
+                # the input pool numbers the tree once the input files are grafted
+                if not self.input_pool:
+                    self.finish_tree(root)
                 return(root)
 
         except FileNotFoundError as e:
             raise Exception('File {} not found'.format(e.filename))
 
 
+    def parse_preamble(self, tex_main, LATEX_ROOT=None):
+        r'''
+        Parse the preamble of `tex_main' only: the file is read up to 
+        \begin{document} (see read_preamble) and the rest is neither 
+        tokenized nor parsed. Definitions made in the preamble are 
+        recorded in the registry as usual. Returns the root of the tree 
+        (the preamble nodes).
+        '''
+        if not LATEX_ROOT:
+            self.LATEX_ROOT = os.path.dirname(os.path.abspath(tex_main))
+        else:
+            self.LATEX_ROOT = LATEX_ROOT
+        self.tex_main = tex_main
+        self.inputs = []
+
+        try:
+            with open(tex_main) as f:
+                log.info('Reading preamble from .{}'.format(tex_main))
+                tokens = self.tokenize(read_preamble(f))
+        except FileNotFoundError as e:
+            raise Exception('File {} not found'.format(e.filename))
+
+        self.start_tree(tokens, tex_main)
+        self.budget.start()
+        with self.building():
+            siblings = self.run(self.parse_tokens(tokens))
+            root = ClassFactory('Root', [], BaseClass=Node)() # instantiate!
+            root.append_children(siblings)
+        self.finish_tree(root)
+        return root
+
+
+    def reparse(self, root, changed_paths):
+        r'''
+        Parse the input files in `changed_paths' again (e.g. after editing 
+        a chapter) and replace their subtrees in the tree `root' returned by 
+        `parse_file'. The numbers and markers are then set again.
+
+        The whole document is parsed again (from .the initial state) if the 
+        main file changed, or if the old or new version of a changed file 
+        makes definitions, which may change the way later files are parsed.
+        The updated tree is numbered again from 0 (see finish_tree).
+        Returns the root of the updated tree.
+        '''
+        from .parallel import parse_input, graft
+
+        changed_paths = set(os.path.abspath(path) for path in changed_paths)
+        if os.path.abspath(self.tex_main) in changed_paths:
+            return self.parse_file_again()
+
+        # changed files (not inside other changed files)
+        records = [r for r in self.inputs if os.path.abspath(r.filename) in changed_paths]
+        changed_cmds = set(id(r.cmd) for r in records)
+        for record in records:
+            node = record.cmd.parent
+            while node and not id(node) in changed_cmds:
+                node = node.parent
+            if node:
+                continue
+            if record.defines:
+                return self.parse_file_again()
+
+            # parse with the state before the file (in this process)
+            log.info('Parsing {} again'.format(record.filename))
+            result = parse_input(record.snapshot, record.filename, self.LATEX_ROOT, self.options(),
+                                 base=self.node_ids.count)
+            if result.registry:
+                return self.parse_file_again()
+            if not self.add_species(result.changed):
+                return self.parse_file_again()
+
+            # replace the subtree (and the records of the files inside it)
+            record.cmd.children = []
+            graft(self, record.cmd, result, shift=False)
+            idx = self.inputs.index(record)
+            self.inputs = [r for r in self.inputs if not self.is_inside(r.cmd, record.cmd)]
+            self.inputs[idx:idx] = result.inputs
+
+        with self.building():
+            self.renumber_all(root)
+        self.finish_tree(root)
+        return root
+
+
+    def parse_file_again(self):
+        '''
+        Parse the main file again from .the initial state.
+        '''
+        log.info('Parsing {} again'.format(self.tex_main))
+        self.restore(self.start)
+        return self.parse_file(self.tex_main, LATEX_ROOT=self.LATEX_ROOT)
+
+
+    def is_inside(self, node, ancestor):
+        '''
+        True if `node' is `ancestor' or one of its descendants.
+        '''
+        while node and not node is ancestor:
+            node = node.parent
+        return node is ancestor
+
+
+    def add_species(self, species):
+        '''
+        Add the species (created while parsing an input file) to the registry.
+        Returns False if a species of the same name has a different
+        base class (e.g. used elsewhere as an environment).
+        '''
+        for name, cls in species.items():
+            if not name in self.registry.species:
+                dict.__setitem__(self.registry.species, name, cls)
+                dict.__setitem__(self.registry.params, name, [])
+            elif not self.registry.species[name].__bases__ == cls.__bases__:
+                log.info('Species {} redefined'.format(name))
+                return False
+        return True
+
+
+    def snapshot(self):
+        '''
+        Copy of the registry and counters (pickled).
+        '''
+        return pickle.dumps((self.registry, self.counters))
+
+
+    def restore(self, snapshot):
+        '''
+        Restore the registry and counters from .a snapshot.
+        '''
+        self.registry, self.counters = pickle.loads(snapshot)
+
+
     def parse(self, s, **kwargs):
         r'''
         Parse a latex string. This should be the only entry point!
@@ -227,13 +558,17 @@ class Parser():
         log.info('input: {}'.format(s))
         
         # parse
-        tokens = TokenStream(s)
+        tokens = self.tokenize(s)
         log.info('tokens: {}'.format(tokens))
-        siblings =  self.parse_tokens(tokens, **kwargs)
-        
-        # create root node
-        root = ClassFactory('Root', [], BaseClass=Node)() # instantiate!
-        root.append_children(siblings)
+        self.start_tree(tokens, '<string>')
+        self.budget.start()
+        with self.building():
+            siblings = self.run(self.parse_tokens(tokens, **kwargs))
+
+            # create root node
+            root = ClassFactory('Root', [], BaseClass=Node)() # instantiate!
+            root.append_children(siblings)
+        self.finish_tree(root)
 
         # post processing
         # set labels (post-hoc because it relies on parents)
@@ -245,23 +580,136 @@ class Parser():
         return root
 
 
-    def parse_tokens(self, tokens, stop_tokens=[], replace_stop_token=False, **kwargs):
+    def iterparse(self, source):
+        r'''
+        Parse a latex string (or file object) and yield parse events 
+        (start, text, end) as parsing proceeds, instead of returning the 
+        tree (see events.py). Finished subtrees are not kept. Macros are 
+        expanded and nodes numbered as in `parse'. 
+        The iterative engine is used whatever the engine option.
+        '''
+        tokens = self.tokenize(source)
+        self.node_ids = NodeIds()
+        self.source_map = None
+        self.events = EventStream()
+        events = self.events.events
+        self.budget.start()
+        steps = run_stepwise(self.parse_tokens(tokens))
+        try:
+            # building while parsing only (not while the caller 
+            # handles the events, it may build other trees)
+            done = False
+            while not done:
+                done = True
+                with self.building():
+                    for _ in steps:
+                        if events:
+                            done = False
+                            break
+                while events:
+                    yield events.popleft()
+        finally:
+            self.events = None
+
+
+    def open_node(self, node):
+        '''
+        The contents of `node' are parsed next (see iterparse).
+        '''
+        if self.events is not None:
+            self.events.open(node)
+
+
+    def close_node(self, node):
+        '''
+        The contents of `node' have been parsed (see iterparse).
+        '''
+        if self.events is not None:
+            self.events.close(node)
+
+
+    def quietly(self, gen):
+        '''
+        Run the parser generator `gen' without streaming its nodes, e.g.
+        arguments (see iterparse).
+        '''
+        if self.events is None:
+            return gen
+        return self.events.quietly(gen)
+
+
+    def start_tree(self, tokens, name, base=0):
+        '''
+        Start a new tree for the main token stream: a new allocator for 
+        the serial numbers of its nodes (starting at `base') and a new 
+        source map (if locations are enabled). Nodes are numbered and 
+        recorded while the parser is `building'.
+        '''
+        self.node_ids = NodeIds(base)
+        self.source_map = None
+        if self.locations:
+            self.source_map = SourceMap(base=base)
+            self.source_map.add_file(name, tokens)
+            self.source_map.stream = tokens
+
+
+    def finish_tree(self, root):
+        '''
+        Number the nodes of the tree `root' 0..n-1 (in the order they were
+        created) and reorder the source map to match. Nodes created while
+        parsing but left out of the tree (e.g. the empty row after the
+        last \\\\ of a tabular, the subtree replaced by `reparse') also took
+        serial numbers, so the numbers are only dense once the tree is
+        finished.
+        '''
+        nodes = sorted(tree_nodes(root), key=lambda node: node.serial_number)
+        serials = [node.serial_number for node in nodes]
+        for (idx, node) in enumerate(nodes):
+            node.serial_number = idx
+        self.node_ids.count = len(nodes)
+        if self.source_map:
+            self.source_map.renumber(serials)
+
+
+    @contextlib.contextmanager
+    def building(self):
+        '''
+        Nodes created in this thread are numbered by `node_ids' and 
+        recorded in `source_map' (see node.py). The previous allocator
+        and source map are restored on exit, so parses can be nested.
+        '''
+        context = CONTEXT
+        saved = (context.ids, context.source_map)
+        context.ids, context.source_map = self.node_ids, self.source_map
+        try:
+            yield
+        finally:
+            context.ids, context.source_map = saved
+
+
+    def parse_tokens(self, tokens, stop_tokens=frozenset(), replace_stop_token=False, **kwargs):
         r'''
         The main recursive function.
         Parses the token stream until the first stop token is encountered.
         Returns a :py:class:`NodeList` object. 
+        This is a generator (run by self.run, see engine.py)
         '''      
 
-        # init return list
-        siblings = NodeList()
+        # init return list (streamed by iterparse)
+        siblings = NodeList() if self.events is None else self.events.siblings()
         
         # check for empty stream or EndToken
         if not tokens or tokens.peek() == EndToken:
             return siblings  # empty
 
-        # allow single stop tokens to be specified (default is list)
+        # allow single stop tokens to be specified (default is a set)
         if isinstance(stop_tokens, Token):
-            stop_tokens = [stop_tokens]
+            stop_tokens = frozenset([stop_tokens])
+        elif not isinstance(stop_tokens, frozenset):
+            stop_tokens = frozenset(stop_tokens)
+
+        # noexpand flag
+        noexpand = kwargs.get('noexpand', False)
 
         # init output buffer for printable characters (catcodes 10,11,12)
         output = []
@@ -273,15 +721,15 @@ class Parser():
              # pop next
             t = tokens.pop()
             log.debug('PARSE_TOKENS')
-            log.debug('Curr token:  {}'.format(t))
-            log.debug('Stop tokens: {}'.format(stop_tokens))
+            log.debug('Curr token:  %s', t)
+            log.debug('Stop tokens: %s', stop_tokens)
             
             # --------------------
             # check for stop token
             if t in stop_tokens:
 
-                log.debug('Stop token found: {}'.format(t))
-                log.debug('replace_stop_token = {}'.format(replace_stop_token))
+                log.debug('Stop token found: %s', t)
+                log.debug('replace_stop_token = %s', replace_stop_token)
 
                 # return stop token to stream if required
                 if replace_stop_token:
@@ -293,13 +741,13 @@ class Parser():
                     siblings.append(Text(s))
 
                 # return nodes 
-                log.debug('End recursion and return: {}'.format(siblings))
+                log.debug('End recursion and return: %s', siblings)
                 return siblings
                 
             
             # --------------------
             # check for noexpand (repeat verbatim until next stop token)
-            if 'noexpand' in kwargs and kwargs['noexpand']:
+            if noexpand:
                 if t.catcode == 0:
                     output.append('\\')
                 output.append(t.value)
@@ -312,61 +760,32 @@ class Parser():
             # these are accumulated in the output buffer
             # and dumped into Text() nodes when a non-printable
             # character is encountered.
-            if t.catcode in [10, 11, 12]:
+            if t.catcode in PRINTABLE:
                 
-                # append to output buffer
-                log.debug("'{}' added to output buffer".format(t.value))
+                # append to output buffer (with the rest of the run)
+                log.debug("'%s' added to output buffer", t.value)
                 output.append(t.value)
+                output.append(tokens.take_text(stop_tokens))
                 continue
 
             # if not a printable character, print buffer contents 
             # into a Text node, then branch on remaining catcodes
             else:
                 if output:
-                    log.debug("'{}' appended as Text node".format(''.join(output)))
+                    log.debug("'%s' appended as Text node", output)
                     siblings.append(Text(''.join(output)))
                     output = []  # empty ready for the next time
 
-            
             # --------------------
-            # Command (0, cmd_name)
-            if t.catcode == 0:
-                log.info('Command token is: {}'.format(t))
-                    
-                # init node 
-                node = None
-
-                # push token back onto stream before invoking
-                # parse_environment or parse_command. This avoids
-                # having to pass the `node' object as an
-                # argument to these functions
-                tokens.push(t)
-
-                # environment
-                if t.value == 'begin':
-                    node = self.parse_environment(tokens)
-                # tex-style environment
-                elif self.registry.is_environment(t.value):
-                    node = self.parse_environment(tokens, tex_style=True)
-                # command 
-                else:
-                    node = self.parse_command(tokens)
-                
-                # append to return list
-                if node:
+            # Most catcodes are dispatched to a handler (see `handlers')
+            # which returns a node (or None), or a generator which is
+            # run by the engine to produce the node
+            handler = self.handlers.get(t.catcode)
+            if handler:
+                node = yield handler(tokens, t)
+                if node is not None:
                     siblings.append(node)
 
-            # --------------------
-            # Begin Group (1, '{')
-            elif (t.catcode == 1):
-                
-                # replace token and call parse_group
-                tokens.push(t)
-                node = self.parse_group(tokens)
-                
-                # append to output
-                siblings.append(node)
-
             # --------------------
             # End Group (2, '}') 
             elif t.catcode == 2:
@@ -374,39 +793,6 @@ class Parser():
                 # we should never reach here ... 
                 assert(False)
                 
-            # --------------------
-            # Mathmode (3, '$')
-            elif t.catcode == 3:
-                
-                node = None
-
-                # display ($$)
-                if tokens and tokens.peek() == Token(3,'$'):
-                    tokens.pop()
-                    node = Display()
-                    kids = self.parse_tokens(tokens, Token(3,'$'))
-                    if tokens and tokens.peek() == Token(3,'$'):
-                        tokens.pop()
-                        node.append_children(kids)
-                    else:
-                        raise Exception('double dollars don\'t match')
-                
-                # inline ($)
-                else:
-                    node = Inline()
-                    kids = self.parse_tokens(tokens, Token(3,'$'))
-                    node.append_children(kids)
-
-                # append to output
-                if node:
-                    siblings.append(node)
-
-            # --------------------
-            # Alignment (4, '&')
-            # These are dealt with in parse_tabular
-            elif t.catcode == 4:
-                siblings.append(Text(text='&'))
-            
             # --------------------
             # Alignment (5, '\n')
             elif t.catcode == 5: 
@@ -430,59 +816,6 @@ class Parser():
                         output.append(t.value)
                         output.extend(spaces)
                 
-            # --------------------
-            # Parameter (6, '#') 
-            # These are dealt with in parse_macro
-            elif t.catcode == 6:
-                siblings.append(Text(text='#')) # append to text
-
-            # --------------------
-            # Superscript (^)
-            elif t.catcode == 7:
-                # create node
-                node = Superscript()
-                # return token and parse argument
-                tokens.push(t)
-                node.args = self.parse_arguments(tokens)
-                # append to output
-                siblings.append(node)
-
-            # --------------------
-            # Subscript (_)
-            elif t.catcode == 8:
-                # create node
-                node = Subscript()
-                # return token and parse argument
-                tokens.push(t)
-                node.args = self.parse_arguments(tokens)
-                # append to output
-                siblings.append(node)
-
-            # --------------------
-            # Invalid character (null) 
-            elif t.catcode == 9:
-                # do nothing (continue to next token)
-                pass
-
-            # --------------------
-            # Active characters - usually only tilde (~)
-            elif t.catcode == 13:
-                # create ActiveCharactoer object
-                ac = ActiveCharacter(t.value)
-                # TODO: we need to parse arguments here!!!
-                pass
-                # append to output
-                siblings.append(ac)
-
-            # --------------------
-            # Comment (%)
-            elif t.catcode == 14:
-                # return token and call parse_comment
-                tokens.push(t)
-                comment_node = self.parse_comment(tokens)
-                # append to output
-                siblings.append(comment_node)
-                
             # --------------------
             # Invalid character
             elif t.catcode == 15:
@@ -497,10 +830,111 @@ class Parser():
         
         # return siblings
         # Note: the end_token cleans up any trailing characters
-        log.debug('End parse_tokens with final token: {}'.format(t))
+        log.debug('End parse_tokens with final token: %s', t)
         return siblings
 
 
+    # --------------------
+    # Handlers for parse_tokens (keyed on catcode).
+    # Each is passed the stream and the current token (already popped)
+    # and returns a node (or None) or a generator (see engine.py).
+
+    def parse_control_sequence(self, tokens, t):
+        '''
+        Command (0, cmd_name)
+        '''
+        log.info('Command token is: {}'.format(t))
+
+        # push token back onto stream before invoking
+        # parse_environment or parse_command. This avoids
+        # having to pass the `node' object as an
+        # argument to these functions
+        tokens.push(t)
+
+        # environment
+        if t.value == 'begin':
+            return self.parse_environment(tokens)
+        # tex-style environment
+        elif self.registry.is_environment(t.value):
+            return self.parse_environment(tokens, tex_style=True)
+        # command 
+        return self.parse_command(tokens)
+
+
+    def parse_begin_group(self, tokens, t):
+        '''
+        Begin Group (1, '{')
+        '''
+        # replace token and call parse_group
+        tokens.push(t)
+        return self.parse_group(tokens)
+
+
+    def parse_mathmode(self, tokens, t):
+        '''
+        Mathmode (3, '$')
+        '''
+        # display ($$)
+        if tokens and tokens.peek() == DOLLAR:
+            tokens.pop()
+            node = Display()
+            self.open_node(node)
+            kids = yield self.parse_tokens(tokens, DOLLAR)
+            self.close_node(node)
+            if tokens and tokens.peek() == DOLLAR:
+                tokens.pop()
+                node.append_children(kids)
+            else:
+                raise Exception('double dollars don\'t match')
+        
+        # inline ($)
+        else:
+            node = Inline()
+            self.open_node(node)
+            kids = yield self.parse_tokens(tokens, DOLLAR)
+            self.close_node(node)
+            node.append_children(kids)
+
+        return node
+
+
+    def parse_character(self, tokens, t):
+        '''
+        Alignment (4, '&') and Parameter (6, '#')
+        These are dealt with in parse_tabular and parse_macro
+        so here they are appended as text
+        '''
+        return Text(text=t.value)
+
+
+    def parse_script(self, tokens, t):
+        '''
+        Superscript (^) and Subscript (_)
+        '''
+        # create node
+        node = Superscript() if t.catcode == 7 else Subscript()
+        # return token and parse argument
+        tokens.push(t)
+        node.args = yield self.quietly(self.parse_arguments(tokens))
+        return node
+
+
+    def parse_null(self, tokens, t):
+        '''
+        Ignored character (null): do nothing (continue to next token)
+        '''
+        return None
+
+
+    def parse_active_character(self, tokens, t):
+        '''
+        Active characters - usually only tilde (~)
+        '''
+        # create ActiveCharacter object
+        # TODO: we need to parse arguments here!!!
+        return ActiveCharacter(t.value)
+
+
     def parse_group(self, tokens, noexpand=False):
         '''
         Input is a `TokenStream' object. First token must be (1, '{')
@@ -508,33 +942,22 @@ class Parser():
         Returns a `Group' object
         '''
         t = tokens.pop()
-        if not t == Token(1,'{'):
+        if not t == LBRACE:
             raise Exception('Error: parse_group: first token must be (1,{)')
         
         node = Group()
         # expand 
         if not noexpand:
-            sibs = self.parse_tokens(tokens, Token(2, '}'))
+            self.open_node(node)
+            sibs = yield self.parse_tokens(tokens, RBRACE)
+            self.close_node(node)
         
         # noexpand (used in macros)
-        # any stack symbols would do the trick
+        # the source up to the matching brace is taken as it stands
+        # (only braces are matched, so a definition can contain an
+        # unmatched \begin or \end e.g. \newenvironment{x}{\begin{y}}{\end{y}})
         else:
-            s = ''
-            stack = ['{']
-            while stack:
-                if tokens.peek() == Token(1,'{'):
-                    stack.append('{')
-                elif tokens.peek() == Token(2,'}'):
-                    stack.pop()
-                elif tokens.peek == Token(0,'begin'):
-                    stack.append('begin')
-                elif tokens.peek == Token(0,'end'):
-                    stack.pop()
-                if tokens.peek().catcode == 0:
-                    s += '\\'
-                s += tokens.pop().value
-            s = s[:-1] # discard final '}'
-            sibs = [Text(s)]
+            sibs = [Text(tokens.take_group())]
 
         node.append_children(sibs)
         return node
@@ -555,27 +978,29 @@ class Parser():
 
         # check for starred
         starred = False
-        if tokens.peek() == Token(12,'*'):
+        if tokens.peek() == STAR:
             tokens.pop()
             starred = True
 
         # mathmode 
         #   - Inline is a subclass of Group
         #   - Display is a subclass of Environment
-        if t in [Token(0, '('), Token(0, '[')]:
+        if t in [MATH_OPEN, DISPLAY_OPEN]:
 
             # display or inline            
-            if t == Token(0,'('):
+            if t == MATH_OPEN:
                 node = Inline(delimiter='latex')
-                stop_token = Token(0, ')')
+                stop_token = MATH_CLOSE
             else:
                 node = Display(delimiter='latex')
-                stop_token = Token(0, ']')
+                stop_token = DISPLAY_CLOSE
 
             # parse tokens and deal with spaces
             if tokens and tokens.peek().catcode == 16:
                 node.pre_space = tokens.pop().value
-            sibs = self.parse_tokens(tokens, stop_token)
+            self.open_node(node)
+            sibs = yield self.parse_tokens(tokens, stop_token)
+            self.close_node(node)
             node.append_children(sibs)
             if tokens and tokens.peek().catcode == 16:
                 node.post_space = tokens.pop().value
@@ -591,11 +1016,14 @@ class Parser():
         
         # replace original token (which carries the command name)
         # then parse arguments 
+        # (the source tokens of the arguments of user-defined commands are
+        # recorded for the expansion, see expand_template)
         tokens.push(t)
+        arg_tokens = [] if cmd.species in self.registry.custom else None
         if cmd.genus == 'Macro':
-            cmd.args = self.parse_arguments(tokens, noexpand=True)
+            cmd.args = yield self.quietly(self.parse_arguments(tokens, noexpand=True))
         else:
-            cmd.args = self.parse_arguments(tokens)
+            cmd.args = yield self.quietly(self.parse_arguments(tokens, arg_tokens=arg_tokens))
         
         # set parent node of arguments (messy - it would be better to pass cmd to parse_arguments)
         for arg in filter(None, cmd.args.values()):
@@ -605,41 +1033,8 @@ class Parser():
         if not cmd.starred:
             self.set_number(cmd)
         
-        # --------------------
-        # numbers
-        #
-        # Genus `Numeric' are cmds of the form `\arabic{chapter}' or `\alph{section}' 
-        # All species of genus `Numeric' have a named
-        # argument called `counter'. We want to set the
-        # content to be a Number() object - these store
-        # integer values (Text objects store strings).
-        # We attach the number as a child of the `Numeric' object
-        # not as an attribute: the only named parameter of
-        # a `numeric' object is `counter' (which specifies which
-        # counter value to record). This applies to the species
-        # but not specifically to this phenotype.
-
-        if cmd.genus == 'Numeral' and 'counter' in cmd.args:
-            cmd.noexpand = True
-            counter_name = ''.join([x.chars() for x in cmd.args['counter'].children])
-            if counter_name in self.counters:
-                cmd.value = int(self.counters[counter_name])
-
-        # Genus `NumericLabel' represents cmd of the form
-        #   '\thechapter', `\thesection', ...
-        # which are macros defined by e.g
-        #   \renewcommand{\thesection}{\arabic{chapter}.\alph{section}}
-        # We may want to pass these along to the writer functions
-        #
-        # This is an example of on-the-fly expansion!!
-
-        if cmd.species[:3] == 'the' and cmd.species[3:] in self.counters:
-            counter_name = cmd.species[3:]
-            tex_str = self.registry.marker_formats[counter_name]
-            new_tokens = TokenStream(tex_str)
-            sibs = self.parse_tokens(new_tokens)
-            cmd.noexpand = True
-            cmd.append_children(sibs)
+        # numbers (\arabic{chapter}) and markers (\thechapter)
+        self.set_value(cmd)
 
         # --------------------
         # block commands (non-leaf)
@@ -660,29 +1055,36 @@ class Parser():
             # default stop tokens:
             #   - same token e.g. (0, 'item') or (0, 'section), and 
             #   - end token (0, 'end') (end-of-list for items, end-of-document for sections)
-            stop_tokens = [t, Token(0,'end')]  
-
+            #
             # additional stop tokens (from registry.block_commands):
             #   - (0, 'chapter') for (0, 'section')
             #   - (0, 'itemize') for (0, 'item')
-            stop_tokens += [Token(0,s) for s in self.registry.block_commands[cmd.species]] 
-
+            #
             # extra stop tokens to catch tex-style environments
             #   - e.g. (0, 'enddocument'), or (0, 'enditemize')
             # TODO: Are these now obsolete because tex-style 
             # environments are caught in `parse_tokens'?
-            stop_tokens += [Token(0,'end'+s) for s in self.registry.block_commands[cmd.species]] 
+            #
+            # The complete sets are precomputed in the registry.
+            stop_tokens = self.registry.block_command_stops[cmd.species]
 
-            sibs = self.parse_tokens(tokens, stop_tokens, replace_stop_token=True)
+            # sectioning commands outside the selected block (see parse_file)
+            if self.selector and self.selector.seeking and cmd.species in self.selector.sections:
+                sibs = yield self.select_block(cmd, tokens, stop_tokens)
+            else:
+                self.open_node(cmd)
+                sibs = yield self.parse_tokens(tokens, stop_tokens, replace_stop_token=True)
+                self.close_node(cmd)
             cmd.append_children(sibs) 
         
         #--------------------
         # declarations
         elif cmd.species in self.registry.block_declarations:
             log.info('block declaration: {}'.format(cmd.species))
-            stop_tokens = [Token(0,'end'), Token(2,'}'), Token(12,']'), Token(0,'item'),]
-            stop_tokens += self.registry.block_declarations[cmd.species]
-            sibs = self.parse_tokens(tokens, stop_tokens, replace_stop_token=True)
+            stop_tokens = self.registry.block_declaration_stops[cmd.species]
+            self.open_node(cmd)
+            sibs = yield self.parse_tokens(tokens, stop_tokens, replace_stop_token=True)
+            self.close_node(cmd)
             cmd.append_children(sibs)
   
         #--------------------
@@ -704,18 +1106,21 @@ class Parser():
         elif cmd.species in self.registry.custom:
 
             log.info('User-defined command: {}'.format(cmd.species))
-            print('User-defined command: {}'.format(cmd.species))
 
-            # retrieve and expand command definition
-            tex_str = self.registry.custom[cmd.species]
-            exp_str = self.expand_custom_def(tex_str, cmd.args.values())
+            # retrieve command definition (compiled into a template)
+            # and substitute the arguments
+            template = self.custom_template(cmd.species)
+            new_tokens = self.expand_template(template, cmd.args.values(), arg_tokens)
+            self.budget.expand(cmd.species, len(new_tokens))
 
-            # tokenize (the end_token is needed to stop the recursion in the right place)
-            new_tokens = TokenStream(exp_str)
-            tokens.extend(new_tokens)
+            # splice (the end_token is needed to stop the recursion in the right place)
+            tokens.splice_tokens(new_tokens)
 
             # parse tokens into children
-            sibs = self.parse_tokens(tokens)
+            self.open_node(cmd)
+            sibs = yield self.parse_tokens(tokens)
+            self.close_node(cmd)
+            self.budget.done()
             cmd.append_children(sibs)
 
         # --------------------
@@ -739,15 +1144,99 @@ class Parser():
                     if not filename[-4:] == '.tex':
                         filename += '.tex'
                 filename = os.path.join(self.LATEX_ROOT, filename)
+
+            # parallel mode: the file is parsed by the input pool
+            # and the children are attached later (see parallel.py)
+            if self.LATEX_ROOT and self.input_pool:
+                self.input_pool.submit(cmd, filename)
+
+            elif self.LATEX_ROOT:
+                snapshot = self.snapshot()
+                version = self.registry.version
                 newtoks = self.tokenize_file(filename) # inc end_token
-                sibs = self.parse_tokens(newtoks)
+                if self.source_map:
+                    stream, self.source_map.stream = self.source_map.stream, newtoks
+                self.open_node(cmd)
+                if self.selector and self.selector.seeking:
+                    sibs = yield self.select_tokens(newtoks)
+                else:
+                    sibs = yield self.parse_tokens(newtoks)
+                self.close_node(cmd)
+                if self.source_map:
+                    self.source_map.stream = stream
                 cmd.append_children(sibs)
+                record = InputRecord(cmd, filename, snapshot, self.registry.version != version)
+                self.inputs.append(record)
 
         # --------------------
         # return cmd object
         return cmd
 
 
+    def select_tokens(self, tokens, stop_tokens=frozenset(), replace_stop_token=False):
+        r'''
+        Parse the token stream up to the first stop token (as parse_tokens)
+        outside the selected block (see parse_file). The source is skipped
+        up to the next sectioning, input or macro command, which is parsed
+        as usual, and only these commands are returned. Once the selected
+        block has been parsed the rest of the source is skipped. Streams
+        which are not read from .the source (macro expansions) are parsed
+        as usual.
+        '''
+        if isinstance(stop_tokens, Token):
+            stop_tokens = frozenset([stop_tokens])
+        selector = self.selector
+        siblings = NodeList()
+
+        while True:
+            position = tokens.source_position()
+            if position is None:
+                sibs = yield self.parse_tokens(tokens, stop_tokens, replace_stop_token)
+                siblings.extend(sibs)
+                return siblings
+
+            # skip to the next command (or the end of the block)
+            text, pos, end = position
+            mode = 'fast' if selector.found else 'seek'
+            pos, _ = selector.scan(text, pos, end, stop_tokens, self.registry, self.counters, mode)
+            tokens.seek(pos)
+
+            t = tokens.peek()
+            if t is None or t.catcode == 15:
+                tokens.pop()
+                return siblings
+            if t in stop_tokens:
+                if not replace_stop_token:
+                    tokens.pop()
+                return siblings
+            if t.catcode == 0 and t.value in selector.stops:
+                node = yield self.parse_control_sequence(tokens, tokens.pop())
+                siblings.append(node)
+                continue
+
+            # unbalanced braces or environments: parse the rest as usual
+            sibs = yield self.parse_tokens(tokens, stop_tokens, replace_stop_token)
+            siblings.extend(sibs)
+            return siblings
+
+
+    def select_block(self, cmd, tokens, stop_tokens):
+        '''
+        Contents of the sectioning command `cmd' outside the selected
+        block: parsed if `cmd' is selected, otherwise skipped (see
+        select_tokens).
+        '''
+        selector = self.selector
+        if not selector.matches(cmd, tokens, self.registry, self.counters, stop_tokens):
+            return (yield self.select_tokens(tokens, stop_tokens, replace_stop_token=True))
+        selector.seeking = False
+        self.open_node(cmd)
+        sibs = yield self.parse_tokens(tokens, stop_tokens, replace_stop_token=True)
+        self.close_node(cmd)
+        selector.found = True
+        return sibs
+
+
     def parse_environment(self, tokens, tex_style=False, **kwargs):
         '''
         Parse environment. The first token must be (0,'begin').
@@ -758,16 +1247,16 @@ class Parser():
         env_name = ''
         pre_space = ''
         post_space = ''
-        stop_token = Token(0,'end') # overwritten for tex-style
+        stop_token = END # overwritten for tex-style
         starred = False
 
         # tex environments
         if tex_style:
             env_name = tokens.pop().value
-            if tokens.peek() == Token(12, '*'):
+            if tokens.peek() == STAR:
                 tokens.pop()
                 starred = True
-            stop_token = Token(0, 'end'+env_name)
+            stop_token = COMMANDS['end'+env_name]
             # record trailing whitespace (after \itemize) if any
             if tokens.peek().catcode == 16:
                 pre_space = tokens.pop().value
@@ -789,7 +1278,7 @@ class Parser():
             tokens.pop()                        # pop '{'
             while tokens.peek().catcode == 11:  # pop name
                 env_name += tokens.pop().value
-            if tokens.peek() == Token(12, '*'):
+            if tokens.peek() == STAR:
                 tokens.pop()
                 starred = True
             if not tokens.peek().catcode == 2:
@@ -804,8 +1293,10 @@ class Parser():
             env.tex_style = True
         
         # push dummy token (0,'env_name') to stream and call parse_arguments
-        tokens.push(Token(0,env_name))
-        env.args = self.parse_arguments(tokens, parse_undelimited=False)
+        # (source tokens of the arguments recorded for user-defined environments)
+        tokens.push(COMMANDS[env_name])
+        arg_tokens = [] if env_name in self.registry.custom else None
+        env.args = yield self.quietly(self.parse_arguments(tokens, parse_undelimited=False, arg_tokens=arg_tokens))
 
         # set number
         if not env.starred:
@@ -817,70 +1308,62 @@ class Parser():
 
         # lists
         if env.genus == 'List':
-            if env.species == 'itemize':
-                self.registry.is_enum = False
-                sibs = self.parse_tokens(tokens, stop_token)
-            else:
-                self.registry.is_enum = True
-                self.registry.enum_depth += 1
-                # if self.registry.enum_depth == 4:
-                #     self.counters['enumiv'] += 1
-                # elif self.registry.enum_depth == 3:
-                #     self.counters['enumiii'] += 1
-                # if self.registry.enum_depth == 2:
-                #     self.counters['enumii'] +=1
-                # if self.registry.enum_depth == 1:
-                #     self.counters['enumi'] += 1
-                sibs = self.parse_tokens(tokens, stop_token)
-                self.registry.enum_depth -= 1
-                if self.registry.enum_depth < 4:
-                    self.counters['enumiv'] = 0
-                if self.registry.enum_depth < 3:
-                    self.counters['enumiii'] = 0
-                if self.registry.enum_depth < 2:
-                    self.counters['enumii'] = 0
-                if self.registry.enum_depth < 1:
-                    self.counters['enumi'] = 0
+            self.begin_list(env)
+            self.open_node(env)
+            sibs = yield self.parse_tokens(tokens, stop_token)
+            self.close_node(env)
+            self.end_list(env)
 
 
         # tabular
         elif env.species == 'tabular':
             log.info('tabular.args is {}'.format(env.args))
             colspec = ''.join([x.chars() for x in env.args['cols'].children])
-            sibs = self.parse_tabular(colspec, tokens, **kwargs)
+            sibs = yield self.quietly(self.parse_tabular(colspec, tokens, **kwargs))
             
             
         # verbatim
         elif env.genus == 'Verbatim':
-            sibs = self.parse_tokens(tokens, stop_token, noexpand=True)
+            self.open_node(env)
+            sibs = yield self.parse_tokens(tokens, stop_token, noexpand=True)
+            self.close_node(env)
 
         # user-defined
         elif env.species in self.registry.custom:
             
             log.info('User-defined environment: {}'.format(env.species))
-            # extract source from registry.custom
-            tex_str_pre, tex_str_post = self.registry.custom[env.species]  
+            # templates compiled from .the source in registry.custom
+            template_pre, template_post = self.custom_template(env.species)
             
             # substitute argument values for the placeholders (#1, #2, etc.)
-            # These are only allowed in the `begdef' argument (tex_str_pre)
-            # TODO: this repeats the code for user-defined macros (bad)
-            for pos, arg in enumerate(env.args.values()):
-                seed = '#' + str(pos+1)
-                s = arg.chars()
-                if arg.species == 'Group':
-                    s = ''.join([x.chars() for x in arg.children])
-                tex_str_pre = tex_str_pre.replace(seed, s)
-            env.pre_children  = self.parse_tokens(TokenStream(tex_str_pre))
-            env.post_children = self.parse_tokens(TokenStream(tex_str_post))
-            sibs = self.parse_tokens(tokens, stop_token)
+            # These are only allowed in the `begdef' argument (template_pre)
+            pre = self.expand_template(template_pre, env.args.values(), arg_tokens)
+            post = self.expand_template(template_post, [])
+            self.budget.expand(env.species, len(pre) + len(post))
+            pre_tokens = TokenStream(end_token=False)
+            pre_tokens.splice_tokens(pre)
+            post_tokens = TokenStream(end_token=False)
+            post_tokens.splice_tokens(post)
+            env.pre_children  = yield self.quietly(self.parse_tokens(pre_tokens))
+            env.post_children = yield self.quietly(self.parse_tokens(post_tokens))
+            self.budget.done()
+            self.open_node(env)
+            sibs = yield self.parse_tokens(tokens, stop_token)
+            self.close_node(env)
+
+        # document body outside the selected block (see parse_file)
+        elif env.species == 'document' and self.selector and self.selector.seeking:
+            sibs = yield self.select_tokens(tokens, stop_token)
 
         # default (parse contents)
         else:
-            sibs = self.parse_tokens(tokens, stop_token)
+            self.open_node(env)
+            sibs = yield self.parse_tokens(tokens, stop_token)
+            self.close_node(env)
         
         # recursion terminated by (0,'end') or (0, 'enditemize')
         # now tidy up ...
-        if tokens.peek() == Token(12,'*'): # pop star if any
+        if tokens.peek() == STAR: # pop star if any
             tokens.pop()
         if tokens and tokens.peek().catcode == 16:
             post_space = tokens.pop().value
@@ -890,7 +1373,7 @@ class Parser():
             tokens.pop()                        # pop '{'
             while tokens and tokens.peek().catcode == 11:  # pop env name
                 tokens.pop()
-            if tokens and tokens.peek() == Token(12, '*'): # pop star if any
+            if tokens and tokens.peek() == STAR: # pop star if any
                 tokens.pop()
             if tokens and not tokens.peek().catcode == 2:
                 raise Exception("Right brace '}}' expected.")
@@ -902,7 +1385,7 @@ class Parser():
         return env
 
 
-    def parse_arguments(self, tokens, noexpand=False, parse_undelimited=True):
+    def parse_arguments(self, tokens, noexpand=False, parse_undelimited=True, arg_tokens=None):
         r'''
         Parse the arguments of a command.
         input: `tokens`: a `TokenStream` object (see tokens.py)
@@ -943,6 +1426,10 @@ class Parser():
             - \hspace* adds horizontal space that will not disappear at the beginning of a line.
             - \\* creates a new line which will not cause a page break (so control characters can have starred forms).
             - \tag* (in amsmath) allows you to add markers to replace equation numbers.
+
+        If `arg_tokens' is a list, the source tokens of each argument are
+        appended to it (None if they could not be recorded, see 
+        TokenStream.record), e.g. for expanding user-defined commands.
         '''
 
         # init
@@ -991,13 +1478,15 @@ class Parser():
             # starred version (always optional)
             # now dealt with in parse_command and parse_environment
             if param_type == 's':
-                # if tokens.peek() == Token(12, '*'):
+                # if tokens.peek() == STAR:
                 #     tokens.pop()
                 #     starred = True
                 pass
 
             # optional argument 
             elif param_type == 'o': 
+                if arg_tokens is not None:
+                    rec = tokens.record()
 
                 # check for left bracket
                 # TODO: parse arg and kwargs and store somewhere
@@ -1005,11 +1494,11 @@ class Parser():
                 #
                 # 
                 log.debug('Parsing optional argument ...')
-                if tokens.peek() == Token(12, '['):
+                if tokens.peek() == LBRACKET:
                     tokens.pop()
                     arg = OptArg()
                     # s = ''
-                    # while not tokens.peek() == Token(12, ']'):
+                    # while not tokens.peek() == RBRACKET:
                     #     if tokens.peek().catcode == 0:
                     #         s += '\\'
                     #     s += tokens.pop().value
@@ -1019,27 +1508,32 @@ class Parser():
                     # doubles = [item.split('=') for item in items if '=' in item]
                     # doubles = dict(doubles)
 
-                    sibs = self.parse_tokens(tokens, Token(12, ']')) # stop token not replaced
+                    sibs = yield self.parse_tokens(tokens, RBRACKET) # stop token not replaced
                     arg.append_children(sibs)
                     argTable.__setitem__(param_name, arg)
 
                 else:
                     log.debug('Optional argument {} not provided for  {}'.format(param_name, cmd_name))
                     argTable.__setitem__(param_name, None)
+                if arg_tokens is not None:
+                    arg_tokens.append(tokens.stop_record(rec))
 
             # mandatory argument
             elif param_type == 'm': 
 
                 if tokens.peek().catcode == 16:
                     arg.post_space = tokens.pop().value
+                if arg_tokens is not None:
+                    rec = tokens.record()
 
                 # delimited arguments
                 # check for left brace
                 if tokens.peek().catcode == 1:
-                    arg = self.parse_group(tokens, noexpand=noexpand)  # returns Group object
-                    log.debug('arg is {}'.format(arg))
-                    log.debug('arg.chars() is {}'.format(arg.chars()))
-                    log.debug('next token is {}'.format(tokens.peek()))
+                    arg = yield self.parse_group(tokens, noexpand=noexpand)  # returns Group object
+                    if log.isEnabledFor(logging.DEBUG):
+                        log.debug('arg is {}'.format(arg))
+                        log.debug('arg.chars() is {}'.format(arg.chars()))
+                        log.debug('next token is {}'.format(tokens.peek()))
 
                 # undelimited arguments (ignored in parse_environment)
                 # if no left brace, the next token is the argument
@@ -1065,6 +1559,8 @@ class Parser():
                 
                 # record argument
                 argTable.__setitem__(param_name, arg)
+                if arg_tokens is not None:
+                    arg_tokens.append(tokens.stop_record(rec))
 
             else:
                 raise Exception('Argument type {} not recognised'.format(param_type))
@@ -1092,6 +1588,9 @@ class Parser():
         It is enough to write
             if cmd.args['name']:
         ''' 
+        # definitions change from .here on (see parallel.py)
+        self.registry.version += 1
+
         #----------
         # 1. \newtheorem
         #   cmd defn is \newtheorem{name}[numbered_like]{caption}[numbered_within]
@@ -1211,6 +1710,10 @@ class Parser():
             if new_species_name[0] == '\\':
                 new_species_name = new_species_name[1:]
 
+            # marker formats e.g. \renewcommand{\thesection}{\Roman{section}}
+            if self.set_marker_format(cmd, new_species_name):
+                return
+
             # extract parameters
             params = []
             if 'numargs' in cmd.args and cmd.args['numargs']: # number of arguments
@@ -1308,10 +1811,10 @@ class Parser():
             # iterate over row contents
             row = Row()
             column_index = 0
-            while tokens.peek() not in [Token(0,'end'), Token(0,'\\')]:
+            while tokens.peek() not in [END, NEWLINE]:
                 
                 # extract hlines and set row format
-                while tokens.peek() == Token(0, 'hline'):
+                while tokens.peek() == HLINE:
                     name = tokens.pop().value
                     hline = self.registry.create_phenotype(name, base_class=Command)
 
@@ -1325,16 +1828,16 @@ class Parser():
                 cell.format = column_formats[column_index]
                 column_index += 1
 
-                stop_tokens = [Token(0,'end'), Token(4,'&'), Token(0, '\\')]
-                kids = self.parse_tokens(tokens, stop_tokens, replace_stop_token=True)
+                stop_tokens = [END, AMPERSAND, NEWLINE]
+                kids = yield self.parse_tokens(tokens, stop_tokens, replace_stop_token=True)
                 cell.append_children(kids)
                 row.append_child(cell)
                 
                 # pop (4, '&') token that is replaced by parse_tokens
                 # but keep (0, '\\') which serves to break the loop
-                if tokens.peek() == Token(4, '&'):
+                if tokens.peek() == AMPERSAND:
                     tokens.pop()
-                # elif tokens.peek() == Token(0, '\\'):
+                # elif tokens.peek() == NEWLINE:
                 #     row.append_child(self.registry.create_phenotype('Backslash'))
             
             # append row
@@ -1346,8 +1849,8 @@ class Parser():
                     prev_row.format += 'B'*len(row.format)
             
             #   continue to next row if next token is (0, '\\')
-            if tokens.peek() == Token(0, '\\'):
-                node = self.parse_command(tokens)
+            if tokens.peek() == NEWLINE:
+                node = yield self.parse_command(tokens)
                 row.append_child(node)
                 continue
 
@@ -1360,72 +1863,141 @@ class Parser():
         return siblings
 
 
-    def parse_comment(self, tokens):
+    def parse_comment(self, tokens, t=None):
         '''
-        Parse comment. 
+        Parse comment. The first token is the raw comment token (14,'%...\n')
+        carrying the source of the comment (see tokens.py).
         The opening comment character (%) and the closing newline are discarded.
-        We need to convert tokens back to chars
+        The token can be passed as `t' if it has already been popped.
         '''        
         # first token must be comment character
-        t = tokens.pop()
+        if t is None:
+            t = tokens.pop()
         if not t.catcode == 14:
             return None
-        
-        # convert tokens back to chars, until we encounter a newline token
-        chars = ''
-        t = tokens.pop() 
-        while tokens and not t.catcode == 5:
-            if t.catcode == 0:
-                chars += '\\{}'.format(t.value)
-                if tokens.peek().catcode == 16:
-                    post_space = tokens.pop().value
-                    if post_space and post_space[-1] == '\n':
-                        chars += post_space[:-1]
-                        break
-                    else:
-                        chars += post_space
-                if t.value in ['begin', 'end']:
-                    chars += '{{{}}}'.format(tokens.pop().value)
+
+        # strip comment character and newline
+        text = t.value[1:]
+        if text.endswith('\n'):
+            return Comment(text[:-1])
+        return Comment(text, newline=False)
+
+
+    def parse_verbatim(self, tokens, t):
+        r'''
+        Parse a raw verbatim token (17, source), either
+            \verb|...|   or \verb*|...|
+            \begin{verbatim} ... \end{verbatim} (or any Verbatim environment)
+        The contents are recorded as a single Text node.
+        '''
+        # inline
+        m = VERB_RE.match(t.value)
+        if m:
+            node = Verb(m.group('text'), delimiter=m.group('delim'))
+            node.starred = bool(m.group('star'))
+            return node
+
+        # environment
+        m = VERBATIM_RE.match(t.value)
+        if not m:
+            raise Exception('Verbatim token {} not recognised'.format(t))
+        env = self.registry.create_phenotype(m.group('env'), base_class=Environment)
+        env.starred = bool(m.group('star'))
+        env.pre_space = m.group('pre_space')
+        env.post_space = m.group('post_space')
+        env.append_child(Text(m.group('text')))
+        return env
+
+
+    def custom_template(self, species_name):
+        '''
+        Token template for the custom definition of `species_name'
+        (recorded in registry.custom by some macro command eg \newcommand)
+        User-defined environments have a pair of templates (begdef, enddef).
+        Templates are compiled once and cached in registry.templates
+        until the definition changes (e.g. \renewcommand).
+        '''
+        source = self.registry.custom[species_name]
+        cached = self.registry.templates.get(species_name)
+        if cached and cached[0] is source:
+            return cached[1]
+
+        if isinstance(source, tuple):
+            template = tuple([self.compile_template(s) for s in source])
+        else:
+            template = self.compile_template(source)
+        self.registry.templates[species_name] = (source, template)
+        return template
+
+
+    def compile_template(self, tex_str):
+        '''
+        Tokenize a custom definition (latex source format). 
+        The parameter names #1, #2, ... are replaced by slots: the 
+        integers 0, 1, ... (argument positions) in the list of tokens.
+        '''
+        template = []
+        for t in tokenize(tex_str, end_token=False, verbatim=self.registry.verbatim):
+            if template and template[-1] is HASH and t.catcode == 12 and t.value in '123456789':
+                template[-1] = int(t.value) - 1
             else:
-                chars += t.value
-            t = tokens.pop()
-        
-        # return comment node
-        return Comment(chars)
+                template.append(t)
+        return template
 
 
-    def expand_custom_def(self, tex_str, args):
+    def expand_template(self, template, args, arg_tokens=None):
         '''
-        Parse custom command. Returns a list of Node objects.
-        `tex_str':
-            - a custom command definition in latex source format
-            - recorded in registry.custom by some macro command (eg \newcommand)
-            - might contain parameter names #1, #2, ...
-        arg_list': 
+        Expand a custom definition. Returns a list of tokens.
+        `template':
+            - list of tokens and parameter slots (see compile_template)
+        `args': 
             - list of Node objects passed as arguments.
             - usually cmd.args.values() where cmd is the macro name
-        The function expands `tex_str' by replacing the parameter names with 
-        these arguments converted back into Latex format. The expanded command
-        is then tokenized and parsed in the usual way.
-
+        `arg_tokens':
+            - the source tokens of the arguments recorded while they were
+              parsed (see parse_arguments), or None
+        The tokens of the arguments are spliced into the template in place 
+        of the slots. The expanded command is then parsed in the usual way.
+        Arguments whose tokens were not recorded are converted back into 
+        Latex format and tokenized.
         '''
-        # init expanded str
-        exp_str = tex_str
-
-        # substitute arguments for parameters
+        # argument tokens
         # check for None type (optional arguments)
-        for pos, arg in enumerate(args):
-            seed = '#' + str(pos+1)
+        values = []
+        for idx, arg in enumerate(args):
+            recorded = arg_tokens[idx] if arg_tokens else None
+            if recorded is not None:
+                # the contents of a group (without the braces)
+                if arg and arg.species == 'Group':
+                    recorded = recorded[1:-1]
+                values.append(recorded)
+                continue
             s = ''
             if arg:
                 if arg.species == 'Group':
                     s = ''.join([x.chars() for x in arg.children])
                 else:
                     s = arg.chars()
-            exp_str = exp_str.replace(seed, s)    
+            # text without control sequences or comments maps directly to character tokens
+            if '\\' in s or '%' in s:
+                values.append(tokenize(s, end_token=False, verbatim=self.registry.verbatim))
+            else:
+                values.append(list(map(CHARS.__getitem__, s)))
+
+        # substitute arguments for parameters
+        # (parameters without arguments are left as they are)
+        tokens = []
+        for item in template:
+            if not type(item) is int:
+                tokens.append(item)
+            elif item < len(values):
+                tokens.extend(values[item])
+            else:
+                tokens.append(HASH)
+                tokens.append(CHARS[str(item+1)])
         
-        # return expanded string
-        return exp_str
+        # return expanded tokens
+        return tokens
 
 
     def set_number(self, node, **kwargs):
@@ -1460,8 +2032,6 @@ class Parser():
         if not counter_name:
             return
 
-        print('set_number: {}'.format(node.species))
-        
         # increment counter and set number
         # counters for numbered and numbered_like species should have
         # been created and included in self.counters by this point
@@ -1469,37 +2039,183 @@ class Parser():
         self.counters[counter_name] += 1
         node.number = self.counters[counter_name]
 
-        # set marker
-        s = '\\arabic{{{}}}'.format(counter_name)
-        if counter_name in self.registry.marker_formats:
-            s = self.registry.marker_formats[counter_name]
-        new_tokens = TokenStream(s)
-        num_str = []
-        for numeral in self.parse_tokens(new_tokens):
-            print(numeral)
-            if not numeral.genus == 'Numeral':
-                num_str.append(numeral.chars())
-                continue
-            if numeral.species == 'arabic':
-                num_str.append(str(numeral.value))
-            elif numeral.species == 'Alph':
-                num_str.append(chr(64 + numeral.value))
-            elif numeral.species == 'alph':
-                num_str.append(chr(96 + numeral.value))
-            elif numeral.species == 'Roman':
-                num_str.append(write_roman(numeral.value))
-            elif numeral.species == 'roman':
-                num_str.append(write_roman(numeral.value).lower())
-            else:
-                print('NUMERAL SPECIES {} NOT RECOGNISED'.format(numeral.species))
-        print(num_str)
-        node.marker = Text(''.join(num_str))
+        # set marker (compiled marker format, see numeral.py)
+        formatter = self.registry.marker_formatter(counter_name)
+        node.marker = Text(formatter(self.counters))
 
         # reset other counters
         if node.species in self.registry.numbered:
             for counter_name in self.registry.numbered[node.species]:
                 self.counters[counter_name] = 0
-        
+
+
+    def set_value(self, cmd):
+        r'''
+        Set the value of numbers and markers from .the current counters.
+
+        Genus `Numeric' are cmds of the form `\arabic{chapter}' or `\alph{section}' 
+        All species of genus `Numeric' have a named
+        argument called `counter'. We want to set the
+        content to be a Number() object - these store
+        integer values (Text objects store strings).
+        We attach the number as a child of the `Numeric' object
+        not as an attribute: the only named parameter of
+        a `numeric' object is `counter' (which specifies which
+        counter value to record). This applies to the species
+        but not specifically to this phenotype.
+
+        Genus `NumericLabel' represents cmd of the form
+          '\thechapter', `\thesection', ...
+        which are macros defined by e.g
+          \renewcommand{\thesection}{\arabic{chapter}.\alph{section}}
+        We may want to pass these along to the writer functions
+
+        The marker is computed from .the compiled marker format 
+        (see numeral.py) and recorded as a Text child
+        '''
+        if cmd.genus == 'Numeral' and 'counter' in cmd.args:
+            cmd.noexpand = True
+            counter_name = ''.join([x.chars() for x in cmd.args['counter'].children])
+            if counter_name in self.counters:
+                cmd.value = int(self.counters[counter_name])
+
+        if cmd.species[:3] == 'the' and cmd.species[3:] in self.counters:
+            counter_name = cmd.species[3:]
+            formatter = self.registry.marker_formatter(counter_name)
+            cmd.noexpand = True
+            cmd.children = []
+            cmd.append_child(Text(formatter(self.counters)))
+
+
+    def macro_name(self, cmd):
+        '''
+        Name of the command or environment defined by the macro `cmd'
+        (without the leading backslash) or None.
+        '''
+        arg = cmd.args.get('name')
+        if not arg:
+            return None
+        if arg.species == 'Group':
+            name = ''.join([x.chars() for x in arg.children])
+        else:
+            name = arg.chars()
+        if name[:1] == '\\':
+            name = name[1:]
+        return name
+
+
+    def set_marker_format(self, cmd, species_name):
+        r'''
+        Marker formats e.g. \renewcommand{\thesection}{\Roman{section}}
+        update registry.marker_formats (see numeral.py). 
+        Returns False if `species_name' is not of the form the<counter>.
+        '''
+        if not (species_name[:3] == 'the' and species_name[3:] in self.counters):
+            return False
+        if cmd.args['def']:
+            tex_str = ''.join([x.chars() for x in cmd.args['def'].children])
+            self.registry.update_marker_formats({species_name[3:]: tex_str})
+        return True
+
+
+    def begin_list(self, env):
+        '''
+        Update the enum nesting tracker at the start of a list.
+        '''
+        if env.species == 'itemize':
+            self.registry.is_enum = False
+        else:
+            self.registry.is_enum = True
+            self.registry.enum_depth += 1
+
+
+    def end_list(self, env):
+        '''
+        Update the enum nesting tracker (and reset the enum 
+        counters) at the end of a list.
+        '''
+        if env.species == 'itemize':
+            return
+        self.registry.enum_depth -= 1
+        if self.registry.enum_depth < 4:
+            self.counters['enumiv'] = 0
+        if self.registry.enum_depth < 3:
+            self.counters['enumiii'] = 0
+        if self.registry.enum_depth < 2:
+            self.counters['enumii'] = 0
+        if self.registry.enum_depth < 1:
+            self.counters['enumi'] = 0
+
+
+    def renumber_all(self, root):
+        '''
+        Set the numbers and markers of the tree `root' again starting 
+        from .the initial state (see parse_file).
+        '''
+        registry, counters = pickle.loads(self.start)
+        self.renumber(root.children, counters, registry.marker_formats, 
+            registry.is_enum, registry.enum_depth)
+
+
+    def renumber(self, nodes, counters, marker_formats, is_enum=False, enum_depth=0):
+        r'''
+        Set the numbers and markers of `nodes' (and their descendants)
+        again, starting from .the given counters and marker formats. 
+        The calls to set_number, set_value, set_marker_format and 
+        begin_list/end_list made by the parser are repeated in the 
+        same order (arguments before the node, the node before its 
+        children). Used to number trees whose parts were parsed 
+        separately (see parallel.py).
+        '''
+        self.counters = dict(counters)
+        self.registry.marker_formats = dict(marker_formats)
+        self.registry.marker_formatters = {}
+        self.registry.is_enum = is_enum
+        self.registry.enum_depth = enum_depth
+
+        # explicit stack of (action, node) pairs (trees can be deep)
+        stack = [('visit', node) for node in reversed(nodes)]
+        while stack:
+            action, node = stack.pop()
+            if action == 'end_list':
+                self.end_list(node)
+                continue
+            if not isinstance(node, Command):
+                stack.extend(('visit', child) for child in reversed(node.children))
+                continue
+            if action == 'visit':
+                # arguments first (parsed before the node is numbered)
+                # undelimited arguments are not numbered by the parser
+                stack.append(('number', node))
+                args = [arg for arg in node.args.values() if isinstance(arg, (Group, OptArg))]
+                stack.extend(('visit', arg) for arg in reversed(args))
+                continue
+
+            # number the node (see parse_command and parse_environment)
+            # verbatim nodes are read from .raw tokens (not numbered)
+            if node.genus == 'Verbatim':
+                continue
+            if not node.starred:
+                self.set_number(node)
+            if not isinstance(node, Environment):
+                self.set_value(node)
+
+            # macros which change counters or marker formats (see parse_macro)
+            if node.genus == 'Macro':
+                name = self.macro_name(node)
+                if not name:
+                    pass
+                elif node.species == 'newtheorem':
+                    if not node.args['numbered_like']:
+                        self.counters[name] = 0
+                elif not node.species in ['newenvironment', 'renewenvironment']:
+                    self.set_marker_format(node, name)
+
+            if node.genus == 'List':
+                self.begin_list(node)
+                stack.append(('end_list', node))
+            kids = [*getattr(node, 'pre_children', ()), *getattr(node, 'post_children', ()), *node.children]
+            stack.extend(('visit', child) for child in reversed(kids))
 
              
 # #==================================================
@@ -20,24 +20,139 @@ We also define a ClassFactory() method to produce classes from
     
 The parser initializes the registry from coredefs.py and updates
 the tables in response to \newcommand, \newcounter etc.
+
+ClassFactory is memoised: the same arguments give the same class while
+the class is alive. The classes of the species in the definitions
+files are kept for the life of the process (see defined_class), the
+classes created for a document (unknown commands, \newcommand, ...)
+are freed with the document. Species classes are only created when
+the species is first used (see SpeciesTable): most of the species in 
+coredefs.py do not occur in a given document.
+
+Registries are built once per process (see Registry.prototype) and 
+each parser works on a copy (see Registry.copy). The prototype is also 
+saved in the per-user cache directory (settings.CACHE_ROOT) and loaded
+by later processes instead of being built again (see Registry.save and 
+Registry.load).
 '''
 
 from .coredefs import character_names
 from .command import Command, Environment, Declaration
 from .parameter import ArgTable, parse_definition
 from .node import Node
-from .tokens import Token
+from .numeral import compile_marker_format
+from .tokens import COMMANDS, END, RBRACE, RBRACKET, ITEM
+from latextree.settings import CACHE_ROOT
+import os
 import json
+import pickle
+import hashlib
+import tempfile
+import copyreg
+import weakref
 from logging import getLogger
 log = getLogger(__name__)
 
 
+class SpeciesType(type):
+    '''
+    Metaclass of the classes created by ClassFactory. Instances (classes)
+    are pickled by their factory arguments (name, argnames, BaseClass) 
+    so that trees and registries can be passed between processes.
+    '''
+    pass
+
+
+# classes created by ClassFactory keyed on their factory arguments (while
+# alive: the classes created for unknown commands in a document are freed
+# with the document)
+FACTORY_CLASSES = weakref.WeakValueDictionary()
+
+# classes of the species in definitions files keyed on their factory
+# arguments (see defined_class)
+DEFINED_CLASSES = {}
+
+
+def factory_class(name, argnames, BaseClass):
+    '''
+    Class created by ClassFactory with these arguments (used to restore 
+    the same class when unpickling).
+    '''
+    return ClassFactory(name, argnames, BaseClass)
+
+
+def defined_class(name, argnames, BaseClass):
+    '''
+    ClassFactory for the species (and genera) of definitions files, which
+    are kept for the life of the process: there is a bounded number of
+    them and they are shared by all the documents (see SpeciesTable).
+    '''
+    cls = ClassFactory(name, argnames, BaseClass)
+    DEFINED_CLASSES[cls.factory_args] = cls
+    return cls
+
+
+def reduce_species(cls):
+    if not 'factory_args' in cls.__dict__:
+        return cls.__qualname__
+    return (factory_class, cls.factory_args)
+
+copyreg.pickle(SpeciesType, reduce_species)
+
+
+# prototype registries keyed on the ids of their definitions (see Registry.prototype)
+# the definitions are kept with the registry (so the ids are not reused)
+PROTOTYPES = {}
+
+# definitions files keyed on file name: (modification time, defs)
+DEFS_FILES = {}
+
+# directory for registry snapshots (None to disable)
+SNAPSHOT_ROOT = CACHE_ROOT
+
+# modules whose code builds the registry or whose objects are saved in a
+# snapshot: the snapshot keys include a hash of their source, so old
+# snapshots are ignored when any of them changes (see snapshot_path)
+SNAPSHOT_MODULES = ('coredefs', 'registry', 'parameter', 'tokens', 'numeral')
+SOURCE_HASH = None
+
+
+def read_defs_file(defs_file):
+    '''
+    Definitions in JSON format (read once per process unless the file changes).
+    '''
+    try:
+        mtime = os.path.getmtime(defs_file)
+        cached = DEFS_FILES.get(defs_file)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        with open(defs_file, 'r') as input_file:
+            log.info('Reading definitions from {}'.format(defs_file))
+            defs = json.load(input_file)
+
+    except FileNotFoundError as e:
+        raise Exception('File {} not found'.format(e.filename))
+
+    DEFS_FILES[defs_file] = (mtime, defs)
+    return defs
+
+
 def ClassFactory(name, argnames, BaseClass):
     '''
     Creates classes corresponding to LaTeX entities. Argument names are passed
     as a list (all are assumed to be mandatory). 
     The BaseClass is to enforce the three-level hierarchy.
+    Classes are memoised on (name, argnames, BaseClass): the same
+    arguments give the same class while it is alive.
+    The taxonomy (species, genus, family) is set on the class when it is
+    created (see Node.__init_subclass__). Classes add no slots: if the
+    BaseClass has no instance __dict__ (e.g. Group) one is added for the
+    `args' and `symbol' attributes.
     '''
+    factory_args = (name, tuple(argnames), BaseClass)
+    cls = FACTORY_CLASSES.get(factory_args)
+    if cls is not None:
+        return cls
 
     def __init__(self, **kwargs):
 
@@ -76,7 +191,152 @@ def ClassFactory(name, argnames, BaseClass):
             name = character_names[name]
 
     # return the new class
-    return type(name, (BaseClass,), {"__init__": __init__})
+    # classes without arguments or symbol use the __init__ of the BaseClass
+    namespace = {"factory_args": factory_args}
+    if symbol or argnames:
+        namespace["__init__"] = __init__
+    if BaseClass.__dictoffset__:
+        namespace["__slots__"] = ()
+    cls = SpeciesType(name, (BaseClass,), namespace)
+    FACTORY_CLASSES[factory_args] = cls
+    return cls
+
+
+def source_hash():
+    '''
+    Hash of the source of SNAPSHOT_MODULES (computed once per process).
+    '''
+    global SOURCE_HASH
+    if SOURCE_HASH is None:
+        h = hashlib.sha1()
+        for name in SNAPSHOT_MODULES:
+            with open(os.path.join(os.path.dirname(__file__), name + '.py'), 'rb') as source_file:
+                h.update(source_file.read())
+        SOURCE_HASH = h.hexdigest()
+    return SOURCE_HASH
+
+
+def snapshot_path(defs_list):
+    '''
+    Snapshot file for the definitions in `defs_list' (keyed on a hash
+    of their contents and of the source of the registry code, see
+    source_hash) or None if snapshots are disabled.
+    '''
+    if not SNAPSHOT_ROOT:
+        return None
+    try:
+        data = json.dumps([source_hash(), defs_list], sort_keys=True)
+    except OSError as e:
+        log.warning('Registry snapshots disabled: {}'.format(e))
+        return None
+    key = hashlib.sha1(data.encode('utf-8')).hexdigest()
+    return os.path.join(SNAPSHOT_ROOT, 'registry-{}.pickle'.format(key))
+
+
+def trusted(path, st):
+    '''
+    True unless the file or directory `path' (with os.stat result `st')
+    could have been written by another user: snapshots are unpickled, so
+    they must be owned by the current user and not writable by group or
+    others. Not checked where there are no user ids (Windows).
+    '''
+    if not hasattr(os, 'getuid'):
+        return True
+    if st.st_uid != os.getuid() or st.st_mode & 0o022:
+        log.warning('Registry snapshots ignored: {} is not private to the current user'.format(path))
+        return False
+    return True
+
+
+class SpeciesTable(dict):
+    '''
+    Species classes keyed on species name. A species can also be given by
+    its factory arguments in `specs' (name, argnames, genus factory 
+    arguments), in which case the class is created when the species is first looked up. Iterating over 
+    the table creates all the classes.
+    '''
+    def __init__(self, specs=None):
+        dict.__init__(self)
+        self.specs = specs if specs is not None else {}
+
+    def __missing__(self, name):
+        if not name in self.specs:
+            raise KeyError(name)
+        species_name, argnames, genus_args = self.specs[name]
+        cls = defined_class(species_name, argnames, defined_class(*genus_args))
+        dict.__setitem__(self, name, cls)
+        return cls
+
+    def define(self, name, spec):
+        '''
+        Register the species `name' by its factory arguments.
+        '''
+        dict.pop(self, name, None)
+        self.specs[name] = spec
+
+    def __contains__(self, name):
+        return dict.__contains__(self, name) or name in self.specs
+
+    def get(self, name, default=None):
+        try:
+            return self[name]
+        except KeyError:
+            return default
+
+    def build(self):
+        '''
+        Create the classes of all species.
+        '''
+        for name in self.specs:
+            if not dict.__contains__(self, name):
+                self.__missing__(name)
+
+    def __iter__(self):
+        self.build()
+        return dict.__iter__(self)
+
+    def __len__(self):
+        self.build()
+        return dict.__len__(self)
+
+    def keys(self):
+        self.build()
+        return dict.keys(self)
+
+    def values(self):
+        self.build()
+        return dict.values(self)
+
+    def items(self):
+        self.build()
+        return dict.items(self)
+
+    def copy(self):
+        table = SpeciesTable(dict(self.specs))
+        dict.update(table, dict.items(self))
+        return table
+
+    def genus_names(self, genus_name):
+        '''
+        Names of the species of genus `genus_name' (without creating the classes).
+        '''
+        names = set()
+        for name, spec in self.specs.items():
+            if not dict.__contains__(self, name) and spec[2][0] == genus_name:
+                names.add(name)
+        for name, cls in dict.items(self):
+            if cls.__bases__[0].__name__ == genus_name:
+                names.add(name)
+        return names
+
+    def changes(self, before):
+        '''
+        Species created or redefined since `before' (a copy of this table).
+        '''
+        return {name: cls for name, cls in dict.items(self) if not cls is before.get(name)}
+
+    def __reduce__(self):
+        return (SpeciesTable, (), self.__dict__, None, iter(dict.items(self)))
 
 
 class Registry():
@@ -95,7 +355,7 @@ class Registry():
 
         # registers all keyed on species name
         # types (all species are registered here)
-        self.species = {}
+        self.species = SpeciesTable()
         self.params = {}                # parameter definitions (type, name)
 
         # stop tokens for block commands (\section, \item)
@@ -103,28 +363,151 @@ class Registry():
         self.block_commands = {}
         self.block_declarations = {}
 
+        # complete stop token sets (frozensets) used by the parser
+        self.block_command_stops = {}
+        self.block_declaration_stops = {}
+
+        # grandparent class (family) keyed on species class (see is_environment)
+        self.families = {}
+
         # registers keyed on counter name (numbered species)
         self.numbered = {}              # reset counters for numbered species
         self.numbered_like = {}         # shared counter for arbitrary species
         self.marker_formats = {}        # keyed on species name
+        self.marker_formatters = {}     # compiled marker formats (see marker_formatter)
         self.names = {}                 # keyed on node.species + 'name' e.g. 'chaptername'
 
         # registers for runtime expansion
         # on-the-fly macro definitions  keyed on species_name: ascii
         self.custom = {}
 
+        # token templates compiled from .the custom table (see Parser.custom_template)
+        # keyed on species_name: (source, template)
+        self.templates = {}
+
         # on-the-fly theorem headings   keyed on species_name: Group()
         self.theorem_names = {}
 
+        # verbatim environments (read as raw tokens by the tokenizer)
+        self.verbatim = frozenset()
+
         # init enum nesting tracker (needed for enumi, enumii, ...)
         self.is_enum = False
         self.enum_depth = 0
 
+        # incremented whenever definitions change (see Parser.parse_macro)
+        self.version = 0
+
         # parse new definitions
         if defs:
             self.update_defs(defs)
 
 
+    @classmethod
+    def prototype(cls, *defs_list):
+        '''
+        Registry for the definitions in `defs_list' (applied in order).
+        Built once per process and shared: it must not be modified
+        (parsers work on copies, see copy), nor must the definitions.
+        The registry is loaded from .the snapshot directory if it has been
+        built before (by any process), otherwise it is built and saved.
+        The species names are interned (see tokens.TokenTable).
+        '''
+        key = tuple(id(defs) for defs in defs_list)
+        if not key in PROTOTYPES:
+            path = snapshot_path(defs_list)
+            registry = cls.load(path) if path else None
+            if registry is None:
+                registry = cls()
+                for defs in defs_list:
+                    registry.update_defs(defs)
+                if path:
+                    registry.save(path)
+            COMMANDS.intern(registry.species.specs)
+            PROTOTYPES[key] = (defs_list, registry)
+        return PROTOTYPES[key][1]
+
+
+    def save(self, path):
+        '''
+        Write a snapshot of the registry to `path'. Species are saved
+        as their factory arguments (see SpeciesTable) and the caches
+        (families, compiled formats and templates) are not saved.
+        Failures are logged and ignored (the snapshot is only a cache).
+        The directory is created private to the current user, and nothing
+        is written to a directory which is not (see trusted).
+        '''
+        state = self.__getstate__()
+        state['families'] = {}
+        snapshot_root = os.path.dirname(path)
+        try:
+            os.makedirs(snapshot_root, mode=0o700, exist_ok=True)
+            if not trusted(snapshot_root, os.stat(snapshot_root)):
+                return
+            fd, tmp_path = tempfile.mkstemp(dir=snapshot_root)
+            with os.fdopen(fd, 'wb') as output_file:
+                pickle.dump(state, output_file, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+            log.info('Registry snapshot saved in {}'.format(path))
+        except OSError as e:
+            log.warning('Registry snapshot not saved: {}'.format(e))
+
+
+    @classmethod
+    def load(cls, path):
+        '''
+        Registry from .the snapshot at `path' (see save) or None if there is 
+        no (valid) snapshot. Snapshots are only read if the file and its
+        directory are private to the current user (see trusted).
+        '''
+        try:
+            snapshot_root = os.path.dirname(path)
+            if not trusted(snapshot_root, os.stat(snapshot_root)):
+                return None
+            with open(path, 'rb') as input_file:
+                if not trusted(path, os.fstat(input_file.fileno())):
+                    return None
+                state = pickle.load(input_file)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            log.warning('Registry snapshot {} not loaded: {}'.format(path, e))
+            return None
+        log.info('Registry snapshot loaded from {}'.format(path))
+        registry = cls.__new__(cls)
+        registry.__dict__.update(state)
+        return registry
+
+
+    def copy(self):
+        '''
+        Copy of the registry (for parsing a document). The tables are 
+        copied so that definitions made in the document (e.g. \newcommand)
+        do not change this registry. The species classes are shared.
+        '''
+        registry = Registry.__new__(Registry)
+        for name, value in self.__dict__.items():
+            if isinstance(value, dict):
+                value = value.copy()
+            registry.__dict__[name] = value
+
+        # nested tables updated in place (see update_numbered, update_names)
+        registry.numbered = {key: list(val) if isinstance(val, list) else val 
+            for key, val in self.numbered.items()}
+        registry.names = {key: dict(val) for key, val in self.names.items()}
+        return registry
+
+
+    def __getstate__(self):
+        '''
+        Compiled formats and templates are not pickled (recompiled on demand).
+        '''
+        state = self.__dict__.copy()
+        state['marker_formatters'] = {}
+        state['templates'] = {}
+        return state
+
+
     def pretty_print(self):
         print('--------------------')
         print('Registry')
@@ -140,6 +523,7 @@ class Registry():
 
         # update defs
         self.defs.update(defs)
+        self.version += 1
 
         # species and arguments
         if 'commands' in defs:
@@ -178,13 +562,13 @@ class Registry():
 
     def update_species(self, genera, base_class=Node):
         '''
-        Update species.
+        Update species. Classes are created when first used (see SpeciesTable).
         '''
         # iterate over genera
         for genus in genera:
 
-            # create class for this genus
-            parent_class = ClassFactory(genus, [], BaseClass=base_class)
+            # factory arguments of the class for this genus
+            parent_args = (genus, (), base_class)
 
             # iterate over species
             for species_def in genera[genus]:
@@ -201,10 +585,12 @@ class Registry():
                     dict.__setitem__(self.params, species_name, params)
 
                 # record species class
-                param_names = [p.name for p in params]
-                new_class = ClassFactory(
-                    species_name, param_names, BaseClass=parent_class)
-                dict.__setitem__(self.species, species_name, new_class)
+                param_names = tuple(p.name for p in params)
+                self.species.define(species_name, (species_name, param_names, parent_args))
+
+                # record verbatim environments
+                if base_class == Environment and genus == 'Verbatim':
+                    self.verbatim = self.verbatim | {species_name}
 
 
     def update_block_commands(self, block_commands):
@@ -219,11 +605,19 @@ class Registry():
                 continue
             dict.__setitem__(self.block_commands, species_name, stop_tokens)
 
+            # the command itself, (0,'end'), the listed commands and 
+            # their tex-style environment ends e.g. (0,'enditemize')
+            stop_set = [COMMANDS[species_name], END]
+            stop_set += [COMMANDS[s] for s in stop_tokens]
+            stop_set += [COMMANDS['end'+s] for s in stop_tokens]
+            dict.__setitem__(self.block_command_stops, species_name, frozenset(stop_set))
+
 
     def update_block_declarations(self, genus_names):
         '''
         Update stop tokens for block_declaration declarations.
-        Tokens (2,'}') and (0,'end') are automatically added by the parser.
+        Tokens (2,'}'), (12,']'), (0,'end') and (0,'item') are added 
+        in the stop token sets (block_declaration_stops) used by the parser.
         Input: `block_declarations' is a list of Genus names
         '''
         # iterate over species
@@ -236,10 +630,13 @@ class Registry():
             species_names = [parse_definition(sdef)[0]
                              for sdef in species_defs]
             for species_name in species_names:
-                stop_tokens = [Token(0, x)
+                stop_tokens = [COMMANDS[x]
                                for x in species_names if not x == species_name]
                 dict.__setitem__(self.block_declarations,
                                  species_name, stop_tokens)
+                stop_set = [END, RBRACE, RBRACKET, ITEM] + stop_tokens
+                dict.__setitem__(self.block_declaration_stops,
+                                 species_name, frozenset(stop_set))
 
 
     def update_numbered(self, numbered):
@@ -280,6 +677,22 @@ class Registry():
                 numeric_label = numeric_label.replace(seed, counter_label)
 
             dict.__setitem__(self.marker_formats, species_name, numeric_label)
+            self.marker_formatters.pop(species_name, None)
+
+
+    def marker_formatter(self, counter_name):
+        r'''
+        Marker format for `counter_name' compiled into a function of the 
+        counter values (see numeral.py). Compiled on first use and cached 
+        until the format is changed by update_marker_formats.
+        The default format is \arabic{counter_name}.
+        '''
+        formatter = self.marker_formatters.get(counter_name)
+        if formatter is None:
+            tex_str = self.marker_formats.get(counter_name, '\\arabic{{{}}}'.format(counter_name))
+            formatter = compile_marker_format(tex_str)
+            self.marker_formatters[counter_name] = formatter
+        return formatter
 
 
     def update_names(self, names):
@@ -299,9 +712,13 @@ class Registry():
 
 
     def is_environment(self, species_name):
-        if species_name in self.species:
-            return self.species[species_name].__bases__[0].__bases__[0] == Environment
-        return False
+        species_class = self.species.get(species_name)
+        if species_class is None:
+            return False
+        # cached on the class (species may be redefined)
+        if not species_class in self.families:
+            self.families[species_class] = species_class.__bases__[0].__bases__[0]
+        return self.families[species_class] == Environment
 
 
     def create_phenotype(self, species_name, base_class=Node):
@@ -0,0 +1,216 @@
+# selection.py
+r'''
+Selective parsing (see Parser.parse_file).
+
+    root = parser.parse_file('main.tex', select='chapter:3')
+
+Only the selected block of the document body (a sectioning command and
+its contents) is parsed. Selectors are
+    'chapter:3'     the third chapter
+    'section:2.3'   the third section of the second chapter (the numbers
+                    of the master counters are given from .the left)
+    'label:key'     the sectioning command whose text (up to the next
+                    sectioning command) contains \label{key}
+
+The preamble is parsed as usual. In the document body the source is
+skipped by a scanner which tracks braces, environments, comments and
+verbatim regions without creating tokens or nodes. The scanner stops at
+    - sectioning commands at the selected level or above, which are
+      parsed (arguments and number) and either selected or skipped in
+      turn (lower levels are counted)
+    - input commands, whose files are skipped in the same way
+    - macros (\newcommand, \newtheorem, ...), which are parsed so that
+      the selected block is expanded as in a full parse
+Numbered commands and environments found by the scanner (figures,
+equations, ...) step their counters, so the numbers in the selected
+block are the same as in a full parse. Once the selected block has been
+parsed the rest of the document is skipped without stopping.
+
+Sectioning, input and macro commands are only found at the top level of
+a block (not inside groups or environments), and counters changed by
+\setcounter in skipped text are not seen.
+'''
+
+import re
+
+# matches the scanner stops at
+SKIP_RE = re.compile(r'''
+    %[^\n]*                                     # comment
+  | \\verb\*?([^\sA-Za-z*])[^\n]*?\1            # \verb|...|
+  | \\(?P<word>[A-Za-z]+)(?P<star>\s*\*)?       # control word
+  | \\.                                         # control symbol
+  | (?P<brace>[{}])
+''', re.VERBOSE | re.DOTALL)
+
+# environment name or argument following \begin, \end or \label
+NAME_RE = re.compile(r'\s*\{([^{}]*)\}')
+
+# end of verbatim environments keyed on name
+VERBATIM_END_RES = {}
+
+def verbatim_end_re(name):
+    if not name in VERBATIM_END_RES:
+        VERBATIM_END_RES[name] = re.compile(r'\\end\s*\{' + re.escape(name) + r'\}')
+    return VERBATIM_END_RES[name]
+
+
+class Selector():
+    '''
+    Block selected by the `select' argument of Parser.parse_file.
+    '''
+    def __init__(self, select, registry):
+        kind, sep, value = select.partition(':')
+        if not sep or not value:
+            raise Exception('Selector {} not recognised'.format(select))
+
+        # sectioning commands which may start or end the selected block
+        self.sections = registry.species.genus_names('Section')
+
+        self.species = None
+        self.label = None
+        if kind == 'label':
+            self.label = value
+        else:
+            if not kind in self.sections:
+                raise Exception('Selector {}: {} is not a sectioning command'.format(select, kind))
+            try:
+                self.path = [int(x) for x in value.split('.')]
+            except ValueError:
+                raise Exception('Selector {} not recognised'.format(select))
+            self.species = kind
+            self.chain = self.master_counters(kind, registry)[-len(self.path):]
+
+            # lower levels (e.g. sections for 'chapter:3') are only counted
+            self.sections &= set([kind] + registry.block_commands.get(kind, []))
+
+        # command names the scanner stops at
+        self.stops = self.sections | registry.species.genus_names('Input') \
+            | registry.species.genus_names('Macro')
+
+        self.seeking = True     # outside the selected block
+        self.found = False      # the selected block has been parsed
+
+
+    def master_counters(self, species, registry):
+        '''
+        Counters which reset the counter of `species' (outermost first)
+        followed by the counter itself.
+        '''
+        chain = [species]
+        while True:
+            master = next((name for name, resets in registry.numbered.items()
+                if isinstance(resets, list) and chain[0] in resets), None)
+            if master is None or master in chain:
+                return chain
+            chain.insert(0, master)
+
+
+    def matches(self, cmd, tokens, registry, counters, stop_tokens):
+        '''
+        True if the sectioning command `cmd' (numbered, with its arguments
+        parsed) is selected. The label selector looks ahead in the source.
+        '''
+        if self.label is not None:
+            position = tokens.source_position()
+            if position is None:
+                return False
+            text, pos, end = position
+            return self.scan(text, pos, end, stop_tokens, registry, counters, mode='peek')[1]
+        if not cmd.species == self.species or cmd.starred:
+            return False
+        return [counters.get(name, 0) for name in self.chain] == self.path
+
+
+    def count(self, name, registry, counters):
+        '''
+        Step the counter of a numbered species found by the scanner
+        (as Parser.set_number does).
+        '''
+        if name in registry.numbered:
+            counter_name = name
+        elif name in registry.numbered_like:
+            counter_name = registry.numbered_like[name]
+        else:
+            return
+        counters[counter_name] = counters.get(counter_name, 0) + 1
+        if name in registry.numbered:
+            for counter_name in registry.numbered[name]:
+                counters[counter_name] = 0
+
+
+    def scan(self, text, pos, end, stop_tokens, registry, counters, mode='seek'):
+        r'''
+        Skip `text' from .`pos' to the end of the block, i.e. the first stop
+        token, unmatched \end or unmatched closing brace at the top level
+        (or `end'). Returns (position, label found).
+            mode='seek'     also stop at sectioning, input and macro
+                            commands and step counters
+            mode='peek'     stop as for 'seek' (without stepping counters)
+                            or when \label{self.label} is found
+            mode='fast'     only stop at the end of the block
+        '''
+        stop_names = set(t.value for t in stop_tokens if t.catcode == 0)
+        stops = self.stops if not mode == 'fast' else ()
+        counting = mode == 'seek'
+        verbatim = registry.verbatim
+        braces = 0
+        envs = []
+        search = SKIP_RE.search
+
+        while True:
+            m = search(text, pos, end)
+            if not m:
+                return end, False
+            pos = m.end()
+            word = m.group('word')
+
+            # groups
+            brace = m.group('brace')
+            if brace == '{':
+                braces += 1
+                continue
+            if brace == '}':
+                if not braces:
+                    return m.start(), False
+                braces -= 1
+                continue
+
+            # comments, \verb and control symbols
+            if word is None:
+                continue
+
+            # environments (verbatim environments are skipped whole)
+            if word == 'begin' or word == 'end':
+                e = NAME_RE.match(text, pos, end)
+                if not e:
+                    continue
+                name = e.group(1)
+                if word == 'begin':
+                    pos = e.end()
+                    if name.rstrip('*') in verbatim:
+                        v = verbatim_end_re(name).search(text, pos, end)
+                        if not v:
+                            return end, False
+                        pos = v.end()
+                        continue
+                    if counting and not name[-1:] == '*':
+                        self.count(name, registry, counters)
+                    envs.append(name)
+                    continue
+                if envs or braces:
+                    if envs:
+                        envs.pop()
+                    pos = e.end()
+                    continue
+                return m.start(), False
+
+            # commands
+            if not braces and not envs:
+                if word in stop_names or word in stops:
+                    return m.start(), False
+            if mode == 'peek' and word == 'label':
+                e = NAME_RE.match(text, pos, end)
+                if e and e.group(1) == self.label:
+                    return m.start(), True
+            if counting and not m.group('star'):
+                self.count(word, registry, counters)
@@ -17,29 +17,37 @@ Catcodes
 13  ~                   Active character
 14 %                    Comment character
 15 <delete>             Invalid character 
+
+Pseudo-catcodes used by the tokenizer
+16 <whitespace>         Whitespace following a control sequence
+17 <raw>                Verbatim source: \verb|...| or a verbatim environment
+
+Streams created with a set of verbatim environment names (see `token_re`)
+return each comment as a single catcode 14 token with value '%...\n', and 
+each \verb or verbatim environment as a single catcode 17 token, both 
+carrying the untouched source.
 '''
 
+import re
 import json
+import mmap
+import bisect
+from array import array
+from collections import namedtuple
 
 import logging
 log = logging.getLogger(__name__)
 log.setLevel(logging.WARNING)
 
-class Token():
+class Token(namedtuple('Token', ['catcode', 'value'])):
     '''
-    Token class. Could it be done with a namedtuple?
-    '''    
-    def __init__(self, catcode, value):
-        self.catcode = catcode
-        self.value = value
-    
+    Token class. Immutable (catcode, value) pair, so tokens can be shared
+    (see the token tables below) and compared as plain tuples.
+    '''
+    __slots__ = ()
+
     def __repr__(self):
         return '({},{})'.format(self.catcode, repr(self.value))
-    
-    def __eq__(self, other):
-        if isinstance(other, Token):
-            return (self.catcode == other.catcode) and (self.value == other.value)
-        return False
 
 
 class EndToken(Token):
@@ -47,138 +55,958 @@ class EndToken(Token):
     EndToken class. End marker for TokenStream objects. 
     Not currently used by parser (useful for debugging).
     '''
-    def __init__(self):
-        Token.__init__(self, 15, '')
+    __slots__ = ()
+
+    def __new__(cls):
+        return Token.__new__(cls, 15, '')
 
 
-class TokenStream(list):
+class TokenStream():
+    '''
+    Stream of tokens read from .a string, file object or mmap.
 
-    def __init__(self, s='', end_token=True):
+    The source is tokenized on demand: a cursor (`TextCursor`) moves
+    through the text and tokens are scanned into a small buffer a few
+    hundred characters at a time. With `columnar=True` the source is
+    tokenized up front into a `TokenBuffer` and read through a
+    `ColumnCursor` instead. If `verbatim` is a (frozen) set of environment
+    names, comments and verbatim source are returned as raw tokens (see
+    `token_re`).
+
+    The buffer is a stack (next token last) so `push` returns tokens to
+    the stream. Macro expansions are spliced in as sub-streams with
+    `splice`: the current cursor and buffer are saved and restored when
+    the sub-stream (including its end token) has been read.
+
+    The tokens read from .the stream can be recorded (see `record`), e.g.
+    the source tokens of the arguments of a user-defined macro, which are
+    spliced into its expansion.
+    '''
+
+    def __init__(self, s='', end_token=True, columnar=False, file_id=None, verbatim=None):
+
+        # read source text
+        if hasattr(s, 'read') and not isinstance(s, mmap.mmap):
+            s = s.read()
+        if not isinstance(s, str):
+            s = str(s, 'utf-8')     # bytes, bytearray, mmap, ...
+
+        # cursor
+        if columnar:
+            self.cursor = ColumnCursor(TokenBuffer(s, verbatim))
+        else:
+            self.cursor = TextCursor(s, pattern=token_re(verbatim))
+        self.cursor.file_id = file_id
+        self.end_token = end_token
+
+        # buffer of scanned or pushed tokens (stack order)
+        self.buffer = []
+
+        # saved state of the enclosing streams (see `splice`)
+        self.outer = []
+
+        # open recordings (see `record`)
+        self.records = []
 
-        # tokenize input string
-        tokens = []
-        if isinstance(s, str):
-            tokens  = self.tokenize(s, end_token=end_token)
-        
-        # init self as list
-        list.__init__(self, tokens) 
         log.info('TokenStream created')
 
+    def __bool__(self):
+        return bool(self.buffer) or self.fill()
+
+    def __iter__(self):
+        '''
+        Iterate over the remaining tokens without consuming them.
+        '''
+        ts = self.copy()
+        while ts:
+            yield ts.pop()
+
     def __eq__(self, other):
-        if isinstance(other, TokenStream) and len(self) > 0:
+        if isinstance(other, TokenStream) and self:
             return all([t1 == t2 for (t1,t2) in zip(self, other)])
         return False
 
+    def __repr__(self):
+        ts = self.copy()
+        tokens = [ts.pop() for _ in range(20) if ts]
+        more = ', ...' if ts else ''
+        return 'TokenStream([{}{}])'.format(', '.join(map(repr, tokens)), more)
+
+    def copy(self):
+        '''
+        Independent stream over the same source from .the current position.
+        '''
+        ts = TokenStream.__new__(TokenStream)
+        ts.cursor = self.cursor.copy()
+        ts.end_token = self.end_token
+        ts.buffer = list(self.buffer)
+        ts.outer = [(cursor.copy(), list(buffer), end_token)
+                    for (cursor, buffer, end_token) in self.outer]
+        ts.records = []
+        return ts
+
+    def fill(self):
+        '''
+        Refill the (empty) buffer. Returns False at the end of the stream.
+        '''
+        while not self.buffer:
+            tokens = self.cursor.read()
+            if tokens:
+                self.buffer = tokens
+            elif self.end_token:
+                self.buffer.append(EndToken())
+                self.end_token = False
+            elif self.outer:
+                (self.cursor, self.buffer, self.end_token) = self.outer.pop()
+            else:
+                return False
+        return True
+
+    def splice(self, ts):
+        '''
+        Insert the stream `ts` at the current position (macro expansion).
+        '''
+        self.outer.append((self.cursor, self.buffer, self.end_token))
+        self.cursor = ts.cursor.copy()
+        self.buffer = list(ts.buffer)
+        self.end_token = ts.end_token
+        self.outer.extend(ts.outer)
+
+    def splice_tokens(self, tokens, end_token=True):
+        '''
+        Insert a list of tokens (in document order) at the current position
+        (macro expansion from .a template, see Parser.expand_template).
+        '''
+        self.outer.append((self.cursor, self.buffer, self.end_token))
+        self.cursor = TextCursor('')
+        self.buffer = tokens[::-1]
+        self.end_token = end_token
+
     def pop(self):
-        if len(self):
-            t = super(TokenStream, self).pop()
-            log.debug('{} popped'.format(t))
+        if self.buffer or self.fill():
+            t = self.buffer.pop()
+            if self.records:
+                self.note((t,))
+            log.debug('%s popped', t)
             return t
         return None
 
     def push(self, t):
         if isinstance(t, Token):
-            log.debug('{} pushed'.format(t))
-            self.append(t)
+            log.debug('%s pushed', t)
+            self.buffer.append(t)
+            if self.records:
+                self.unnote(t)
+
+    def record(self):
+        '''
+        Start recording the tokens read from .the stream at the current
+        level: tokens of the streams spliced in from .here on (e.g. macro
+        expansions) are not recorded, nor are tokens pushed back to the
+        stream (they are recorded when first read, or not at all if they
+        were never in the stream). Returns the recording, a list [level,
+        tokens, number of tokens pushed back], for `stop_record`.
+        '''
+        rec = [len(self.outer), [], 0]
+        self.records.append(rec)
+        return rec
+
+    def stop_record(self, rec):
+        '''
+        Stop the recording `rec` and return the tokens read since it was
+        started (in document order) or None if they were not all read as
+        tokens (see `take_group`), the stream was read past the end of
+        the level where the recording started, or tokens pushed back
+        have not been read again.
+        '''
+        self.records.remove(rec)
+        if rec[2]:
+            return None
+        return rec[1]
+
+    def note(self, tokens):
+        '''
+        Add `tokens` (read from .the current level) to the recordings.
+        '''
+        level = len(self.outer)
+        for rec in self.records:
+            if rec[1] is None or rec[0] < level:
+                continue
+            if rec[0] > level:
+                rec[1] = None
+            elif rec[2]:
+                skip = min(rec[2], len(tokens))
+                rec[2] -= skip
+                rec[1].extend(tokens[skip:])
+            else:
+                rec[1].extend(tokens)
+
+    def unnote(self, t):
+        '''
+        Token `t` pushed back to the current level: the next token read
+        from .this level is not recorded again.
+        '''
+        level = len(self.outer)
+        for rec in self.records:
+            if rec[0] == level:
+                rec[2] += 1
+
+    def drop_records(self):
+        '''
+        Drop the open recordings (source read without tokens).
+        '''
+        for rec in self.records:
+            rec[1] = None
     
     def isempty(self):
-        if len(self) > 0:
-            return False
-        return True 
-    
+        return not self
+
     def peek(self):
-        if not self.isempty():
-            log.debug('peek: next token is {}'.format(self[-1]))
-            return self[-1]
+        if self.buffer or self.fill():
+            log.debug('peek: next token is %s', self.buffer[-1])
+            return self.buffer[-1]
         return None
 
-    def tokenize(self, s, end_token=True):
+    def tell(self):
         '''
-        Convert string to tokens.
+        Position of the next token as a triple (file_id, a, b) where the
+        pair (a, b) is resolved into an offset by the cursor (see `offset`).
+        Spliced streams without a file id report the position of the
+        enclosing stream (i.e. the position following the macro).
         '''
+        cursor = self.cursor
+        buffer = self.buffer
+        if cursor.file_id is None:
+            for (outer_cursor, outer_buffer, _) in reversed(self.outer):
+                if outer_cursor.file_id is not None:
+                    cursor = outer_cursor
+                    buffer = outer_buffer
+                    break
+        return (cursor.file_id,) + cursor.tell(len(buffer))
 
-        # convert string to a stream of characters
-        chars = list(s)
-        chars.reverse()
+    def source_position(self):
+        '''
+        Source text, offset of the next token and offset of the end of 
+        the stream, or None if the stream is not read directly from .a 
+        source string (e.g. a spliced macro expansion) or the source has 
+        been read to the end.
+        '''
+        cursor = self.cursor
+        if self.outer or not self.end_token:
+            return None
+        return (cursor.text, cursor.offset(*cursor.tell(len(self.buffer))), cursor.text_end())
 
-        # initialize token list
-        tokens = []
-        
-        # start popping chars
-        while chars:
-            c = chars.pop()
-
-            # escape character (extract command)
-            if c == '\\':
-                
-                # check for empty stream
-                if not chars:
-                    tokens.append(Token(12,c))
-                    return tokens
-                
-                # init cmd
-                cmd = chars.pop()
-                
-                #--------------------
-                # scan for cmd word
-                if cmd.isalpha():
-
-                    # extract name
-                    while chars and chars[-1].isalpha():
-                        cmd += chars.pop()
-
-                    log.info('Command word: {}'.format(cmd))
-                        
-                # record trailing whitespace (space|tab|newline)
-                wspace = []
-                while chars and chars[-1].isspace():
-                    wspace.append(chars.pop())
-                wspace = ''.join(wspace)
-                
-                # push token and whitespace (if any)
-                tokens.append(Token(0,cmd))
-                if wspace:
-                    tokens.append(Token(16, wspace))
-                
-            # catcodes 1 to 15 are straightforward
-            elif c == '{':
-                tokens.append(Token(1,c))   # start group
-            elif c == '}':
-                tokens.append(Token(2,c))   # end group
-            elif c == '$':
-                tokens.append(Token(3,c))   # mathmode
-            elif c == '&':
-                tokens.append(Token(4,c))   # alignment 
-            elif c == '\n':
-                tokens.append(Token(5,c))   # newline
-            elif c == '#':
-                tokens.append(Token(6,c))   # parameter
-            elif c == '^':
-                tokens.append(Token(7,c))   # superscript
-            elif c == '_':
-                tokens.append(Token(8,c))   # subscript 
-            elif c == '':
-                tokens.append(Token(9,c))   # null (empty string)
-            elif c.isspace():
-                tokens.append(Token(10,c))  # space 
-            elif c.isalpha():
-                tokens.append(Token(11,c))  # letter
-            elif c == '~':
-                tokens.append(Token(13,c))  # active
-            elif c == '%':
-                tokens.append(Token(14,c))  # comment
-            elif c == '\x7f':
-                tokens.append(Token(15,c))  # invalid character (delete)
+    def seek(self, pos):
+        '''
+        Move the stream to offset `pos' in the source (see source_position).
+        '''
+        if self.records:
+            self.drop_records()
+        self.buffer = []
+        self.cursor.seek(pos)
+
+    def take_group(self):
+        '''
+        Pop the tokens up to the right brace matching a left brace already
+        popped (the right brace is popped too) and return their source. 
+        Tokens already scanned are popped one at a time, then the source
+        is searched for the matching brace (see `group_re`) and sliced,
+        unless the stream is a spliced expansion.
+        '''
+        if self.records:
+            self.drop_records()
+        depth = 1
+        parts = []
+        while True:
+            buffer = self.buffer
+            while buffer:
+                t = buffer.pop()
+                if t == LBRACE:
+                    depth += 1
+                elif t == RBRACE:
+                    depth -= 1
+                    if not depth:
+                        return ''.join(parts)
+                if t.catcode == 0:
+                    parts.append('\\')
+                parts.append(t.value)
+            if not self.outer and self.end_token:
+                break
+            if not self.fill():
+                raise Exception("Right brace '}' expected.")
+
+        # search the source
+        cursor = self.cursor
+        text = cursor.text
+        start = pos = cursor.source_offset()
+        end = cursor.text_end()
+        search = group_re(cursor.pattern).search
+        while True:
+            m = search(text, pos, end)
+            if not m:
+                raise Exception("Right brace '}' expected.")
+            pos = m.end()
+            brace = m.group('brace')
+            if brace == '{':
+                depth += 1
+            elif brace == '}':
+                depth -= 1
+                if not depth:
+                    self.seek(pos)
+                    parts.append(text[start:m.start()])
+                    return ''.join(parts)
+
+    def take_text(self, stop_tokens=[]):
+        '''
+        Pop the run of printable tokens (catcodes 10, 11 and 12) at the
+        front of the stream, up to the first stop token, and return their
+        values as a single string. Runs still in the source are returned
+        as slices of the source without creating tokens.
+        '''
+        stop_chars = STOP_CHARS.get(stop_tokens) if isinstance(stop_tokens, frozenset) else None
+        if stop_chars is None:
+            stop_chars = ''.join([t.value for t in stop_tokens if t.catcode in PRINTABLE])
+            if isinstance(stop_tokens, frozenset):
+                STOP_CHARS[stop_tokens] = stop_chars
+        buffer = self.buffer
+        level = len(self.outer)
+        parts = []
+        while True:
+            while buffer and buffer[-1].catcode in PRINTABLE \
+                    and not buffer[-1].value in stop_chars:
+                parts.append(buffer.pop().value)
+            if buffer:
+                break
+            run = self.cursor.read_text(stop_chars)
+            if not run:
+                break
+            parts.append(run)
+            if not self.fill():
+                break
+            buffer = self.buffer
+        text = ''.join(parts)
+        if self.records:
+            if len(self.outer) == level:
+                self.note(list(map(CHARS.__getitem__, text)))
             else:
-                tokens.append(Token(12,c))  # everything else
-        
-        # include end token
-        if end_token:
-            tokens.append(EndToken())
-        
-        tokens.reverse()
+                self.drop_records()
+        return text
+
+
+# Catcodes of the special characters. Every other character is
+# a space (10), a letter (11) or other (12), see `catcode` below.
+CATCODES = {
+    '{': 1,         # start group
+    '}': 2,         # end group
+    '$': 3,         # mathmode
+    '&': 4,         # alignment
+    '\n': 5,        # newline
+    '#': 6,         # parameter
+    '^': 7,         # superscript
+    '_': 8,         # subscript
+    '~': 13,        # active
+    '%': 14,        # comment
+    '\x7f': 15,     # invalid character (delete)
+}
+
+
+def catcode(c):
+    '''
+    Catcode of a single (non-escaped) character.
+    '''
+    if c in CATCODES:
+        return CATCODES[c]
+    if c.isspace():
+        return 10
+    if c.isalpha():
+        return 11
+    return 12
+
+
+# Catcodes of printable characters (collected into Text nodes)
+PRINTABLE = (10, 11, 12)
+
+# printable stop characters of stop token sets (see TokenStream.take_text)
+STOP_CHARS = {}
+
+
+# Master regex for the tokenizer. Each match is either a control sequence
+# (with its trailing whitespace), a run of printable characters (catcodes
+# 10, 11 and 12) or a single special character, so plain text is consumed
+# a line at a time rather than a character at a time.
+#   [^\W\d_] is "letter" as far as `re` is concerned, which is slightly
+#   wider than str.isalpha() (e.g. superscript digits) so control words
+#   are checked before use.
+TOKEN_PATTERN = r'''
+    \\(?:(?P<word>[^\W\d_]+)|(?P<symbol>.))(?P<space>\s*)
+  | (?P<text>[^\\{}$&\n#^_~%\x7f]+)
+  | (?P<char>.)
+'''
+
+TOKEN_RE = re.compile(TOKEN_PATTERN, re.VERBOSE | re.DOTALL)
+
+# Raw tokens (comments, \verb and verbatim environments) are matched
+# ahead of the patterns above. {names} is replaced by the verbatim
+# environment names.
+RAW_PATTERN = r'''
+    (?P<comment>%[^\n]*\n?)
+  | (?P<verb>\\verb\*?(?P<delim>[^\sA-Za-z*])[^\n]*?(?P=delim))
+  | (?P<verbatim>\\begin\s*\{{(?P<env>{names})(?P<star>\*?)\}}
+        .*?\\end\s*\{{(?P=env)(?P=star)\}})
+  | '''
+
+TOKEN_RES = {None: TOKEN_RE}
+
+# Braces outside raw tokens and control symbols (see TokenStream.take_group),
+# matched in place of TOKEN_PATTERN
+GROUP_PATTERN = r'''
+    \\.
+  | (?P<brace>[{}])
+'''
+
+GROUP_RES = {}
+
+def group_re(pattern):
+    '''
+    Regex for finding the braces in the source tokenized by `pattern`
+    (see `token_re`). Raw tokens are skipped.
+    '''
+    if not pattern in GROUP_RES:
+        prefix = pattern.pattern[:-len(TOKEN_PATTERN)]
+        GROUP_RES[pattern] = re.compile(prefix + GROUP_PATTERN, re.VERBOSE | re.DOTALL)
+    return GROUP_RES[pattern]
+
+def token_re(verbatim=None):
+    '''
+    Master regex for the tokenizer. If `verbatim` is a set of environment
+    names then comments, \verb and the given environments are returned
+    as raw tokens. Compiled patterns are cached on the set of names.
+    '''
+    if not verbatim in TOKEN_RES:
+        names = '|'.join([re.escape(name)
+                          for name in sorted(verbatim, key=len, reverse=True)])
+        pattern = RAW_PATTERN.format(names=names or '(?!)') + TOKEN_PATTERN
+        TOKEN_RES[verbatim] = re.compile(pattern, re.VERBOSE | re.DOTALL)
+    return TOKEN_RES[verbatim]
+
+
+class CharTable(dict):
+    '''
+    Single-character tokens keyed on the character (catcode from `catcode`).
+    '''
+    def __missing__(self, c):
+        t = self[c] = Token(catcode(c), c)
+        return t
+
+
+class TokenTable(dict):
+    '''
+    Tokens of a fixed catcode keyed on their value. The table is shared
+    by every document parsed in the process, so it must not grow with
+    them: new values are interned until the table holds `limit' tokens
+    (and only if they are no longer than MAX_INTERNED), after which they
+    get a token of their own. Known values (e.g. the species names of
+    the definitions files, see Registry.prototype) are interned with
+    `intern' regardless of the limit.
+    '''
+    def __init__(self, catcode, limit):
+        self.catcode = catcode
+        self.limit = limit
+
+    def __missing__(self, value):
+        t = Token(self.catcode, value)
+        if len(self) < self.limit and len(value) <= MAX_INTERNED:
+            self[value] = t
+        return t
+
+    def intern(self, values):
+        '''
+        Intern the tokens for `values' (a bounded set).
+        '''
+        for value in values:
+            if not value in self:
+                self[value] = Token(self.catcode, value)
+
+
+# longest value interned by a TokenTable
+MAX_INTERNED = 32
+
+# Interned tokens. Tokens are immutable, so the tokenizer hands out one
+# shared token per distinct character and per distinct control sequence
+# and whitespace string (up to the limits of the tables).
+CHARS = CharTable()                 # single characters
+COMMANDS = TokenTable(0, 2**12)     # control sequences
+SPACES = TokenTable(16, 2**6)       # whitespace after control sequences
+
+# shared tokens used by the parser
+LBRACE = CHARS['{']
+RBRACE = CHARS['}']
+DOLLAR = CHARS['$']
+AMPERSAND = CHARS['&']
+HASH = CHARS['#']
+STAR = CHARS['*']
+LBRACKET = CHARS['[']
+RBRACKET = CHARS[']']
+BEGIN = COMMANDS['begin']
+END = COMMANDS['end']
+ITEM = COMMANDS['item']
+HLINE = COMMANDS['hline']
+NEWLINE = COMMANDS['\\']        # \\
+MATH_OPEN = COMMANDS['(']       # \(
+MATH_CLOSE = COMMANDS[')']      # \)
+DISPLAY_OPEN = COMMANDS['[']    # \[
+DISPLAY_CLOSE = COMMANDS[']']   # \]
+
+
+def scan(s, pos, stop, end, tokens, pattern=TOKEN_RE):
+    '''
+    Append tokens (in document order) for the matches starting in s[pos:stop]
+    to the list `tokens` and return the position after the last match.
+    Matches never cross `end`, but the last one may run past `stop` so
+    control sequences are never split.
+    '''
+    append = tokens.append
+    extend = tokens.extend
+    match = pattern.match
+    chars = CHARS.__getitem__
+
+    while pos < stop:
+        m = match(s, pos, end)
+        kind = m.lastgroup
+        text = m.group(kind)
+        pos = m.end()
+
+        # printable characters
+        if kind == 'text':
+            extend(map(chars, text))
+
+        # control sequence (trailing whitespace recorded as catcode 16)
+        elif kind == 'space':
+            name = m.group('word')
+            if name is None:
+                name = m.group('symbol')
+            elif not name.isalpha():
+                # cut the name at the first non-letter (and rescan from there)
+                idx = next(i for i, c in enumerate(name) if not c.isalpha())
+                name = name[:idx] or name[0]
+                if len(name) < len(m.group('word')):
+                    pos = m.start() + 1 + len(name)
+                    text = ''
+            append(COMMANDS[name])
+            if text:
+                append(SPACES[text])
+
+        # special character
+        elif kind == 'char':
+            append(chars(text))
+
+        # comment
+        elif kind == 'comment':
+            append(Token(14, text))
+
+        # \verb or verbatim environment
+        else:
+            append(Token(17, text))
+
+    return pos
+
+
+def tokenize(s, end_token=True, verbatim=None):
+    '''
+    Convert string to a list of tokens (in document order).
+    Equivalent to `tokenize_chars` but driven by the master regex,
+    so the Python loop runs once per match rather than once per character.
+    Raw tokens are returned if `verbatim` is set (see `token_re`).
+    '''
+    tokens = []
+    scan(s, 0, len(s), len(s), tokens, token_re(verbatim))
+
+    # include end token
+    if end_token:
+        tokens.append(EndToken())
+
+    return tokens
+
+
+# Runs of printable characters (the `text` group of TOKEN_RE) keyed on
+# the printable characters excluded from .the run (stop tokens).
+TEXT_RES = {}
+
+def text_re(stop_chars=''):
+    if not stop_chars in TEXT_RES:
+        TEXT_RES[stop_chars] = re.compile(
+            r'[^\\{{}}$&\n#^_~%\x7f{}]+'.format(re.escape(stop_chars)))
+    return TEXT_RES[stop_chars]
+
+
+class CatcodeTable(dict):
+    '''
+    Translation table (for str.translate) from .characters to catcodes,
+    so the catcodes of a run of characters are computed in one call.
+    '''
+    def __missing__(self, o):
+        c = self[o] = chr(catcode(chr(o)))
+        return c
+
+CATCODE_TABLE = CatcodeTable()
+
+
+class TokenBuffer():
+    '''
+    Columnar token storage. Tokens are recorded as parallel arrays of
+    catcodes and (start, end) offsets into the source string, and their
+    values are taken from .the source only when a token is requested.
+    Control sequence offsets include the escape character.
+    '''
+    def __init__(self, s, verbatim=None):
+        self.text = s
+        self.pattern = token_re(verbatim)
+        self.catcodes = array('B')
+        self.starts = array('I')
+        self.ends = array('I')
+        self.scan(0, len(s))
+
+    def __len__(self):
+        return len(self.catcodes)
+
+    def __getitem__(self, i):
+        c = self.catcodes[i]
+        if c == 0:
+            return COMMANDS[self.text[self.starts[i]+1:self.ends[i]]]
+        if c == 16:
+            return SPACES[self.text[self.starts[i]:self.ends[i]]]
+        if c == 14 or c == 17:
+            return Token(c, self.text[self.starts[i]:self.ends[i]])
+        return CHARS[self.text[self.starts[i]]]
+
+    def scan(self, pos, end):
+        '''
+        Append columns for the tokens in self.text[pos:end].
+        '''
+        s = self.text
+        catcodes = self.catcodes
+        starts = self.starts
+        ends = self.ends
+        match = self.pattern.match
+
+        while pos < end:
+            m = match(s, pos, end)
+            kind = m.lastgroup
+            start = m.start()
+            pos = m.end()
+
+            # printable characters
+            if kind == 'text':
+                text = m.group(kind)
+                catcodes.frombytes(text.translate(CATCODE_TABLE).encode('latin-1'))
+                starts.extend(range(start, pos))
+                ends.extend(range(start+1, pos+1))
+
+            # control sequence (trailing whitespace recorded as catcode 16)
+            elif kind == 'space':
+                name = m.group('word')
+                if name is None:
+                    name = m.group('symbol')
+                elif not name.isalpha():
+                    idx = next(i for i, c in enumerate(name) if not c.isalpha())
+                    name = name[:idx] or name[0]
+                    pos = min(pos, start + 1 + len(name))
+                stop = start + 1 + len(name)
+                catcodes.append(0)
+                starts.append(start)
+                ends.append(stop)
+                if stop < pos:
+                    catcodes.append(16)
+                    starts.append(stop)
+                    ends.append(pos)
+
+            # special character
+            elif kind == 'char':
+                catcodes.append(CHARS[m.group(kind)].catcode)
+                starts.append(start)
+                ends.append(pos)
+
+            # raw tokens
+            else:
+                catcodes.append(14 if kind == 'comment' else 17)
+                starts.append(start)
+                ends.append(pos)
+
+
+class TextCursor():
+    '''
+    Position in a source string, scanned a chunk at a time.
+    '''
+
+    # characters scanned per read
+    chunk_size = 512
+
+    # characters scanned by the first read after a seek (doubled on 
+    # each read up to chunk_size)
+    seek_size = 32
+
+    def __init__(self, text, pos=0, end=None, pattern=TOKEN_RE):
+        self.text = text
+        self.pos = pos
+        self.end = len(text) if end is None else end
+        self.pattern = pattern
+        self.file_id = None
+        self.size = self.chunk_size
+
+        # last chunk read (see `tell`)
+        self.chunk_start = pos
+        self.chunk_len = 0
+
+    def copy(self):
+        cursor = TextCursor(self.text, self.pos, self.end, self.pattern)
+        cursor.file_id = self.file_id
+        cursor.chunk_start = self.chunk_start
+        cursor.chunk_len = self.chunk_len
+        cursor.size = self.size
+        return cursor
+
+    def read(self):
+        '''
+        Tokens for the next chunk of the source (in stack order).
+        '''
+        tokens = []
+        self.chunk_start = self.pos
+        if self.pos < self.end:
+            stop = min(self.pos + self.size, self.end)
+            self.pos = scan(self.text, self.pos, stop, self.end, tokens, self.pattern)
+            tokens.reverse()
+            if self.size < self.chunk_size:
+                self.size = min(2 * self.size, self.chunk_size)
+        self.chunk_len = len(tokens)
+        return tokens
+
+    def tell(self, buffered):
+        '''
+        Position given `buffered` tokens not yet read from .the last chunk,
+        as (start of chunk, number of tokens read from .the chunk). Resolved
+        into an offset only when required (see `offset`).
+        '''
+        return (self.chunk_start, max(self.chunk_len - buffered, 0))
+
+    def offset(self, chunk_start, count):
+        '''
+        Offset of the token following the first `count` tokens of the chunk.
+        The chunk is scanned again only as far as required.
+        '''
+        if chunk_start == self.chunk_start and count >= self.chunk_len:
+            return self.pos
+        tokens = []
+        pos = chunk_start
+        while len(tokens) < count and pos < self.end:
+            stop = min(pos + self.seek_size, self.end)
+            pos = scan(self.text, pos, stop, self.end, tokens, self.pattern)
+        return chunk_start + sum([len(t.value) + (t.catcode == 0) for t in tokens[:count]])
+
+    def source_offset(self):
+        '''
+        Offset of the next token not yet read.
+        '''
+        return self.pos
+
+    def text_end(self):
+        '''
+        Offset of the end of the source read by the cursor.
+        '''
+        return self.end
+
+    def seek(self, pos):
+        '''
+        Move the cursor to offset `pos` (the start of a token). The next
+        reads are short (see seek_size) as only a few tokens may be read
+        before the next seek.
+        '''
+        self.pos = pos
+        self.chunk_start = pos
+        self.chunk_len = 0
+        self.size = self.seek_size
+
+    def read_text(self, stop_chars=''):
+        '''
+        Printable characters from .the cursor up to the next token that
+        is not printable (or is in `stop_chars`).
+        '''
+        m = text_re(stop_chars).match(self.text, self.pos, self.end)
+        if m:
+            self.pos = m.end()
+            return m.group()
+        return ''
+
+
+class ColumnCursor():
+    '''
+    Position in a `TokenBuffer`.
+    '''
+
+    # tokens per read
+    chunk_size = 256
+
+    def __init__(self, columns, index=0, end=None):
+        self.columns = columns
+        self.text = columns.text
+        self.index = index
+        self.end = len(columns) if end is None else end
+        self.pattern = columns.pattern
+        self.file_id = None
+
+    def copy(self):
+        cursor = ColumnCursor(self.columns, self.index, self.end)
+        cursor.file_id = self.file_id
+        return cursor
+
+    def tell(self, buffered):
+        '''
+        Position given `buffered` tokens not yet read, as (index, 0).
+        '''
+        return (max(self.index - buffered, 0), 0)
+
+    def offset(self, index, count=0):
+        '''
+        Offset of the token at `index`.
+        '''
+        if index < len(self.columns):
+            return self.columns.starts[index]
+        return len(self.text)
+
+    def seek(self, pos):
+        '''
+        Move the cursor to the token starting at offset `pos`.
+        '''
+        self.index = bisect.bisect_left(self.columns.starts, pos)
+
+    def source_offset(self):
+        '''
+        Offset of the next token not yet read.
+        '''
+        return self.offset(self.index)
+
+    def text_end(self):
+        '''
+        Offset of the end of the source read by the cursor.
+        '''
+        return self.offset(self.end)
+
+    def read(self):
+        '''
+        Tokens for the next chunk of the buffer (in stack order).
+        '''
+        stop = min(self.index + self.chunk_size, self.end)
+        tokens = [self.columns[i] for i in range(stop-1, self.index-1, -1)]
+        self.index = stop
         return tokens
 
+    def read_text(self, stop_chars=''):
+        '''
+        Printable characters from .the cursor up to the next token that
+        is not printable (or is in `stop_chars`), as a slice of the source.
+        '''
+        columns = self.columns
+        catcodes = columns.catcodes
+        text = columns.text
+        i = self.index
+        while i < self.end and catcodes[i] in PRINTABLE \
+                and not text[columns.starts[i]] in stop_chars:
+            i += 1
+        if i == self.index:
+            return ''
+        run = text[columns.starts[self.index]:columns.ends[i-1]]
+        self.index = i
+        return run
+
+
+def tokenize_chars(s, end_token=True):
+    '''
+    Convert string to a list of tokens (in document order), one character
+    at a time. This is the original tokenizer, kept as a reference for
+    testing and benchmarking `tokenize`.
+    '''
+
+    # convert string to a stream of characters
+    chars = list(s)
+    chars.reverse()
+
+    # initialize token list
+    tokens = []
+
+    # start popping chars
+    while chars:
+        c = chars.pop()
+
+        # escape character (extract command)
+        if c == '\\':
+            
+            # check for empty stream
+            if not chars:
+                tokens.append(Token(12,c))
+                continue
+            
+            # init cmd
+            cmd = chars.pop()
+            
+            #--------------------
+            # scan for cmd word
+            if cmd.isalpha():
+
+                # extract name
+                while chars and chars[-1].isalpha():
+                    cmd += chars.pop()
+
+                log.info('Command word: {}'.format(cmd))
+                    
+            # record trailing whitespace (space|tab|newline)
+            wspace = []
+            while chars and chars[-1].isspace():
+                wspace.append(chars.pop())
+            wspace = ''.join(wspace)
+            
+            # push token and whitespace (if any)
+            tokens.append(Token(0,cmd))
+            if wspace:
+                tokens.append(Token(16, wspace))
+            
+        # catcodes 1 to 15 are straightforward
+        elif c == '{':
+            tokens.append(Token(1,c))   # start group
+        elif c == '}':
+            tokens.append(Token(2,c))   # end group
+        elif c == '$':
+            tokens.append(Token(3,c))   # mathmode
+        elif c == '&':
+            tokens.append(Token(4,c))   # alignment 
+        elif c == '\n':
+            tokens.append(Token(5,c))   # newline
+        elif c == '#':
+            tokens.append(Token(6,c))   # parameter
+        elif c == '^':
+            tokens.append(Token(7,c))   # superscript
+        elif c == '_':
+            tokens.append(Token(8,c))   # subscript 
+        elif c == '':
+            tokens.append(Token(9,c))   # null (empty string)
+        elif c.isspace():
+            tokens.append(Token(10,c))  # space 
+        elif c.isalpha():
+            tokens.append(Token(11,c))  # letter
+        elif c == '~':
+            tokens.append(Token(13,c))  # active
+        elif c == '%':
+            tokens.append(Token(14,c))  # comment
+        elif c == '\x7f':
+            tokens.append(Token(15,c))  # invalid character (delete)
+        else:
+            tokens.append(Token(12,c))  # everything else
+    
+    # include end token
+    if end_token:
+        tokens.append(EndToken())
+    
+    return tokens
+
+
 
 def test_tokens():
     # s = r'\begin   {document}  \$  3   Hello \textbf   {cruel} world!  \end    {document}'
@@ -191,7 +1019,7 @@ def test_tokens():
 
     ts = TokenStream(s)
     print(s)
-    print(ts[::-1])
+    print(list(ts))
 
 if __name__ == '__main__':
     test_tokens()
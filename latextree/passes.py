@@ -0,0 +1,283 @@
+# passes.py
+r'''
+Post-processing passes (see LatexTree.pp_tree).
+
+After a parse the tree is post-processed to extract the information
+passed to the write functions and templates (labels, table of contents,
+image files, ...). Each pass declares the species and genera of the
+nodes it wants to see, and a single traversal of the tree (a Visitor)
+feeds them all. The same traversal fills the species index of the tree
+(see LatexTree.get_phenotypes).
+
+A pass is a subclass of `Pass' with
+    species     species names of the nodes visited e.g. ('label',)
+    genera      genus names of the nodes visited e.g. ('Section',)
+    every       True to visit every node
+    start       called before the traversal (e.g. to reset results)
+    visit       called for each node of interest (in document order)
+    finish      called after the traversal (e.g. to set tree attributes)
+
+Passes are run in the order given (start and finish), and each node is
+visited by the passes in the same order. Third parties can add passes
+to all new trees
+
+    @register_pass
+    class CountFootnotes(Pass):
+        species = ('footnote',)
+        def start(self, tree):
+            tree.footnote_count = 0
+        def visit(self, node, tree):
+            tree.footnote_count += 1
+
+or to a single tree with tree.passes.append(CountFootnotes()).
+'''
+
+from latextree.parser.misc import parse_kv_opt_args, parse_length
+from latextree.parser.index import SpeciesIndex, preorder
+
+import logging
+log = logging.getLogger(__name__)
+
+
+class Pass():
+    '''
+    Base class for post-processing passes.
+    '''
+    species = ()
+    genera = ()
+    every = False
+
+    def start(self, tree):
+        pass
+
+    def visit(self, node, tree):
+        pass
+
+    def finish(self, tree):
+        pass
+
+
+class Visitor():
+    '''
+    Runs `passes' over a tree in a single traversal.
+    '''
+    def __init__(self, passes):
+        self.passes = list(passes)
+        self.methods = {}   # visit methods keyed on node class
+
+    def visit_methods(self, cls):
+        '''
+        Visit methods of the passes interested in nodes of class `cls'.
+        '''
+        if not cls in self.methods:
+            self.methods[cls] = [p.visit for p in self.passes
+                if p.every or cls.species in p.species or cls.genus in p.genera]
+        return self.methods[cls]
+
+    def run(self, tree):
+        '''
+        Run the passes over `tree' and index its nodes on species.
+        '''
+        for p in self.passes:
+            p.start(tree)
+
+        index = SpeciesIndex()
+        index.root = tree.root
+        methods = self.methods
+        for node in preorder(tree.root):
+            index.add(node)
+            cls = type(node)
+            for visit in methods[cls] if cls in methods else self.visit_methods(cls):
+                visit(node, tree)
+        tree.species_index = index
+
+        for p in self.passes:
+            p.finish(tree)
+
+
+# pass classes run by every new tree (see register_pass)
+PASSES = []
+
+def register_pass(cls):
+    '''
+    Add the pass class `cls' to the passes of every new LatexTree
+    (can be used as a class decorator).
+    '''
+    PASSES.append(cls)
+    return cls
+
+
+@register_pass
+class DocumentPass(Pass):
+    '''
+    Extract document element if any.
+    '''
+    def start(self, tree):
+        tree.doc_root = next(
+            (child for child in tree.root.children if child.species == 'document'), None)
+
+
+@register_pass
+class PreamblePass(Pass):
+    '''
+    Extract selected document properties from .preamble.
+    '''
+    def start(self, tree):
+        for node in [child for child in tree.root.children if not child.species == 'document']:
+            if node.species == 'title' and 'title' in node.args:
+                tree.preamble.__setitem__('title', node.args['title'])
+            if node.species == 'author' and 'names' in node.args:
+                tree.preamble.__setitem__('author', node.args['names'])
+            if node.species == 'date' and 'date' in node.args:
+                tree.preamble.__setitem__('date', node.args['date'])
+            if node.species == 'documentclass' and 'name' in node.args:
+                tree.preamble.__setitem__('documentclass', node.args['name'])
+            if node.species == 'graphicspath' and 'paths' in node.args:
+                graphicspath = node.args['paths']
+                tree.preamble.__setitem__('graphicspath', graphicspath)
+
+
+@register_pass
+class SectionsPass(Pass):
+    '''
+    Level-1 chapters or sections (only if there is a document element).
+    '''
+    species = ('chapter', 'section')
+
+    def start(self, tree):
+        self.found = {'chapter': [], 'section': []}
+
+    def visit(self, node, tree):
+        self.found[node.species].append(node)
+
+    def finish(self, tree):
+        if tree.doc_root:
+            tree.chapters = self.found['chapter']
+            tree.sections = []
+            if not tree.chapters:
+                tree.sections = self.found['section']
+
+
+@register_pass
+class LabelsPass(Pass):
+    '''
+    Create a map of labels to the labelled Node objects.
+    '''
+    species = ('label', 'bibitem')
+
+    def start(self, tree):
+        self.found = {'label': [], 'bibitem': []}
+
+    def visit(self, node, tree):
+        self.found[node.species].append(node)
+
+    def finish(self, tree):
+        tree.labels = {}
+        for node in self.found['label']:
+            key = node.args['key'].chars(nobrackets=True)
+            while node.parent:
+                if hasattr(node, 'number'):
+                    break
+                if node.species in tree.registry.block_commands:
+                    break
+                node = node.parent
+            tree.labels.__setitem__(key, node)
+        for node in self.found['bibitem']:
+            key = node.args['key'].chars(nobrackets=True)
+            tree.labels.__setitem__(key, node)
+
+
+@register_pass
+class TocPass(Pass):
+    '''
+    Experimental: create table of contents as a dict
+        {document: [{section: [{subsection: [...]}, ...]}, ...]}
+    A section is in the table if its parent is in the table, or if it
+    is inside input files (whose sections are merged into one dict)
+    whose parent is. Sections in other nodes are left out.
+    '''
+    species = ('document',)
+    genera = ('Section',)
+
+    def start(self, tree):
+        self.subs = {}      # lists of entries keyed on node id (nodes in the table)
+        self.inputs = {}    # entries of input files keyed on node id
+        tree.toc = None
+        if tree.doc_root:
+            self.subs[id(tree.doc_root)] = []
+
+    def visit(self, node, tree):
+        if id(node) in self.subs:
+            return
+
+        # parent in the table (through input files)
+        outer = None
+        parent = node.parent
+        while parent and parent.genus == 'Input':
+            outer = parent
+            parent = parent.parent
+        if not parent or not id(parent) in self.subs:
+            return
+
+        subs = self.subs[id(node)] = []
+        if outer is None:
+            self.subs[id(parent)].append({node: subs})
+            return
+        if not id(outer) in self.inputs:
+            self.inputs[id(outer)] = {}
+            self.subs[id(parent)].append(self.inputs[id(outer)])
+        self.inputs[id(outer)][node] = subs
+
+    def finish(self, tree):
+        if tree.doc_root:
+            tree.toc = {tree.doc_root: self.subs[id(tree.doc_root)]}
+
+
+@register_pass
+class ImageFilesPass(Pass):
+    r'''
+    Create a map of `includegraphics' objects onto file names.
+
+    The filenames are relative to LATEX_ROOT and possibly `graphicspath'
+    We need to check \graphicspath and \DeclareGraphicsExtensions
+    The `graphics' table is used by write functions to
+        (1) copy image files (static files) to the server
+        (2) include <img src="{{ ... }}"> elements in templates.
+    '''
+    species = ('includegraphics', 'includevideo')
+
+    def start(self, tree):
+        tree.image_files = {}
+        tree.video_urls = {}
+
+    def visit(self, node, tree):
+        if node.species == 'includegraphics':
+            fname_str = node.args['file'].children[0].content
+            tree.image_files.__setitem__(node, fname_str)
+        else:
+            log.debug('includevideo args: {}'.format(node.args))
+            url_str = node.args['arg1'].chars(
+                nobrackets=True)  # defined with \newfloat
+            tree.video_urls.__setitem__(node, url_str)
+
+
+@register_pass
+class WidthsPass(Pass):
+    '''
+    Set width attributes for minipages and images
+    '''
+    species = ('minipage', 'includegraphics')
+
+    def visit(self, node, tree):
+        if node.species == 'minipage':
+            width = node.args['width'].chars(
+                nobrackets=True)  # mandatory arg
+            node.width = parse_length(width)
+
+        elif 'options' in node.args:  # optional arg
+            opt_arg_str = node.args['options'].chars(nobrackets=True)
+            kw = parse_kv_opt_args(opt_arg_str)[1]
+            if 'scale' in kw:
+                node.width = str(int(99*float(kw['scale']))) + '%'
+            elif 'width' in kw:
+                node.width = parse_length(kw['width']) + '%'
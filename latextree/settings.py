@@ -13,6 +13,12 @@ LATEX_ROOT = os.path.join(PACKAGE_DIR, 'tex')
 LOG_ROOT = os.path.join(PACKAGE_DIR, 'log')
 WEB_ROOT = os.path.join(PACKAGE_DIR, 'web')
 
+# compiled registry snapshots (see parser/registry.py): a per-user cache
+# directory, or $LATEXTREE_CACHE if set (set it to '' to disable snapshots)
+CACHE_ROOT = os.environ.get('LATEXTREE_CACHE', os.path.join(
+    os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'),
+    'latextree'))
+
 # custom
 EXTENSIONS_ROOT = os.path.join(BASE_DIR, 'extensions')
 
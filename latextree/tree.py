@@ -14,8 +14,11 @@ import sys
 
 
 import pprint as pp
-from latextree.parser.misc import parse_kv_opt_args, parse_length
 from latextree.parser import Parser
+from latextree.parser.compact import CompactTree
+from latextree.parser.index import SpeciesIndex
+from latextree.passes import PASSES, Visitor, DocumentPass, PreamblePass, SectionsPass, \
+    LabelsPass, TocPass, ImageFilesPass, WidthsPass
 from latextree.reader import read_latex_file
 import sys
 import os
@@ -64,11 +67,17 @@ class LatexTree():
 
         # init tree (single)
         self.tex_main = None    # record main file name
+        self.node_ids = None    # serial numbers of the nodes: 0..node_ids.count-1 (see parser/node.py)
+        self.root = None
+        self.species_index = None   # nodes keyed on species (see get_phenotypes)
 
         # for passing to templates
         self.preamble = {}      # selected document properties extracted from root node
         self.images = {}        # image source files (keyed on file name)
 
+        # post-processing passes (see pp_tree)
+        self.passes = [pass_class() for pass_class in PASSES]
+
         # read extensions (custom definitions)
         for ext_file in os.listdir(EXTENSIONS_ROOT):
             if ext_file.endswith(".json"):
@@ -91,153 +100,116 @@ class LatexTree():
     def parse(self, s):
         self.root = self.parser.parse(s)
         self.registry = self.parser.registry
+        self.node_ids = self.parser.node_ids
         self.pp_tree()
 
-    def parse_file(self, tex_main):
+    def parse_file(self, tex_main, parallel=False, processes=None, select=None):
+        r'''
+        Parse `tex_main' (see Parser.parse_file). With select='chapter:3' 
+        (or 'section:2.1', 'label:key') only the preamble and the selected 
+        block are parsed, e.g. for previewing a single chapter.
+        '''
         self.tex_main = os.path.join(LATEX_ROOT, tex_main)
-        self.root = self.parser.parse_file(tex_main)
+        self.root = self.parser.parse_file(tex_main, parallel=parallel, processes=processes, select=select)
         self.registry = self.parser.registry
+        self.node_ids = self.parser.node_ids
+        self.pp_tree()
+
+    def parse_preamble(self, tex_main):
+        r'''
+        Parse the preamble of `tex_main' only (up to \begin{document}, see 
+        Parser.parse_preamble) and extract the document properties (title, 
+        author, date, ...) into `preamble'. Much faster than parse_file 
+        when only the metadata is needed, e.g. for indexing documents. 
+        The parser is reset first so a tree can be reused for many files.
+        '''
+        self.tex_main = os.path.join(LATEX_ROOT, tex_main)
+        self.parser.reset()
+        self.root = self.parser.parse_preamble(tex_main)
+        self.registry = self.parser.registry
+        self.node_ids = self.parser.node_ids
+        self.doc_root = None
+        self.preamble = {}
+        self.pp_preamble()
+
+    def reparse(self, changed_paths):
+        r'''
+        Update the tree after editing the files in `changed_paths'.
+        Only the \input files which changed are parsed again (unless the 
+        main file or the definitions changed, see Parser.reparse), then 
+        numbers, labels and the table of contents are recomputed.
+        '''
+        self.root = self.parser.reparse(self.root, changed_paths)
+        self.species_index = None   # the root is updated in place
+        self.registry = self.parser.registry
+        self.node_ids = self.parser.node_ids
         self.pp_tree()
 
     # post-processing functions
     def pp_tree(self):
         """Extract information for passing to write functions and templates.
 
+        The post-processing passes in `passes' (see passes.py) are run in a 
+        single traversal of the tree, which also indexes the nodes on species.
+        Append a Pass to `passes' (or use passes.register_pass) to extract 
+        more information.
+
         Question: how much of this should be done here, and how much in latex2html.py?
 
         """
         if not self.root:
             return
-        self.pp_document()
-        self.pp_preamble()
-        self.pp_sections()
-        self.pp_labels()
-        self.pp_toc()
-        self.pp_image_files()
-        self.pp_widths()
+        Visitor(self.passes).run(self)
+
+    def run_pass(self, pass_class):
+        """Run a single post-processing pass (a traversal of the tree unless 
+        the pass only looks at the children of the root)."""
+        p = pass_class()
+        if p.species or p.genera or p.every:
+            Visitor([p]).run(self)
+        else:
+            p.start(self)
+            p.finish(self)
 
     def pp_document(self):
-        '''Extract document element if any.'''
-        if any([child.species == 'document' for child in self.root.children]):
-            self.doc_root = next(
-                (child for child in self.root.children if child.species == 'document'), None)
+        """Extract document element if any."""
+        self.run_pass(DocumentPass)
 
     def pp_sections(self):
-        """Tree search (DFS) for Level-1 chapters or sections."""
-        if self.doc_root:
-            self.chapters = self.get_phenotypes('chapter')
-            self.sections = []
-            if not self.chapters:
-                self.sections = self.get_phenotypes('section')
+        """Level-1 chapters or sections."""
+        self.run_pass(SectionsPass)
 
     def pp_preamble(self):
         """Extract selected document properties from preamble."""
-        for node in [child for child in self.root.children if not child.species == 'document']:
-            if node.species == 'title' and 'title' in node.args:
-                self.preamble.__setitem__('title', node.args['title'])
-            if node.species == 'author' and 'names' in node.args:
-                self.preamble.__setitem__('author', node.args['names'])
-            if node.species == 'date' and 'date' in node.args:
-                self.preamble.__setitem__('date', node.args['date'])
-            if node.species == 'documentclass' and 'name' in node.args:
-                self.preamble.__setitem__('documentclass', node.args['name'])
-            if node.species == 'graphicspath' and 'paths' in node.args:
-                graphicspath = node.args['paths']
-                self.preamble.__setitem__('graphicspath', graphicspath)
+        self.run_pass(PreamblePass)
 
     def pp_labels(self):
         """Create a map of labels to the labelled Node objects."""
-        self.labels = {}
-        for node in self.get_phenotypes('label'):
-            key = node.args['key'].chars(nobrackets=True)
-            while node.parent:
-                if hasattr(node, 'number'):
-                    break
-                if node.species in self.registry.block_commands:
-                    break
-                # if node.family == 'Environment':
-                #     break
-                node = node.parent
-            self.labels.__setitem__(key, node)
-        for node in self.get_phenotypes('bibitem'):
-            key = node.args['key'].chars(nobrackets=True)
-            self.labels.__setitem__(key, node)
+        self.run_pass(LabelsPass)
 
     def pp_image_files(self):
-        r"""Create a map of `includegraphics' objects onto file names.
-
-        The filenames are relative to LATEX_ROOT and possibly `graphicspath'
-        We need to check \graphicspath and \DeclareGraphicsExtensions
-        The `graphics' table is used by write functions to
-            (1) copy image files (static files) to the server 
-            (2) include <img src="{{ ... }}"> elements in templates.
-
-        """
-        self.image_files = {}
-        for node in self.get_phenotypes('includegraphics'):
-            fname_str = node.args['file'].children[0].content
-            self.image_files.__setitem__(node, fname_str)
-
-        self.video_urls = {}
-        for video in self.get_phenotypes('includevideo'):
-            print(video.args)
-            url_str = video.args['arg1'].chars(
-                nobrackets=True)  # defined with \newfloat
-            self.video_urls.__setitem__(video, url_str)
+        """Create a map of `includegraphics' objects onto file names."""
+        self.run_pass(ImageFilesPass)
 
     def pp_widths(self):
         """Set width attributes for minipages and images"""
-        for minipage in self.get_phenotypes('minipage'):
-            width = minipage.args['width'].chars(
-                nobrackets=True)  # mandatory arg
-            minipage.width = parse_length(width)
-
-        for image in self.get_phenotypes('includegraphics'):
-            if 'options' in image.args:  # optional arg
-                opt_arg_str = image.args['options'].chars(nobrackets=True)
-                kw = parse_kv_opt_args(opt_arg_str)[1]
-                if 'scale' in kw:
-                    image.width = str(int(99*float(kw['scale']))) + '%'
-                elif 'width' in kw:
-                    image.width = parse_length(kw['width']) + '%'
+        self.run_pass(WidthsPass)
 
     def pp_toc(self):
         """Experimental: create table of contents as a dict"""
-        # recursive function (local)
-        def _pp_toc(node):
-
-            # check node is not 'None' (e.g. from optional arguments)
-            if not node:
-                return {}
-
-            # hack for input or include (file contents parsed into children)
-            if node.genus == 'Input':
-                tt = {}
-                for child in node.children:
-                    tt.update(_pp_toc(child))
-                return tt
-
-            # check children for subsections etc.
-            subs = []
-            for child in node.children:
-                s = _pp_toc(child)
-                if s:
-                    subs.append(s)
-
-            # check node
-            # hack: include root.document node to start things off
-            if node.genus == 'Section' or node.species == 'document':
-                return {node: subs}
-            else:
-                return {}
-
-        # call recursive function on self.document (if it exists)
-        self.toc = None
-        if self.doc_root:
-            self.toc = _pp_toc(self.doc_root)
+        self.run_pass(TocPass)
 
     # search functions
 
+    def locate(self, node):
+        '''
+        Source location of `node` as a Location(file, line, column)
+        named tuple, or None if not known (see parser/location.py).
+        '''
+        if not self.parser.source_map:
+            return None
+        return self.parser.source_map.locate(node)
+
     def get_container(self, node):
         """Get the nearest container for the node in the hierarchy, 
         i.e. the containing environment or other numbered species."""
@@ -251,36 +223,23 @@ class LatexTree():
         return None
 
     def get_phenotypes(self, species):
-        """Retrieve all nodes of the given species."""
-
-        # define inner recursive function
-        def _get_phenotypes(node, species):
-
-            # check node is not 'None' (e.g. from optional arguments)
-            if not node:
-                return []
-
-            # init phenotype list
-            phenotypes = []
-
-            # check node
-            if node.species == species:
-                phenotypes.append(node)
-
-            # check arguments (if any)
-            if hasattr(node, 'args'):
-                for arg in node.args.values():
-                    phenotypes.extend(_get_phenotypes(arg, species))
-
-            # check children
-            for child in node.children:
-                phenotypes.extend(_get_phenotypes(child, species))
-
-            # return phenotypes
-            return phenotypes
-
-        # 2. call recursive function on root
-        return _get_phenotypes(self.root, species)
+        """Retrieve all nodes of the given species (in document order).
+        The nodes are found in the species index of the tree, which is built 
+        on the first call after the root is replaced (see parser/index.py).
+        Call index_species() after adding or removing nodes."""
+        if self.species_index is None or not self.species_index.root is self.root:
+            self.index_species()
+        return self.species_index.get(species)
+
+    def index_species(self):
+        """Index the nodes of the tree on species (see get_phenotypes)."""
+        self.species_index = SpeciesIndex(self.root)
+
+    def to_compact(self):
+        """Struct-of-arrays form of the tree (see parser/compact.py) 
+        for caching and analytics, e.g. compact.species_counts().
+        The tree is recovered with compact.to_node()."""
+        return CompactTree.from_node(self.root)
 
     # write functions
 
@@ -0,0 +1,48 @@
+# test_compact.py
+
+from latextree.parser.parser import Parser
+from latextree.parser.compact import CompactTree
+import pickle
+import pytest
+
+test_inputs = [
+    r'Hello \emph{world} % comment' + '\n',
+    r'\section*{One}\label{sec:one} text $x^2_1$ \verb|a{b|',
+    r'\begin{enumerate}\item one \item[(b)] two \end{enumerate}',
+    r'\newcommand{\hello}[1]{Hi #1} \hello{Bob} \newenvironment{note}{Note:}{End} \begin{note}x\end{note}',
+    r'\begin{tabular}{cc} a & b \\ c & d \end{tabular}',
+]
+
+def tree_signature(root):
+    from latextree.parser.parallel import walk
+    nodes = list(walk([root]))
+    index = {id(node): k for k, node in enumerate(nodes)}
+    return [(node.species, index.get(id(node.parent))) for node in nodes]
+
+@pytest.mark.parametrize("test_input", test_inputs)
+def test_round_trip(test_input):
+    root = Parser().parse(test_input)
+    compact = pickle.loads(pickle.dumps(CompactTree.from_node(root)))
+    root2 = compact.to_node()
+    assert root2.chars() == root.chars() == test_input
+    assert root2.pretty_print() == root.pretty_print()
+    assert tree_signature(root2) == tree_signature(root)
+
+def test_analytics():
+    root = Parser().parse(r'\section{A} \emph{x} \section{B} \emph{y \emph{z}}')
+    compact = CompactTree.from_node(root)
+    assert len(compact) == len(tree_signature(root))
+    assert compact.species_counts()['emph'] == 3
+    sections = compact.find('section')
+    assert [compact.species_name(i) for i in sections] == ['section', 'section']
+    assert compact.species_counts(sections[1])['emph'] == 2
+    assert compact.depth_histogram()[0] == 1
+    assert sum(compact.depth_histogram().values()) == len(compact)
+
+def test_subtree():
+    root = Parser().parse(r'\emph{one \textbf{two}} three')
+    compact = CompactTree.from_node(root)
+    i = compact.find('emph')[0]
+    node = compact.to_node(i)
+    assert node.chars() == r'\emph{one \textbf{two}}'
+    assert compact.node_text(compact.end(i)) == ' three'
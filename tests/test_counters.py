@@ -14,3 +14,13 @@ def test_parser(test_input):
     p = Parser()
     root = p.parse(test_input)
     assert test_input == root.chars()
+
+def test_markers():
+    p = Parser()
+    test_input = r'\section{A}\subsection{B}\renewcommand{\thesection}{\Roman{section}}\section{C}\thesection'
+    root = p.parse(test_input)
+    assert test_input == root.chars()
+    markers = [node.marker.chars() for node in root.children if node.species == 'section']
+    assert markers == ['1', 'II']
+    assert root.children[0].children[0].marker.chars() == '1.1'
+    assert root.children[-1].children[-1].children[0].chars() == 'II'
@@ -0,0 +1,46 @@
+# test_engine.py
+
+from latextree.parser.parser import Parser
+import pytest
+
+test_strings = [
+    r'pre {one {two} three} post',
+    r'\section{One} text \textbf{bold $x^2_{i}$} \[ y \]',
+    r'\begin{itemize} \item one \item two \begin{enumerate}\item three\end{enumerate}\end{itemize}',
+    r'\begin{tabular}{|c|c|} a & b \\ \hline c & d \end{tabular}',
+    r'\newcommand{\hello}[1]{Hi #1} \hello{Bob} {\bf bold \it italic}',
+]
+
+@pytest.mark.parametrize("test_input", test_strings)
+def test_iterative(test_input):
+    root1 = Parser(engine='recursive').parse(test_input)
+    root2 = Parser(engine='iterative').parse(test_input)
+    assert test_input == root2.chars()
+    assert root1.pretty_print() == root2.pretty_print()
+
+def test_deep_nesting():
+    n = 20000
+    p = Parser(engine='iterative')
+    root = p.parse('{' * n + 'x' + '}' * n)
+    node = root
+    for _ in range(n):
+        assert len(node.children) == 1
+        node = node.children[0]
+        assert node.species == 'Group'
+    assert node.children[0].content == 'x'
+
+def test_exceptions():
+    # exceptions raised by a nested call are thrown into the caller
+    from latextree.parser.engine import run_iterative
+    def inner(n):
+        if not n:
+            raise Exception('bottom')
+        return (yield inner(n - 1)) + 1
+    def outer():
+        try:
+            yield inner(3)
+        except Exception as e:
+            return str(e)
+    assert run_iterative(outer()) == 'bottom'
+    with pytest.raises(Exception, match='bottom'):
+        run_iterative(inner(3))
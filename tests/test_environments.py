@@ -6,6 +6,8 @@ test_strings = [
     r'pre \begin{myenv} inside \end{myenv} post',
     r'pre \begin{myenv} first \begin{myenv} inside \end{myenv} second \end{myenv} post',
     r'pre \begin{verbatim}\oops\setcounter[naughty]\end{verbatim} post',
+    r'pre \begin {verbatim}% \end{itemize} {\end {verbatim} post',
+    r'pre \begin{lstlisting}x = {1: 2} # 50% \end{lstlisting} post',
     r'pre \begin{minipage}{\linewidth} inside \end{minipage} post',
 ]
 
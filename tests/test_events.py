@@ -0,0 +1,38 @@
+# test_events.py
+
+from latextree.parser.parser import Parser
+from latextree.parser.events import tree_events
+import pytest
+
+test_strings = [
+    r'\section{A} hello $x^2$ \begin{itemize}\item a {b \bf c} \item d\end{itemize}\thesection',
+    r'\newcommand{\hello}[1]{Hi \textbf{#1}}\newenvironment{note}{N:}{.}\hello{Bob}\begin{note}x\end{note}',
+    r'\begin{tabular}{cc} a & b \\ c & d\end{tabular} \chapter{C} \section{S} \[ \sum \] $$x$$',
+    r'\begin{enumerate}\item a \begin{enumerate}\item b\end{enumerate}\end{enumerate}\itemize \item x \enditemize',
+    r'\begin{verbatim}\x{\end{verbatim} one\\two \paragraph{P} \caption[short]{long}',
+]
+
+@pytest.mark.parametrize("test_input", test_strings)
+def test_iterparse(test_input):
+    events = list(Parser().iterparse(test_input))
+    root = Parser().parse(test_input)
+    assert events == list(tree_events(root.children))
+
+def test_events():
+    events = list(Parser().iterparse(r'\section{A} one \begin{itemize}\item two\end{itemize}'))
+    assert [(e.event, e.species, e.depth) for e in events] == [
+        ('start', 'section', 0), ('text', 'Text', 1), 
+        ('start', 'itemize', 1), ('start', 'item', 2), ('text', 'Text', 3), 
+        ('end', 'item', 2), ('end', 'itemize', 1), ('end', 'section', 0)]
+    assert events[0].args == {'title': '{A}'} and events[0].marker == '1'
+    assert events[1].text == ' one '
+
+def test_close():
+    # the parser can be used again when a stream is closed early
+    p = Parser()
+    events = p.iterparse(r'\section{A} one \section{B} two')
+    next(events)
+    assert p.events.depth == 1
+    events.close()
+    assert p.events is None
+    assert p.parse(r'\section{C}').children[0].marker.chars() == '2'
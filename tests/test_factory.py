@@ -1,4 +1,5 @@
 # test_token.py
+import os
 from latextree.parser.command import Command
 from latextree.parser.registry import ClassFactory, Registry
 
@@ -21,3 +22,97 @@ def test_registry():
     print(o4)
     print(o4.__dict__)
 
+
+def test_prototype():
+    from latextree.parser.parser import Parser
+    p1 = Parser()
+    p2 = Parser()
+    assert p1.prototype is p2.prototype
+    assert not p1.registry is p1.prototype
+    p1.parse(r'\newcommand{\hello}[1]{Hi #1}\newtheorem{theo}{Theorem}\section{A}')
+    assert 'hello' in p1.registry.custom and 'theo' in p1.counters
+    assert not 'hello' in p2.registry.species and not 'hello' in p1.prototype.species
+    assert not 'theo' in p1.prototype.numbered
+    p1.reset()
+    assert not 'hello' in p1.registry.species and not 'theo' in p1.counters
+    assert p1.counters['section'] == 0
+    root = p1.parse(r'\section{B}')
+    assert root.children[0].number == 1
+
+
+def test_snapshot(tmp_path, monkeypatch):
+    import copy
+    from latextree.parser import registry
+    from latextree.parser.coredefs import defs
+    monkeypatch.setattr(registry, 'SNAPSHOT_ROOT', str(tmp_path))
+    built = Registry.prototype(copy.deepcopy(defs))
+    loaded = Registry.prototype(copy.deepcopy(defs))
+    assert not loaded is built and len(list(tmp_path.iterdir())) == 1
+    assert not dict.__contains__(loaded.species, 'section') and 'section' in loaded.species
+    for name in ['params', 'block_command_stops', 'numbered', 'marker_formats', 'names', 'verbatim']:
+        assert getattr(loaded, name) == getattr(built, name)
+    for name, cls in built.species.items():
+        assert loaded.species[name].__name__ == cls.__name__
+        assert loaded.species[name].__bases__[0].__name__ == cls.__bases__[0].__name__
+    assert loaded.is_environment('itemize') and loaded.is_genus('section', 'Section')
+
+
+def test_snapshot_untrusted(tmp_path, monkeypatch):
+    # snapshots are not read from (or written to) files and directories
+    # which other users can write
+    import copy
+    from latextree.parser import registry
+    from latextree.parser.coredefs import defs
+    monkeypatch.setattr(registry, 'SNAPSHOT_ROOT', str(tmp_path))
+    path = registry.snapshot_path([defs])
+    Registry.prototype(copy.deepcopy(defs))
+    assert Registry.load(path) is not None
+    os.chmod(path, 0o666)
+    assert Registry.load(path) is None
+    os.chmod(path, 0o600)
+    os.chmod(tmp_path, 0o777)
+    assert Registry.load(path) is None
+    os.remove(path)
+    Registry.prototype(copy.deepcopy(defs))
+    assert not os.path.exists(path)
+
+
+def test_snapshot_key(tmp_path, monkeypatch):
+    # a change to the registry code gives a new snapshot
+    from latextree.parser import registry
+    from latextree.parser.coredefs import defs
+    monkeypatch.setattr(registry, 'SNAPSHOT_ROOT', str(tmp_path))
+    path = registry.snapshot_path([defs])
+    assert registry.SOURCE_HASH
+    monkeypatch.setattr(registry, 'SOURCE_HASH', 'changed')
+    assert not registry.snapshot_path([defs]) == path
+
+
+def test_lazy_species():
+    from latextree.parser.parser import Parser
+    p = Parser()
+    assert ClassFactory('textbf', ['contents'], BaseClass=Command) is ClassFactory('textbf', ('contents',), Command)
+    assert 'emph' in p.prototype.species and not dict.__contains__(p.prototype.species, 'emph')
+    root = p.parse(r'\emph{x} \unknown')
+    assert root.children[0].__class__ is p.registry.species['emph'] is Parser().registry.species['emph']
+    assert root.children[-1].__class__ is p.registry.species['unknown']
+    assert not dict.__contains__(p.prototype.species, 'emph')
+
+
+def test_document_classes_freed():
+    # classes of unknown commands are not kept after the document
+    import gc
+    from latextree.parser import registry
+    from latextree.parser.parser import Parser
+    p = Parser()
+    p.parse(r'\emph{x} \zzwarmup')
+    p.reset()
+    gc.collect()
+    before = len(registry.FACTORY_CLASSES), len(registry.DEFINED_CLASSES)
+    for k in range(2000):
+        name = 'zz' + ''.join(chr(ord('a') + int(d)) for d in str(k))
+        p.parse(r'\emph{x} \%s' % name)
+        p.reset()
+    gc.collect()
+    assert len(registry.FACTORY_CLASSES) <= before[0] + 10
+    assert len(registry.DEFINED_CLASSES) == before[1]
@@ -0,0 +1,46 @@
+# test_index.py
+
+from latextree.parser.parser import Parser
+from latextree.parser.index import SpeciesIndex
+import pytest
+
+test_input = r'''\section{One \label{sec:one}}
+\begin{figure}\includegraphics[width=3cm]{a.png}\caption{A \emph{first}}\end{figure}
+\section*{Two} \emph{x \emph{y}} \label{sec:two}
+\begin{itemize}\item[\emph{a}] one \item two\end{itemize}
+'''
+
+def find(node, species):
+    '''
+    Reference search (the recursive LatexTree.get_phenotypes)
+    '''
+    found = [node] if node.species == species else []
+    for arg in getattr(node, 'args', {}).values():
+        if arg:
+            found.extend(find(arg, species))
+    for child in node.children:
+        found.extend(find(child, species))
+    return found
+
+@pytest.mark.parametrize("species", ['section', 'label', 'emph', 'includegraphics', 'item', 'Text', 'missing'])
+def test_document_order(species):
+    root = Parser().parse(test_input)
+    index = SpeciesIndex(root)
+    nodes = index.get(species)
+    expected = find(root, species)
+    assert len(nodes) == len(expected)
+    assert all(a is b for a, b in zip(nodes, expected))
+
+def test_tree():
+    from latextree import LatexTree
+    tree = LatexTree()
+    tree.root = Parser().parse(test_input)
+    assert len(tree.get_phenotypes('section')) == 2
+    index = tree.species_index
+    tree.get_phenotypes('label').clear()
+    assert tree.species_index is index and len(tree.get_phenotypes('label')) == 2
+
+    # a new root is indexed again
+    tree.root = Parser().parse(r'\section{Three}')
+    assert len(tree.get_phenotypes('section')) == 1
+    assert not tree.species_index is index
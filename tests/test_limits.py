@@ -0,0 +1,48 @@
+# test_limits.py
+
+from latextree.parser.parser import Parser
+from latextree.parser.limits import ExpansionLimitExceeded
+import pickle
+import pytest
+
+# doubling macros: \twicea expands to 2 tokens, \twiceb to 4, ... 
+def doubling(n):
+    defs = [r'\newcommand{\twicea}{xx}']
+    names = ['twicea']
+    for k in range(1, n):
+        names.append('twice' + chr(ord('a') + k))
+        defs.append(r'\newcommand{\%s}{\%s\%s}' % (names[k], names[k-1], names[k-1]))
+    return ''.join(defs) + '\\' + names[-1]
+
+test_docs = [
+    # source, limits, limit exceeded, macro
+    (r'\newcommand{\a}{\a}\a', {}, 'max_depth', 'a'),
+    (r'\def\a{x\a}\a', {'max_depth': 10}, 'max_depth', 'a'),
+    (r'\newenvironment{e}{\begin{e}}{\end{e}}\begin{e}x\end{e}', {}, 'max_depth', 'e'),
+    (doubling(12), {'max_tokens': 1000}, 'max_tokens', 'twicec'),
+    (r'\newcommand{\a}{x}\a', {'max_time': 0}, 'max_time', 'a'),
+]
+
+@pytest.mark.parametrize("engine", ['recursive', 'iterative'])
+@pytest.mark.parametrize("test_doc", test_docs)
+def test_limits(test_doc, engine):
+    s, limits, limit, macro = test_doc
+    p = Parser(engine=engine, limits=limits)
+    with pytest.raises(ExpansionLimitExceeded) as info:
+        p.parse(s)
+    assert info.value.limit == limit
+    assert info.value.macro == macro
+    assert info.value.count > 0
+
+    # the exception survives pickling (parallel workers)
+    e = pickle.loads(pickle.dumps(info.value))
+    assert (e.macro, e.count, e.limit, e.value) == (info.value.macro, info.value.count, limit, info.value.value)
+
+def test_within_limits():
+    # limits apply per parse
+    p = Parser(limits={'max_tokens': 4096, 'max_depth': 12})
+    for _ in range(3):
+        root = p.parse(doubling(11))
+        assert root.chars().endswith(r'\twicek')
+    assert p.budget.tokens == 4094
+    assert p.budget.depth == 0
@@ -0,0 +1,22 @@
+# test_location.py
+
+from latextree.parser.parser import Parser
+import pytest
+
+test_input = 'Hello\n\\section{One}\n  \\label{sec:one}\n\\begin{itemize}\\item x\\end{itemize}'
+
+@pytest.mark.parametrize("columnar", [False, True])
+def test_locate(columnar):
+    p = Parser(columnar=columnar)
+    root = p.parse(test_input)
+    assert test_input == root.chars()
+    section = root.children[2]
+    label = section.children[1]
+    assert section.species == 'section' and label.species == 'label'
+    assert p.source_map.locate(section) == ('<string>', 2, 9)
+    assert p.source_map.locate(label) == ('<string>', 3, 9)
+
+def test_no_locations():
+    p = Parser(locations=False)
+    root = p.parse(test_input)
+    assert p.source_map is None
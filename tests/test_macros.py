@@ -27,3 +27,72 @@ def test_parser(test_input):
     p = Parser()
     root = p.parse(test_input)
     assert test_input == root.chars()
+
+def test_template():
+    p = Parser()
+    root = p.parse(r'\newcommand{\hi}[2]{#2, #1 #2} \hi{a}{b} \renewcommand{\hi}[1]{Bye #1} \hi{c}')
+    hi1, hi2 = [node for node in root.children if node.species == 'hi']
+    assert ''.join([x.chars() for x in hi1.children]) == 'b, a b'
+    assert ''.join([x.chars() for x in hi2.children]) == 'Bye c'
+
+test_bodies = [
+    r'plain text',
+    r'\textbf{#1} and {{nested}} groups',
+    r'escaped \{ braces \} and \\ newlines',
+    'a comment with a brace % {\n and more',
+    r'\verb|{| and \begin{verbatim} } \end{verbatim}',
+    r'\begin{itemize}',
+    r'\end{itemize}',
+]
+
+@pytest.mark.parametrize("body", test_bodies)
+@pytest.mark.parametrize("columnar", [False, True])
+def test_noexpand_group(body, columnar):
+    p = Parser(columnar=columnar)
+    s = r'\newcommand{\x}{' + body + r'} after'
+    root = p.parse(s)
+    assert root.chars() == s
+    assert p.registry.custom['x'] == body
+    assert root.children[-1].chars() == ' after'
+
+def test_noexpand_group_spliced():
+    # definition read from .a macro expansion (token by token)
+    p = Parser()
+    root = p.parse(r'\newcommand{\define}{\newcommand{\inner}{a {b} \{ c}}\define\inner')
+    assert p.registry.custom['inner'] == r'a {b} \{ c'
+    assert ''.join([x.chars() for x in root.children[-1].children]) == r'a {b} \{ c'
+
+@pytest.mark.parametrize("columnar", [False, True])
+def test_noexpand_group_unterminated(columnar):
+    with pytest.raises(Exception, match=r"^Right brace '\}' expected\.$"):
+        Parser(columnar=columnar).parse(r'\newcommand{\x}{a {b}')
+
+test_arguments = [
+    r'\newcommand{\hi}[2]{#2, #1} \hi{a \emph{b}}{c $x$}',
+    r'\newcommand{\hi}[2][x]{#1 #2} \hi{a} \hi[b \\ c]{d} \hi a',
+    r'\newcommand{\hi}[1]{(#1)} \newcommand{\ho}[1]{\hi{#1} \hi{[#1]}} \ho{a {b} % c' + '\n' + r'\textbf{d}}',
+    r'\newenvironment{myenv}[1]{\textbf{#1}}{end} \begin{myenv}{a \emph{b}}inside\end{myenv}',
+    r'\newcommand{\hi}[1]{#1} \hi{\newcommand{\e}{E}\e}',
+]
+
+@pytest.mark.parametrize("test_input", test_arguments)
+@pytest.mark.parametrize("columnar", [False, True])
+def test_recorded_arguments(test_input, columnar, monkeypatch):
+    # the recorded argument tokens expand like the arguments converted back to Latex
+    expand_template = Parser.expand_template
+    expanded = []
+    def expand(self, template, args, arg_tokens=None):
+        args = list(args)
+        tokens = expand_template(self, template, args, arg_tokens)
+        assert tokens == expand_template(self, template, args)
+        expanded.append(tokens)
+        return tokens
+    monkeypatch.setattr(Parser, 'expand_template', expand)
+    root = Parser(columnar=columnar).parse(test_input)
+    assert root.chars() == test_input
+    assert expanded
+
+def test_quiet(capsys):
+    # macro uses are logged, not written to stdout
+    Parser().parse(r'\newcommand{\hi}[1]{Hi #1} \hi{a} \hi{b}')
+    assert capsys.readouterr().out == ''
@@ -9,6 +9,10 @@ test_strings = [
     # comments
     r'''%\def\bit{\itemize}
     ''',
+    'pre % \\begin{itemize} and } \n post',
+    'pre %comment at the end',
+    # verb
+    r'pre \verb|\begin{itemize}%| and \verb*+{x}+ post',
 ]
 
 @pytest.mark.parametrize("test_input", test_strings)
@@ -19,3 +19,104 @@ def test_add_child():
     child = Text('abcde')
     node.append_child(child)
     assert node.children[-1] == child and node.children[-1].parent == node
+
+
+def test_taxonomy():
+    from latextree.parser.registry import ClassFactory
+    genus = ClassFactory('List', [], BaseClass=Environment)
+    species = ClassFactory('itemize', [], BaseClass=genus)
+    node = species()
+    assert (node.species, node.genus, node.family) == ('itemize', 'List', 'Environment')
+    assert (species.species, species.genus, species.family) == ('itemize', 'List', 'Environment')
+    assert (Text.species, Text.genus, Text.family) == ('Text', 'Content', 'Node')
+
+
+def test_slots():
+    from latextree.parser.group import Group
+    from latextree.parser.registry import ClassFactory
+    for node in [Text('abc'), Group()]:
+        assert not hasattr(node, '__dict__')
+    node = Environment()
+    assert node.__dict__ == {}
+    node.number = 3
+    assert node.number == 3
+
+    # factory classes with arguments on a base without __dict__
+    cls = ClassFactory('boxed', ['contents'], BaseClass=Group)
+    node = cls(contents=Text('abc'))
+    assert node.args['contents'].content == 'abc'
+
+
+def test_shared_empty_children():
+    # leaves share the empty tuple, a list is created for the first child
+    leaf, env = Text('a'), Environment()
+    assert leaf.children == () and env.children == ()
+    assert env.pre_children == () and env.post_children == ()
+    first = Text('b')
+    env.append_children([first, leaf])
+    assert isinstance(env.children, list)
+    assert env.children[0] is first and env.children[1] is leaf and leaf.parent is env
+    assert Environment().children == ()
+
+
+def test_walk():
+    from latextree.parser.parallel import walk
+    node = Environment()
+    node.args['title'] = Text('title')
+    node.pre_children = [Text('pre')]
+    node.append_child(Text('child'))
+    contents = set(n.content for n in walk([node]) if n.species == 'Text')
+    assert contents == {'title', 'pre', 'child'}
+
+
+def test_ids_per_tree():
+    from latextree.parser.parser import Parser
+    from latextree.parser.parallel import walk
+    s = r'\section{A} Some \emph{text} $x^2$ \begin{itemize}\item one\end{itemize}'
+    parser = Parser()
+    root = parser.parse(s)
+    ids = [node.serial_number for node in walk([root])]
+    assert sorted(ids) == list(range(len(ids)))
+    assert parser.node_ids.count == len(ids)
+
+    # the same numbers whatever was parsed before
+    Text('abc')
+    Parser().parse(r'\section{B}')
+    root2 = Parser().parse(s)
+    assert [node.serial_number for node in walk([root2])] == ids
+
+
+def test_ids_dense(monkeypatch):
+    # numbers taken by discarded nodes (e.g. the empty row after the last
+    # \\ of a tabular) are not left as gaps, and the positions follow
+    from latextree.parser.parser import Parser
+    from latextree.parser.parallel import walk
+    s = r'\begin{tabular}{cc} a & b \\ c & d \\ \end{tabular} \emph{x}'
+    parser = Parser(locations=True)
+    root = parser.parse(s)
+    nodes = list(walk([root]))
+    assert sorted(node.serial_number for node in nodes) == list(range(len(nodes)))
+    assert parser.node_ids.count == len(nodes)
+
+    # the same positions as the nodes numbered as they were created
+    monkeypatch.setattr(Parser, 'finish_tree', lambda self, root: None)
+    created = Parser(locations=True)
+    gaps = list(walk([created.parse(s)]))
+    assert created.node_ids.count > len(gaps)
+    assert [parser.source_map.offset(node) for node in nodes] == \
+           [created.source_map.offset(node) for node in gaps]
+
+
+def test_ids_threads():
+    from concurrent.futures import ThreadPoolExecutor
+    from latextree.parser.parser import Parser
+    from latextree.parser.parallel import walk
+    s = r'\section{A} Some \emph{text} $x^2$ \begin{itemize}\item one\end{itemize}' * 20
+    def parse(_):
+        parser = Parser(locations=True)
+        root = parser.parse(s)
+        return [(node.serial_number, parser.source_map.offset(node)) for node in walk([root])]
+    expected = parse(None)
+    with ThreadPoolExecutor(4) as pool:
+        for result in pool.map(parse, range(8)):
+            assert result == expected
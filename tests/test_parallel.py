@@ -0,0 +1,70 @@
+# test_parallel.py
+
+from latextree.parser.parser import Parser
+import pytest
+
+test_docs = [
+    # numbers across files
+    {
+        'main.tex': r'\section{A}\input{one}\input{two}\section{D}\thesection',
+        'one.tex': r'\section{B}\subsection{B1} \begin{enumerate}\item x \item y\end{enumerate}',
+        'two.tex': r'\section{C}\begin{figure}\caption{fig}\end{figure}',
+    },
+    # macro defined in a file and used in a later file
+    {
+        'main.tex': r'\input{one} text \input{two}',
+        'one.tex': r'\newcommand{\hello}[1]{Hello #1}\section{B}',
+        'two.tex': r'\hello{world} \section{C}',
+    },
+    # macro defined in a file and used in the main file
+    {
+        'main.tex': r'\input{one} \hello{world} \input{two}',
+        'one.tex': r'\newcommand{\hello}[1]{Hello #1}',
+        'two.tex': r'\hello{moon}',
+    },
+    # marker format changed in a file
+    {
+        'main.tex': r'\section{A}\input{one}\section{C}\input{two}',
+        'one.tex': r'\renewcommand{\thesection}{\Roman{section}}\section{B}',
+        'two.tex': r'\section{D}\thesection',
+    },
+    # macro redefined in a file with the same arguments
+    {
+        'main.tex': r'\newcommand{\hello}[1]{Hello #1}\input{one} \hello{world}',
+        'one.tex': r'\renewcommand{\hello}[1]{Goodbye #1}',
+    },
+    # input file inside a list
+    {
+        'main.tex': r'\begin{enumerate}\item a \input{one}\item d\end{enumerate}',
+        'one.tex': r'\item b \begin{enumerate}\item c\end{enumerate}',
+    },
+]
+
+@pytest.mark.parametrize("test_doc", test_docs)
+def test_parallel(tmp_path, test_doc):
+    for name, s in test_doc.items():
+        (tmp_path / name).write_text(s)
+    tex_main = str(tmp_path / 'main.tex')
+    p1 = Parser()
+    root1 = p1.parse_file(tex_main)
+    p2 = Parser()
+    root2 = p2.parse_file(tex_main, parallel=True, processes=2)
+    assert root1.chars() == root2.chars() == test_doc['main.tex']
+    assert root1.pretty_print() == root2.pretty_print()
+    assert p1.counters == p2.counters
+
+    # the grafted trees are numbered 0..n-1 too
+    from latextree.parser.parallel import walk
+    ids = sorted(node.serial_number for node in walk([root2]))
+    assert ids == list(range(len(ids))) and p2.node_ids.count == len(ids)
+
+def test_locate(tmp_path):
+    (tmp_path / 'main.tex').write_text('\\input{one}\n\\input{two}')
+    (tmp_path / 'one.tex').write_text('one')
+    (tmp_path / 'two.tex').write_text('two\n\\section{B}')
+    p = Parser()
+    root = p.parse_file(str(tmp_path / 'main.tex'), parallel=True)
+    section = root.children[2].children[-1]
+    assert section.species == 'section'
+    assert p.source_map.locate(section) == (str(tmp_path / 'two.tex'), 2, 9)
+    assert len(set(node.serial_number for node in [section] + root.children)) == 4
@@ -0,0 +1,99 @@
+# test_passes.py
+
+from latextree import LatexTree
+from latextree.passes import Pass, PASSES, register_pass
+import pytest
+
+test_input = r'''\documentclass{article}
+\title{Passes}
+\begin{document}
+\section{One}\label{sec:one}
+\subsection{One.One}
+\begin{figure}\includegraphics[scale=0.5]{a.png}\caption{A}\label{fig:a}\end{figure}
+\begin{minipage}{0.5\textwidth}\section{Hidden}\end{minipage}
+\section{Two}\emph{x \emph{y}}
+\begin{thebibliography}{9}\bibitem{ref} Ref\end{thebibliography}
+\end{document}
+'''
+
+class CountEmph(Pass):
+    species = ('emph',)
+
+    def start(self, tree):
+        self.found = []
+
+    def visit(self, node, tree):
+        self.found.append(node)
+
+    def finish(self, tree):
+        tree.emph_count = len(self.found)
+
+class CountNodes(Pass):
+    every = True
+
+    def start(self, tree):
+        tree.node_count = 0
+
+    def visit(self, node, tree):
+        tree.node_count += 1
+
+def parse(s):
+    tree = LatexTree()
+    tree.parse(s)
+    return tree
+
+def test_results():
+    tree = parse(test_input)
+    assert tree.doc_root.species == 'document'
+    assert tree.preamble['title'].chars(nobrackets=True) == 'Passes'
+    assert [s.args['title'].chars(nobrackets=True) for s in tree.sections] == ['One', 'Hidden', 'Two']
+    assert tree.labels['sec:one'].species == 'section'
+    assert tree.labels['fig:a'].species == 'figure'
+    assert tree.labels['ref'].species == 'bibitem'
+    assert list(tree.image_files.values()) == ['a.png']
+    assert tree.get_phenotypes('includegraphics')[0].width == '49%'
+
+    # sections inside other environments are not in the table of contents
+    sections = tree.toc[tree.doc_root]
+    assert [list(s)[0].args['title'].chars(nobrackets=True) for s in sections] == ['One', 'Two']
+    assert [list(s)[0].species for s in list(sections[0].values())[0]] == ['subsection']
+
+def test_no_document():
+    tree = parse(r'\section{One}\label{one}')
+    assert tree.doc_root is None
+    assert tree.toc is None
+    assert 'one' in tree.labels
+
+@pytest.mark.parametrize("s,count", [(test_input, 2), (r'\emph{a}', 1), ('a', 0)])
+def test_tree_pass(s, count):
+    tree = LatexTree()
+    tree.passes.append(CountEmph())
+    tree.parse(s)
+    assert tree.emph_count == count
+
+def test_register_pass():
+    register_pass(CountNodes)
+    try:
+        tree = parse(test_input)
+    finally:
+        PASSES.remove(CountNodes)
+    assert tree.node_count == sum(tree.species_index.counts().values())
+    assert not any(isinstance(p, CountNodes) for p in LatexTree().passes)
+
+def test_single_pass():
+    # pp_* run one pass each, with the same results
+    tree = parse(test_input)
+    labels, toc, chapters = tree.labels, tree.toc, tree.chapters
+    tree.pp_labels()
+    tree.pp_toc()
+    tree.pp_sections()
+    assert tree.labels == labels and tree.toc == toc and tree.chapters == chapters
+
+def test_quiet(capsys):
+    # image files are collected without writing to stdout
+    s = test_input.replace(r'\begin{document}', r'\newcommand{\includevideo}[2][]{#2}\begin{document}\includevideo{b.mp4}')
+    tree = parse(s)
+    capsys.readouterr()
+    tree.pp_image_files()
+    assert capsys.readouterr().out == ''
+    assert list(tree.video_urls.values()) == ['b.mp4']
@@ -0,0 +1,51 @@
+# test_preamble.py
+
+from latextree import LatexTree
+import pytest
+
+test_docs = [
+    # standard preamble
+    r'''\documentclass[12pt]{article}
+\title{Test} \author{DE} \date{2019}
+\graphicspath{{figures/}}
+\newcommand{\hello}[1]{Hi #1}
+\begin{document}
+\hello{Bob}
+\end{document}''',
+    # \begin{document} in a comment, escaped percent sign
+    r'''\documentclass{article}
+% \begin{document}
+\title{50\% Test} \begin   {document} \section{A}
+\end{document}''',
+    # line break then a comment (not an escaped percent sign)
+    r'''\title{a}\\% \begin{document}
+\author{b}
+\begin{document}x\end{document}''',
+    # tex-style environment
+    r'''\documentclass{article}\author{DE}\document text\enddocument''',
+]
+
+@pytest.mark.parametrize("test_doc", test_docs)
+def test_preamble(tmp_path, test_doc):
+    (tmp_path / 'main.tex').write_text(test_doc)
+    tex_main = str(tmp_path / 'main.tex')
+    t1 = LatexTree()
+    t1.parse_file(tex_main)
+    t2 = LatexTree()
+    t2.parse_preamble(tex_main)
+    assert {k: v.chars() for k, v in t1.preamble.items()} == {k: v.chars() for k, v in t2.preamble.items()}
+    assert set(t1.registry.custom) == set(t2.registry.custom)
+    assert t1.root.chars().startswith(t2.root.chars())
+
+def test_body_not_parsed(tmp_path):
+    # the body would raise an exception (unmatched $$)
+    (tmp_path / 'main.tex').write_text('\\title{T}\n\\begin{document} $$ x $ \\end{document}')
+    t = LatexTree()
+    t.parse_preamble(str(tmp_path / 'main.tex'))
+    assert t.preamble['title'].chars() == '{T}'
+
+def test_comment_after_line_break(tmp_path):
+    (tmp_path / 'main.tex').write_text(test_docs[2])
+    t = LatexTree()
+    t.parse_preamble(str(tmp_path / 'main.tex'))
+    assert t.preamble['author'].chars() == '{b}'
@@ -0,0 +1,48 @@
+# test_reparse.py
+
+from latextree.parser.parser import Parser
+import pytest
+
+test_doc = {
+    'main.tex': r'\section{A}\input{one}\input{two}\section{D}\thesection',
+    'one.tex': r'\section{B}\begin{enumerate}\item x\end{enumerate}\input{three}',
+    'two.tex': r'\section{C}\begin{figure}\caption{fig}\end{figure}',
+    'three.tex': r'\subsection{B1}',
+}
+
+test_edits = [
+    # new section in an input file (later numbers change)
+    ('one.tex', r'\section{B}\section{BB}\begin{enumerate}\item x \item y\end{enumerate}\input{three}'),
+    # nested input file
+    ('three.tex', r'\subsection{B1}\subsection{B2}'),
+    # definitions (parse everything again)
+    ('two.tex', r'\renewcommand{\thesection}{\Roman{section}}\section{C}'),
+    # main file
+    ('main.tex', r'\input{two}\input{one}\thesection'),
+]
+
+@pytest.mark.parametrize("edit", test_edits)
+def test_reparse(tmp_path, edit):
+    for name, s in test_doc.items():
+        (tmp_path / name).write_text(s)
+    tex_main = str(tmp_path / 'main.tex')
+    p1 = Parser()
+    root1 = p1.parse_file(tex_main)
+    two = next(r.cmd for r in p1.inputs if r.filename.endswith('two.tex')).children[0]
+
+    name, s = edit
+    (tmp_path / name).write_text(s)
+    root1 = p1.reparse(root1, [str(tmp_path / name)])
+    p2 = Parser()
+    root2 = p2.parse_file(tex_main)
+    assert root1.pretty_print() == root2.pretty_print()
+    assert p1.counters == p2.counters
+
+    # the old subtree leaves no gap in the numbers
+    from latextree.parser.parallel import walk
+    ids = sorted(node.serial_number for node in walk([root1]))
+    assert ids == list(range(len(ids))) and p1.node_ids.count == len(ids)
+
+    # files which did not change are not parsed again
+    if name in ['one.tex', 'three.tex']:
+        assert next(r.cmd for r in p1.inputs if r.filename.endswith('two.tex')).children[0] is two
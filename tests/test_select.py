@@ -0,0 +1,85 @@
+# test_select.py
+
+from latextree.parser.parser import Parser
+import pytest
+
+test_doc = {
+    'main.tex': r'''\documentclass{book}
+\newtheorem{theorem}{Theorem}
+\begin{document}
+\chapter{A}\label{ch:a}
+\section{A1} Text with a figure \begin{figure}\caption{x}\end{figure}
+% \chapter{commented out}
+\begin{verbatim}
+\chapter{verbatim}
+\end{verbatim}
+\verb|\section{verb}|
+\newcommand{\hello}[1]{Hi #1}
+{\bf bold \label{x}} \begin{theorem} T \end{theorem}
+\begin{equation} x \end{equation}
+\section*{Starred}
+\input{two}
+\chapter{C}\label{ch:c}
+\section{C1}\label{sec:c1} \hello{C} \begin{figure}\caption{z}\end{figure}
+\begin{theorem} U \end{theorem}\begin{equation} y \end{equation}
+\section{C2} \thesection
+\end{document}''',
+    'two.tex': r'''\chapter{B}
+\section{B1} \begin{figure}\caption{y}\end{figure} \hello{B}
+\section{B2}\label{sec:b2}''',
+}
+
+test_selects = [
+    # select, chapter number, section number
+    ('chapter:1', 1, None),
+    ('chapter:2', 2, None),
+    ('chapter:3', 3, None),
+    ('section:1.1', 1, 1),
+    ('section:2.2', 2, 2),
+    ('section:3.1', 3, 1),
+    ('section:3.2', 3, 2),
+    ('label:ch:c', 3, None),
+    ('label:sec:b2', 2, 2),
+    ('label:sec:c1', 3, 1),
+]
+
+def find(node, species, number):
+    # first numbered node of the given species (depth first)
+    if getattr(node, 'species', None) == species and not node.starred \
+            and node.number == number:
+        return node
+    for child in getattr(node, 'children', None) or []:
+        found = find(child, species, number)
+        if found:
+            return found
+
+@pytest.mark.parametrize("select, chapter, section", test_selects)
+def test_select(tmp_path, select, chapter, section):
+    for name, s in test_doc.items():
+        (tmp_path / name).write_text(s)
+    tex_main = str(tmp_path / 'main.tex')
+    root1 = Parser().parse_file(tex_main)
+    p2 = Parser()
+    root2 = p2.parse_file(tex_main, select=select)
+
+    # the selected block is the same as in a full parse
+    node1 = find(root1, 'chapter', chapter)
+    node2 = find(root2, 'chapter', chapter)
+    if section:
+        node1 = find(node1, 'section', section)
+        node2 = find(node2, 'section', section)
+    assert node1.pretty_print() == node2.pretty_print()
+    assert node1.chars() == node2.chars()
+
+    # other blocks are not parsed
+    assert len(root2.chars()) < len(root1.chars())
+    assert p2.selector is None
+
+def test_select_errors(tmp_path):
+    (tmp_path / 'main.tex').write_text(test_doc['main.tex'])
+    tex_main = str(tmp_path / 'main.tex')
+    for select in ['chapter', 'chapter:x', 'emph:1']:
+        with pytest.raises(Exception):
+            Parser().parse_file(tex_main, select=select)
+    with pytest.raises(Exception):
+        Parser().parse_file(tex_main, select='chapter:1', parallel=True)
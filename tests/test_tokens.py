@@ -14,3 +14,165 @@ def test_stream_equality():
     ts1 = TokenStream(r'\test{123}')
     ts2 = TokenStream(r'\test{123}')
     assert ts1 == ts2
+
+import pytest
+from latextree.parser.tokens import tokenize, tokenize_chars
+
+test_strings = [
+    r'\begin   {document}  \$  3   Hello \textbf   {cruel} world!  \end    {document}',
+    r'pre $\alpha    + \beta$ post',
+    'pre %comment\n\\par\n\n   post',
+    r'Hel\^{o} byd! x^2_{i} a~b \#1 & 50\% \\[2ex]',
+    'caf\u00e9 \u00bd x\u00b2 \\\u00b2a \\na\u00efve\t\r\x7f',
+    'trailing backslash \\',
+]
+
+@pytest.mark.parametrize("test_input", test_strings)
+def test_tokenize(test_input):
+    tokens = tokenize(test_input)
+    assert tokens == tokenize_chars(test_input)
+    chars = ''.join(['\\' + t.value if t.catcode == 0 else t.value for t in tokens])
+    assert chars == test_input
+
+def test_interned():
+    ts1 = tokenize(r'\begin{document} x \begin{document} x')
+    ts2 = tokenize(r'\begin{document} x')
+    assert all([t1 is t2 for (t1,t2) in zip(ts1, ts2[:-1])])
+
+def test_interned_bounded():
+    # the process-wide tables do not grow with the control words and
+    # whitespace of the documents (species names stay interned)
+    from latextree.parser.tokens import COMMANDS, SPACES
+    from latextree.parser.parser import Parser
+    Parser()
+    saved = [(table, dict(table)) for table in (COMMANDS, SPACES)]
+    try:
+        for k in range(COMMANDS.limit + 100):
+            name = 'zz' + ''.join(chr(ord('a') + int(d)) for d in str(k))
+            tokenize('\\' + name + ' ' * (k % 100 + 1) + '\\' + name * 10)
+        assert len(COMMANDS) <= COMMANDS.limit and len(SPACES) <= SPACES.limit
+        assert tokenize(r'\section')[0] is tokenize(r'\section')[0]
+        assert tokenize(r'\zzunseen')[0] == Token(0, 'zzunseen')
+    finally:
+        for table, values in saved:
+            table.clear()
+            table.update(values)
+
+def test_immutable():
+    t = Token(0,'cmd')
+    with pytest.raises(AttributeError):
+        t.value = 'other'
+    assert {t: 1}[Token(0,'cmd')] == 1
+
+@pytest.mark.parametrize("test_input", test_strings)
+def test_stream(test_input, monkeypatch):
+    from latextree.parser.tokens import TextCursor
+    monkeypatch.setattr(TextCursor, 'chunk_size', 7)
+    monkeypatch.setattr(TextCursor, 'seek_size', 3)
+    expected = tokenize(test_input)
+    ts = TokenStream(test_input)
+    tokens = []
+    while ts:
+        assert ts.peek() == expected[len(tokens)]
+        t = ts.pop()
+        assert ts.peek() == (expected[len(tokens) + 1] if len(tokens) + 1 < len(expected) else None)
+        ts.push(t)
+        assert ts.peek() is t
+        tokens.append(ts.pop())
+    assert ts.peek() is None
+    assert tokens == expected
+
+@pytest.mark.parametrize("chunk_size,seek_size", [(7, 3), (5, 2), (1, 1)])
+def test_stream_chunks(chunk_size, seek_size, monkeypatch):
+    # tokens crossing the ends of the chunks scanned by the cursor
+    from latextree.parser.tokens import TextCursor
+    monkeypatch.setattr(TextCursor, 'chunk_size', chunk_size)
+    monkeypatch.setattr(TextCursor, 'seek_size', seek_size)
+    read = TextCursor.read
+    stops = []
+    def read_chunk(self):
+        stops.append(min(self.pos + self.size, self.end))
+        return read(self)
+    monkeypatch.setattr(TextCursor, 'read', read_chunk)
+
+    verbatim = frozenset(['verbatim'])
+    s = 'ab \\textbf {x}%comment\n \\verb|%{| y\\par'
+    expected = tokenize(s, verbatim=verbatim)
+    ts = TokenStream(s, verbatim=verbatim)
+    positions = []
+    tokens = []
+    while ts:
+        position = ts.source_position()
+        if position:
+            positions.append(position[1])
+        tokens.append(ts.pop())
+    assert tokens == expected
+    for word in ['\\textbf ', '%comment\n', '\\verb|%{|']:
+        start = s.index(word)
+        assert any(start < stop < start + len(word) for stop in stops)
+
+    # seek back to each token (short reads after a seek) but the spaces
+    # after control words (scanned with the control word)
+    assert len(positions) == len(expected) - 1
+    for idx, pos in enumerate(positions):
+        if expected[idx].catcode == 16:
+            continue
+        ts = TokenStream(s, verbatim=verbatim)
+        ts.seek(pos)
+        assert list(ts) == expected[idx:]
+
+def test_stream_sources():
+    import io
+    s = 'café \\textbf{bold}'
+    assert list(TokenStream(io.StringIO(s))) == tokenize(s)
+    assert list(TokenStream(io.BytesIO(s.encode('utf-8')))) == tokenize(s)
+    assert list(TokenStream(s.encode('utf-8'))) == tokenize(s)
+
+def test_splice():
+    ts = TokenStream(r'a\x+b', end_token=False)
+    assert ts.pop() == Token(11,'a')
+    assert ts.pop() == Token(0,'x')
+    ts.splice(TokenStream(r'\y{1}'))
+    assert list(ts) == tokenize(r'\y{1}') + tokenize('+b', end_token=False)
+
+@pytest.mark.parametrize("test_input", test_strings)
+def test_columnar(test_input):
+    from latextree.parser.tokens import TokenBuffer
+    columns = TokenBuffer(test_input)
+    assert [columns[i] for i in range(len(columns))] == tokenize(test_input, end_token=False)
+    assert list(TokenStream(test_input, columnar=True)) == tokenize(test_input)
+
+@pytest.mark.parametrize("columnar", [False, True])
+def test_take_text(columnar):
+    ts = TokenStream(r'Hello, world] x\cmd', columnar=columnar)
+    assert ts.take_text() == 'Hello, world] x'
+    assert ts.pop() == Token(0,'cmd')
+    ts = TokenStream(r'Hello, world] x\cmd', columnar=columnar)
+    assert ts.take_text([Token(12,']')]) == 'Hello, world'
+    assert ts.pop() == Token(12,']')
+
+def test_raw():
+    verbatim = frozenset(['verbatim'])
+    s = 'a%b\\c\n\\verb|%|\\begin{verbatim}%\\x\\end{verbatim}%d'
+    tokens = tokenize(s, end_token=False, verbatim=verbatim)
+    assert tokens == [Token(11,'a'), Token(14,'%b\\c\n'), Token(17,'\\verb|%|'),
+                      Token(17,'\\begin{verbatim}%\\x\\end{verbatim}'), Token(14,'%d')]
+    assert list(TokenStream(s, end_token=False, verbatim=verbatim, columnar=True)) == tokens
+
+def test_record():
+    ts = TokenStream(r'\a b{c}d')
+    t = ts.pop()
+    rec = ts.record()
+    assert ts.pop().catcode == 16
+    ts.push(t)              # pushed back tokens are not recorded
+    assert ts.pop() is t
+    assert ts.take_text() == 'b'
+    ts.splice(TokenStream('xy', end_token=False))
+    assert ts.pop() == Token(11,'x')    # nor are tokens of spliced streams
+    assert ts.take_text() == 'y'
+    assert ts.pop() == Token(1,'{')
+    assert ts.stop_record(rec) == tokenize(r'\a b{', end_token=False)[1:]
+
+    rec = ts.record()
+    assert ts.take_group() == 'c'
+    assert ts.stop_record(rec) is None